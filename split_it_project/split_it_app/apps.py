@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SplitItAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'split_it_app'
+
+    def ready(self):
+        # connects the connection_created hook applying the sqlite pragmas.
+        from . import sqlite
@@ -0,0 +1,89 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+# the user fields kept in the cache, enough for the permission checks and the created_by foreign keys.
+CACHED_FIELDS = ('username', 'is_active', 'is_staff', 'is_superuser')
+
+def user_cache_key(user_id):
+    return f'auth-user:{user_id}'
+
+def forget_user(user_id):
+    """ Drops the cached state of the user, the next request reads it from the database again. """
+
+    caches[settings.SPLIT_IT_AUTH_CACHE].delete(user_cache_key(user_id))
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """ JWTAuthentication that builds a lightweight user from the id claim of the token and a cached copy of the user.
+
+    The state of the user is kept in a bounded TTL cache that is dropped whenever the user is saved or deleted,
+    so the common case costs no query at all while deactivated users are still refused.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            return super().get_user(validated_token) # the revocation check needs the password hash of the user
+
+        user_id = self.get_user_id(validated_token)
+        cache = caches[settings.SPLIT_IT_AUTH_CACHE]
+        state = cache.get(user_cache_key(user_id))
+        if state is None:
+            state = self.user_model.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).values_list(*CACHED_FIELDS).first()
+            if state is not None:
+                cache.set(user_cache_key(user_id), state)
+        return self.build_user(user_id, state)
+
+    async def aauthenticate(self, request):
+        """ authenticate for the async views, a cached user is served without leaving the event loop. """
+
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            return await sync_to_async(super().get_user)(validated_token)
+
+        user_id = self.get_user_id(validated_token)
+        cache = caches[settings.SPLIT_IT_AUTH_CACHE]
+        state = await cache.aget(user_cache_key(user_id))
+        if state is None:
+            state = await self.user_model.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).values_list(*CACHED_FIELDS).afirst()
+            if state is not None:
+                await cache.aset(user_cache_key(user_id), state)
+        return self.build_user(user_id, state)
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+    def build_user(self, user_id, state):
+        """ Builds the lightweight user from its cached state, refusing missing and inactive users. """
+
+        if state is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+
+        user = self.user_model(**{api_settings.USER_ID_FIELD: user_id}, **dict(zip(CACHED_FIELDS, state)))
+        user._state.adding = False # it is an existing row, only its other fields are not loaded
+        user._state.db = self.user_model.objects.db
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
+
+class CachedJWTScheme(SimpleJWTScheme):
+    """ Documents CachedJWTAuthentication in the schema as the same bearer JWT scheme. """
+
+    target_class = 'split_it_app.authentication.CachedJWTAuthentication'
@@ -0,0 +1,76 @@
+import random
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from .models import Occasion, Event, Share, ExpenditureSummary, OccasionLedger, PairBalance
+from .splits import split_cents_batch, from_cents
+
+# every generated user logs in with this password, it is hashed once for all of them.
+BENCH_PASSWORD = 'bench-data-password'
+BATCH_SIZE = 5000
+
+def generate(seed=0, users=100, occasions=100, events=10000, settlements=1000, participants=6, standalone=0.1, batch_size=BATCH_SIZE):
+    """ Bulk creates a deterministic data set, the same seed and sizes always give the same rows.
+
+    The events are spread round robin over the occasions, a standalone fraction of them belongs to no occasion.
+    Every settlement clears half of the outstanding share of a utiliser who is not the expender, with a matching
+    expenditure history row. The rows are written in batches so memory stays flat for millions of events, and
+    the occasion ledgers are rebuilt once at the end. Returns the no of rows created per model.
+    """
+
+    rng = random.Random(seed)
+    password = make_password(BENCH_PASSWORD)
+    user_model = get_user_model()
+    created_users = user_model.objects.bulk_create(
+        [user_model(username=f'bench_user{index}', email=f'bench_user{index}@example.com', password=password) for index in range(users)],
+        batch_size=batch_size
+    )
+    usernames = [user.username for user in created_users]
+
+    created_occasions = []
+    for start in range(0, occasions, batch_size):
+        created_occasions += Occasion.objects.bulk_create([
+            Occasion(
+                description=f'bench occasion {index}', participants=rng.sample(usernames, min(participants, len(usernames))),
+                created_by=rng.choice(created_users)
+            )
+            for index in range(start, min(start + batch_size, occasions))
+        ])
+
+    settled = set(rng.sample(range(events), min(settlements, events)))
+    counts = {'users': users, 'occasions': occasions, 'events': events, 'shares': 0, 'settlements': 0}
+    for start in range(0, events, batch_size):
+        batch = []
+        for index in range(start, min(start + batch_size, events)):
+            occasion = created_occasions[index % len(created_occasions)] if created_occasions and rng.random() >= standalone else None
+            people = occasion.participants if occasion is not None else rng.sample(usernames, min(participants, len(usernames)))
+            utiliser = rng.sample(people, rng.randint(min(2, len(people)), len(people)))
+            split_type, split = ('shares', [rng.randint(1, 5) for _ in utiliser]) if rng.random() < 0.25 else ('equal', [])
+            batch.append(Event(
+                description=f'bench event {index}', amount=from_cents(rng.randint(100, 1000000)), expender=rng.choice(utiliser),
+                utiliser=utiliser, split_type=split_type, split=split, occasion=occasion,
+                created_by=occasion.created_by if occasion is not None else rng.choice(created_users)
+            ))
+        batch = Event.objects.bulk_create(batch)
+
+        shares = []
+        history = []
+        splits = split_cents_batch([(event.split_type, event.amount, event.utiliser, event.split) for event in batch])
+        for index, (event, split) in enumerate(zip(batch, splits), start=start):
+            event_shares = event.build_shares(split)
+            shares += event_shares
+            debtors = [share for share in event_shares if share.participant != event.expender and share.owed >= Decimal('0.02')]
+            if index in settled and debtors:
+                share = debtors[0]
+                share.cleared = from_cents(int(share.owed * 100) // 2)
+                history.append(ExpenditureSummary(event=event, user=share.participant, amount=share.cleared))
+        Share.objects.bulk_create(shares, batch_size=batch_size)
+        ExpenditureSummary.objects.bulk_create(history, batch_size=batch_size)
+        counts['shares'] += len(shares)
+        counts['settlements'] += len(history)
+
+    for occasion in created_occasions:
+        OccasionLedger.rebuild(occasion.pk)
+    PairBalance.rebuild()
+
+    return counts
@@ -0,0 +1,123 @@
+import csv
+import io
+import json
+import zlib
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+from .models import Event, ExpenditureSummary, ExpenditureArchive
+
+# the rows are sent in chunks of about this many characters, small enough for a quick first byte.
+FLUSH_SIZE = 64 * 1024
+CSV_COLUMNS = ['record', 'event_id', 'description', 'expender', 'split_type', 'participant', 'amount', 'cleared']
+
+class NDJSONRenderer(BaseRenderer):
+    """ Selected by ?format=ndjson, the export rows are streamed by the view and only error bodies are rendered here. """
+
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode() + b'\n' if data is not None else b''
+
+class CSVRenderer(BaseRenderer):
+    """ Selected by ?format=csv, the export rows are streamed by the view and only error bodies are rendered here. """
+
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        data = data if isinstance(data, dict) else {'message': data}
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(data.keys())
+        writer.writerow(data.values())
+        return buffer.getvalue().encode()
+
+def export_records(occasion_id, chunk_size):
+    """ Yields every event of the occasion with its shares and then every cleared expense, reading chunk_size rows at a time. """
+
+    events = Event.objects.filter(occasion_id=occasion_id).order_by('pk').prefetch_related('shares')
+    for event in events.iterator(chunk_size=chunk_size):
+        yield {
+            'record': 'event',
+            'event_id': event.pk,
+            'description': event.description,
+            'expender': event.expender,
+            'split_type': event.split_type,
+            'amount': str(event.amount),
+            'shares': [
+                {'participant': share.participant, 'owed': str(share.owed), 'cleared': str(share.cleared)}
+                for share in event.shares.all()
+            ],
+        }
+
+    # the archived history is older than the history left, so reading it first keeps the settlements in id order.
+    for model in (ExpenditureArchive, ExpenditureSummary):
+        settlements = (
+            model.objects.filter(event__occasion_id=occasion_id).order_by('pk')
+            .values_list('event_id', 'event__description', 'user', 'amount')
+        )
+        for event_id, description, user, amount in settlements.iterator(chunk_size=chunk_size):
+            yield {'record': 'settlement', 'event_id': event_id, 'description': description, 'participant': user, 'amount': str(amount)}
+
+def ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record) + '\n'
+
+def csv_lines(records):
+    """ Flattens the records to CSV_COLUMNS, the shares of an event follow it as share rows. """
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, CSV_COLUMNS, extrasaction='ignore')
+
+    def take():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    writer.writeheader()
+    yield take()
+    for record in records:
+        writer.writerow(record)
+        for share in record.get('shares', []):
+            writer.writerow({
+                'record': 'share', 'event_id': record['event_id'], 'description': record['description'],
+                'participant': share['participant'], 'amount': share['owed'], 'cleared': share['cleared'],
+            })
+        yield take()
+
+def batched(lines, size=FLUSH_SIZE):
+    """ Joins the lines into byte chunks of about size characters, so the response is not written one row at a time. """
+
+    batch = []
+    length = 0
+    for text in lines:
+        batch.append(text)
+        length += len(text)
+        if length >= size:
+            yield ''.join(batch).encode()
+            batch = []
+            length = 0
+    if batch:
+        yield ''.join(batch).encode()
+
+def gzipped(chunks):
+    """ Compresses the chunks as one gzip stream, flushing after every chunk so the client gets bytes straight away. """
+
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+def export_stream(occasion_id, export_format, compress):
+    """ The byte chunks of the export of the occasion in the given format. """
+
+    chunk_size = settings.SPLIT_IT_EXPORT_CHUNK_SIZE
+    lines = (csv_lines if export_format == 'csv' else ndjson_lines)(export_records(occasion_id, chunk_size))
+    chunks = batched(lines)
+    return gzipped(chunks) if compress else chunks
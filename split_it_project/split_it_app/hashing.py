@@ -0,0 +1,77 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """ pbkdf2_sha256 with the no of iterations of the deployment (SPLIT_IT_PBKDF2_ITERATIONS).
+
+    Hashes made with another count still verify with their own count and are upgraded on the next login.
+    """
+
+    @property
+    def iterations(self):
+        return settings.SPLIT_IT_PBKDF2_ITERATIONS
+
+def verify_password(password, encoded):
+    """ Checks the password against the hash, returns whether it matches and whether the hash should be upgraded. """
+
+    upgrade = []
+    valid = check_password(password, encoded, setter=upgrade.append) # the setter only runs for a valid outdated hash
+    return valid, bool(upgrade)
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = {'message': 'Too many passwords are being checked, please retry.'}
+    default_code = 'busy'
+
+class HashingPool:
+    """ A bounded pool running the password hashing off the request workers.
+
+    At most SPLIT_IT_HASHING_WORKERS hashes run at once and SPLIT_IT_HASHING_QUEUE more may wait, anything beyond
+    that is refused with HashingBusy straight away instead of piling up behind a login burst. Threads are enough as
+    hashlib releases the GIL, a process pool can be chosen where the hasher does not (it relies on fork to inherit
+    the settings).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.slots = None
+
+    def start(self):
+        with self.lock:
+            if self.executor is None:
+                workers = settings.SPLIT_IT_HASHING_WORKERS
+                executor_class = ProcessPoolExecutor if settings.SPLIT_IT_HASHING_EXECUTOR == 'process' else ThreadPoolExecutor
+                self.executor = executor_class(max_workers=workers)
+                self.slots = threading.BoundedSemaphore(workers + settings.SPLIT_IT_HASHING_QUEUE)
+            return self.executor
+
+    def submit(self, function, *args):
+        executor = self.start()
+        if not self.slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            future = executor.submit(function, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    async def run(self, function, *args):
+        """ Runs function(*args) on the pool without blocking the event loop. """
+
+        return await asyncio.wrap_future(self.submit(function, *args))
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+hashing_pool = HashingPool()
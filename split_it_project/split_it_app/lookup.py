@@ -0,0 +1,34 @@
+import hashlib
+
+def description_key(description):
+    """ A signed 64 bit hash of the description, it fits a BigIntegerField and keeps its B-tree index compact. """
+
+    digest = hashlib.blake2b(description.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+def as_id(value):
+    """ Returns the value as a primary key when it is numeric, None when it can only be a description. """
+
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        return int(value)
+    return None
+
+def resolve(queryset, value):
+    """ Gets the object of the queryset from a description or a numeric id.
+
+    Descriptions are looked up through the hashed key index and the description itself is compared as well, so hash
+    collisions can never return the wrong row. A numeric value is only taken as an id when no description matches it,
+    so an occasion named "1" is still found by its name. Raises DoesNotExist or MultipleObjectsReturned like
+    queryset.get.
+    """
+
+    description = str(value)
+    try:
+        return queryset.get(description_key=description_key(description), description=description)
+    except queryset.model.DoesNotExist:
+        pk = as_id(value)
+        if pk is None:
+            raise
+        return queryset.get(pk=pk)
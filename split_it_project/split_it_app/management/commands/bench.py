@@ -0,0 +1,238 @@
+import json
+import math
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from split_it_app import urls
+from split_it_app.benchdata import generate, BENCH_PASSWORD
+from split_it_app.lookup import description_key
+from split_it_app.models import Occasion, Event, Share, ExpenditureSummary, ParticipantLedger, PairBalance
+from split_it_app.views import get_tokens_for_user
+
+# the cached summaries are dropped before every request to these routes, so the computation itself is timed.
+UNCACHED_ROUTES = {'occasion-summary', 'occasion-settle-plan'}
+
+def percentile(timings, fraction):
+    """ The nearest rank percentile of the sorted timings. """
+
+    return timings[max(0, math.ceil(fraction * len(timings)) - 1)]
+
+def compare(results, baseline, threshold):
+    """ The regressions of results against the baseline, a p95 more than threshold slower or any extra query. """
+
+    regressions = []
+    for route, result in results['routes'].items():
+        previous = baseline.get('routes', {}).get(route)
+        if previous is None:
+            continue
+        if result['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append(f'{route}: p95 {result["p95_ms"]:.2f}ms, baseline {previous["p95_ms"]:.2f}ms')
+        if result['queries'] > previous['queries']:
+            regressions.append(f'{route}: {result["queries"]} queries, baseline {previous["queries"]}')
+    return regressions
+
+class Command(BaseCommand):
+    """ Benchmarks every split_it_app route against a generated data set. """
+
+    help = (
+        'Generates a deterministic data set, times every route of split_it_app/urls.py and records the p50/p95/p99 '
+        'latency, the no of queries and the query plans of the key queries as JSON. With --baseline the results are '
+        'compared against an earlier run and the command fails on regressions. All data is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='seed of the data generator.')
+        parser.add_argument('--users', type=int, default=100, help='no of generated users.')
+        parser.add_argument('--occasions', type=int, default=100, help='no of generated occasions.')
+        parser.add_argument('--events', type=int, default=10000, help='no of generated events.')
+        parser.add_argument('--settlements', type=int, default=1000, help='no of generated cleared expenses.')
+        parser.add_argument('--requests', type=int, default=50, help='no of timed requests per route.')
+        parser.add_argument('--routes', nargs='+', help='names of the routes to time, all of them by default.')
+        parser.add_argument('--output', help='file the JSON results are written to, stdout by default.')
+        parser.add_argument('--baseline', help='JSON results of an earlier run to compare against.')
+        parser.add_argument('--threshold', type=float, default=0.2, help='fraction by which a p95 may exceed its baseline.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['requests'] < 1:
+            raise CommandError('--users and --requests must be at least 1.')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            start = time.perf_counter()
+            counts = generate(
+                seed=options['seed'], users=options['users'], occasions=options['occasions'],
+                events=options['events'], settlements=options['settlements']
+            )
+            self.stderr.write(f'Generated {counts} in {time.perf_counter() - start:.1f}s.')
+
+            self.setup_fixtures()
+            results = {
+                'seed': options['seed'],
+                'data': counts,
+                'requests': options['requests'],
+                'routes': self.time_routes(options['routes'], options['requests']),
+                'explain': self.explain(),
+            }
+            transaction.set_rollback(True)
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+        for route, result in results['routes'].items():
+            self.stderr.write(
+                f'{route:>36} p50 {result["p50_ms"]:>9.2f}ms p95 {result["p95_ms"]:>9.2f}ms '
+                f'p99 {result["p99_ms"]:>9.2f}ms {result["queries"]:>4} queries'
+            )
+        if baseline is not None:
+            regressions = compare(results, baseline, options['threshold'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+            self.stderr.write(self.style.SUCCESS('No regressions against the baseline.'))
+
+    def setup_fixtures(self):
+        """ Picks the user the requests are made by, their largest occasion and shares they can clear. """
+
+        self.occasion = Occasion.objects.filter(event_occasions__isnull=False).annotate(
+            total=Sum('event_occasions__amount')
+        ).order_by('-total', 'pk').first() or Occasion.objects.order_by('pk').first()
+        self.user = self.occasion.created_by if self.occasion is not None else get_user_model().objects.get(username='bench_user0')
+        self.shares = list(
+            Share.objects.filter(owed__gte=F('cleared') + 1).exclude(participant=F('event__expender'))
+            .order_by('pk').values_list('event_id', 'participant')[:1000]
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_tokens_for_user(self.user)['access'])
+        self.anonymous = APIClient()
+
+    def route_requests(self):
+        """ The requests timed per route name, as (method, function of the request no returning the response). """
+
+        occasion_id = self.occasion.pk if self.occasion is not None else 0
+        participants = self.occasion.participants if self.occasion is not None else [self.user.username]
+        url = lambda name, **kwargs: reverse(f'split_it_app:{name}', kwargs=kwargs)
+
+        def new_event(index, prefix):
+            return {
+                'description': f'bench {prefix} {index}', 'amount': 100 + index % 1000, 'expender': participants[0],
+                'utiliser': participants, 'split_type': 'equal', 'occasion': str(occasion_id),
+            }
+
+        def clearance(index):
+            event_id, participant = self.shares[index % len(self.shares)] if self.shares else (0, '')
+            return {'event': str(event_id), 'user': participant, 'amount': 0.01}
+
+        def export(index):
+            response = self.client.get(url('occasion-export', pk=occasion_id), {'format': 'ndjson'})
+            if response.streaming:
+                b''.join(response.streaming_content) # the rows are only read while the stream is consumed
+            return response
+
+        return {
+            'register_users': [('POST', lambda index: self.anonymous.post(url('register_users'), {
+                'username': f'bench_register{index}', 'email': f'bench_register{index}@example.com', 'password': BENCH_PASSWORD
+            }, format='json'))],
+            'login_users': [('POST', lambda index: self.anonymous.post(url('login_users'), {
+                'username': self.user.username, 'password': BENCH_PASSWORD
+            }, format='json'))],
+            'register_users_async': [('POST', lambda index: self.anonymous.post(url('register_users_async'), {
+                'username': f'bench_register_async{index}', 'email': f'bench_register_async{index}@example.com', 'password': BENCH_PASSWORD
+            }, format='json'))],
+            'login_users_async': [('POST', lambda index: self.anonymous.post(url('login_users_async'), {
+                'username': self.user.username, 'password': BENCH_PASSWORD
+            }, format='json'))],
+            'get_users': [('GET', lambda index: self.client.get(url('get_users')))],
+            'user-balances': [('GET', lambda index: self.client.get(url('user-balances')))],
+            'occasion-view-create': [
+                ('GET', lambda index: self.client.get(url('occasion-view-create'))),
+                ('POST', lambda index: self.client.post(url('occasion-view-create'), {
+                    'description': f'bench new occasion {index}', 'participants': participants
+                }, format='json')),
+            ],
+            'occasion-summary': [('GET', lambda index: self.client.get(url('occasion-summary', pk=occasion_id)))],
+            'occasion-settle-plan': [('GET', lambda index: self.client.get(url('occasion-settle-plan', pk=occasion_id)))],
+            'occasion-export': [('GET', export)],
+            'event-view-create': [
+                ('GET', lambda index: self.client.get(url('event-view-create'))),
+                ('POST', lambda index: self.client.post(url('event-view-create'), new_event(index, 'new event'), format='json')),
+            ],
+            'event-bulk-create': [('POST', lambda index: self.client.post(url('event-bulk-create'), [
+                new_event(index * 10 + offset, 'bulk event') for offset in range(10)
+            ], format='json'))],
+            'expense-clear': [('POST', lambda index: self.client.post(url('expense-clear'), clearance(index), format='json'))],
+            'expense-clear-batch': [('POST', lambda index: self.client.post(url('expense-clear-batch'), {
+                'entries': [clearance(index * 10 + offset) for offset in range(10)], 'mode': 'best_effort'
+            }, format='json'))],
+        }
+
+    def time_routes(self, selected, requests):
+        """ Times every route of the urlconf, routes without a benchmark request are reported and skipped. """
+
+        route_requests = self.route_requests()
+        summary_cache = caches[settings.SPLIT_IT_SUMMARY_CACHE]
+        results = {}
+        for pattern in urls.urlpatterns:
+            name = pattern.name
+            if selected and name not in selected:
+                continue
+            if name not in route_requests:
+                self.stderr.write(f'No benchmark request for route {name}, skipped.')
+                continue
+
+            for method, request in route_requests[name]:
+                timings = []
+                queries = 0
+                for index in range(requests):
+                    if name in UNCACHED_ROUTES:
+                        summary_cache.clear()
+                    with CaptureQueriesContext(connection) as captured:
+                        start = time.perf_counter()
+                        response = request(index)
+                        timings.append(time.perf_counter() - start)
+                    queries = max(queries, len(captured))
+                    if response.status_code >= 400:
+                        self.stderr.write(f'{method} {name} answered {response.status_code} to request {index}.')
+
+                timings.sort()
+                results[f'{method} {name}'] = {
+                    'p50_ms': percentile(timings, 0.50) * 1000,
+                    'p95_ms': percentile(timings, 0.95) * 1000,
+                    'p99_ms': percentile(timings, 0.99) * 1000,
+                    'mean_ms': sum(timings) / len(timings) * 1000,
+                    'queries': queries,
+                }
+        return results
+
+    def explain(self):
+        """ The query plans of the queries behind the lists, the summary, the settle plan and the lookups. """
+
+        occasion_id = self.occasion.pk if self.occasion is not None else 0
+        queries = {
+            'event list': Event.objects.filter(created_by=self.user).order_by('pk')[:settings.SPLIT_IT_PAGE_SIZE],
+            'occasion list': Occasion.objects.filter(created_by=self.user).order_by('pk')[:settings.SPLIT_IT_PAGE_SIZE],
+            'event shares': Share.objects.filter(event__created_by=self.user).order_by('pk')[:settings.SPLIT_IT_PAGE_SIZE],
+            'event lookup': Event.objects.filter(description_key=description_key('bench event 0'), description='bench event 0'),
+            'ledger summary': ParticipantLedger.objects.filter(occasion_id=occasion_id),
+            'active expense': Share.objects.filter(event__occasion_id=occasion_id).values('participant').annotate(
+                active=Sum(F('owed') - F('cleared'))
+            ),
+            'cleared expense': ExpenditureSummary.cleared_rows(event__occasion_id=occasion_id),
+            'outstanding balances': Share.objects.filter(event__occasion_id=occasion_id).exclude(
+                participant=F('event__expender')
+            ).values('participant').annotate(total=Sum(F('owed') - F('cleared'))),
+            'pair balances': PairBalance.counterparties(self.user.username),
+        }
+        return {name: queryset.explain() for name, queryset in queries.items()}
@@ -0,0 +1,45 @@
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from split_it_app.authentication import CachedJWTAuthentication
+from split_it_app.views import get_tokens_for_user
+
+class Command(BaseCommand):
+    """ Benchmarks CachedJWTAuthentication against the database backed JWTAuthentication. """
+
+    help = 'Times the authentication of bearer tokens with both classes and counts their queries. All data is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10000, help='no of authenticated requests per class.')
+        parser.add_argument('--users', type=int, default=100, help='no of distinct users the requests are spread over.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            users = get_user_model().objects.bulk_create(
+                [get_user_model()(username=f'bench_auth_user{index}') for index in range(options['users'])]
+            )
+            factory = APIRequestFactory()
+            requests = [
+                factory.get('/', HTTP_AUTHORIZATION='Bearer ' + get_tokens_for_user(user)['access'])
+                for user in users
+            ]
+            caches[settings.SPLIT_IT_AUTH_CACHE].clear()
+
+            self.stdout.write(f'{"class":>24} {"time (s)":>10} {"per request (us)":>17} {"queries":>8}')
+            for authentication in [JWTAuthentication(), CachedJWTAuthentication()]:
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    for index in range(options['requests']):
+                        authentication.authenticate(requests[index % len(requests)])
+                    elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f'{type(authentication).__name__:>24} {elapsed:>10.4f} {elapsed / options["requests"] * 1e6:>17.1f} {len(queries):>8}'
+                )
+
+            transaction.set_rollback(True)
@@ -0,0 +1,57 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from split_it_app.views import LoginApi, AsyncLoginApi
+
+class Command(BaseCommand):
+    """ Benchmarks the login throughput of LoginApi against AsyncLoginApi at different concurrency levels. """
+    
+    help = 'Times concurrent logins through the sync and the async login views. The benchmark user is deleted afterwards.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16, 64], help='no of logins in flight at once.')
+        parser.add_argument('--logins', type=int, default=64, help='no of logins per concurrency level and view.')
+        
+    def handle(self, *args, **options):
+        # the user has to be committed, the sync view runs its logins on other threads and connections.
+        user = get_user_model().objects.create_user(username='bench_login_user', password='bench_login_password')
+        body = json.dumps({'username': 'bench_login_user', 'password': 'bench_login_password'})
+        factory = RequestFactory()
+        self.request = lambda: factory.post('/', body, content_type='application/json')
+        
+        try:
+            self.stdout.write(f'pbkdf2 iterations: {settings.SPLIT_IT_PBKDF2_ITERATIONS}, hashing workers: {settings.SPLIT_IT_HASHING_WORKERS}')
+            self.stdout.write(f'{"concurrency":>12} {"sync (logins/s)":>16} {"async (logins/s)":>17} {"async 503s":>11}')
+            for concurrency in options['concurrency']:
+                sync_rate, _ = self.measure(options['logins'], lambda: self.sync_logins(concurrency, options['logins']))
+                async_rate, statuses = self.measure(options['logins'], lambda: asyncio.run(self.async_logins(concurrency, options['logins'])))
+                self.stdout.write(f'{concurrency:>12} {sync_rate:>16.1f} {async_rate:>17.1f} {statuses.count(503):>11}')
+        finally:
+            user.delete()
+            
+    def measure(self, logins, function):
+        start = time.perf_counter()
+        statuses = function()
+        return logins / (time.perf_counter() - start), statuses
+    
+    def sync_logins(self, concurrency, logins):
+        """ Every login holds one of the concurrency worker threads for its whole duration, as WSGI workers do. """
+        
+        view = LoginApi.as_view()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return [response.status_code for response in executor.map(lambda _: view(self.request()), range(logins))]
+        
+    async def async_logins(self, concurrency, logins):
+        view = AsyncLoginApi.as_view()
+        in_flight = asyncio.Semaphore(concurrency)
+        
+        async def login():
+            async with in_flight:
+                return (await view(self.request())).status_code
+            
+        return await asyncio.gather(*[login() for _ in range(logins)])
@@ -0,0 +1,44 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from split_it_app.settlement import settle_plan
+
+class Command(BaseCommand):
+    """ Benchmarks the greedy settlement plan for occasions with many participants. """
+    
+    help = 'Times settle_plan over random zero sum balances of different sizes.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000], help='no of participants in the benchmarked occasions.')
+        parser.add_argument('--repeat', type=int, default=3, help='no of timed runs per size, the best one is reported.')
+        parser.add_argument('--seed', type=int, default=42)
+        
+    def handle(self, *args, **options):
+        generator = random.Random(options['seed'])
+        
+        self.stdout.write(f'{"participants":>12} {"transfers":>10} {"time (s)":>10}')
+        for size in options['sizes']:
+            balances = self.random_balances(generator, size)
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                transfers = settle_plan(balances)
+                timings.append(time.perf_counter() - start)
+                
+            self.check_settled(balances, transfers)
+            self.stdout.write(f'{size:>12} {len(transfers):>10} {min(timings):>10.4f}')
+            
+    def random_balances(self, generator, size):
+        """ Random balances in cents that sum to zero, as the balances of an occasion always do. """
+        
+        cents = [generator.randint(-50000, 50000) for _ in range(size - 1)]
+        cents.append(-sum(cents))
+        return {f'participant{index}': cent / 100 for index, cent in enumerate(cents)}
+    
+    def check_settled(self, balances, transfers):
+        remaining = {participant: round(balance * 100) for participant, balance in balances.items()}
+        for transfer in transfers:
+            remaining[transfer['from']] += round(transfer['amount'] * 100)
+            remaining[transfer['to']] -= round(transfer['amount'] * 100)
+        if any(remaining.values()):
+            self.stderr.write(f'The plan for {len(balances)} participants leaves balances unsettled.')
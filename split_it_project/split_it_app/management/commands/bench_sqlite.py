@@ -0,0 +1,131 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from split_it_app.models import retry_on_locked, DatabaseBusy
+from split_it_app.sqlite import apply_pragmas
+
+PARTICIPANTS = ['alice', 'bob', 'carol', 'dave']
+SCHEMA = [
+    'CREATE TABLE event (id INTEGER PRIMARY KEY, occasion_id INTEGER NOT NULL, amount INTEGER NOT NULL)',
+    'CREATE INDEX event_occasion ON event (occasion_id)',
+    'CREATE TABLE share (id INTEGER PRIMARY KEY, event_id INTEGER NOT NULL, participant TEXT NOT NULL, owed INTEGER NOT NULL, cleared INTEGER NOT NULL)',
+    'CREATE INDEX share_event ON share (event_id)',
+]
+SUMMARY = (
+    'SELECT participant, SUM(owed - cleared) FROM share JOIN event ON event.id = share.event_id '
+    'WHERE event.occasion_id = ? GROUP BY participant'
+)
+
+class Command(BaseCommand):
+    """ Benchmarks concurrent reads and writes on sqlite with the development and the production database profile. """
+
+    help = (
+        'Runs worker threads reading occasion summaries and writing events with settlements against a scratch sqlite '
+        'file, once as the development profile (a new connection per operation, default journal, no retries) and once '
+        'as the production profile (persistent connections, SPLIT_IT_SQLITE_PRODUCTION_PRAGMAS, immediate transactions '
+        'and writes retried on a locked database), and reports the throughput and the failed operations of both.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', nargs='+', type=int, default=[1, 4, 8], help='no of worker threads.')
+        parser.add_argument('--seconds', type=float, default=5, help='duration of every run.')
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='fraction of the operations that write.')
+        parser.add_argument('--occasions', type=int, default=50, help='no of occasions the operations are spread over.')
+        parser.add_argument('--events', type=int, default=20000, help='no of events the database starts with.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"profile":>12} {"threads":>8} {"reads/s":>10} {"writes/s":>10} {"failed":>8}')
+        for threads in options['threads']:
+            for profile in ['development', 'production']:
+                with tempfile.TemporaryDirectory() as directory:
+                    path = os.path.join(directory, 'bench.sqlite3')
+                    self.create_database(path, options['occasions'], options['events'])
+                    reads, writes, failed, elapsed = self.run(path, profile, threads, options)
+                self.stdout.write(f'{profile:>12} {threads:>8} {reads / elapsed:>10.0f} {writes / elapsed:>10.0f} {failed:>8}')
+
+    def create_database(self, path, occasions, events):
+        rng = random.Random(0)
+        connection = sqlite3.connect(path)
+        for statement in SCHEMA:
+            connection.execute(statement)
+        connection.executemany('INSERT INTO event (id, occasion_id, amount) VALUES (?, ?, ?)', [
+            (index, index % occasions, rng.randint(100, 100000)) for index in range(1, events + 1)
+        ])
+        connection.executemany('INSERT INTO share (event_id, participant, owed, cleared) VALUES (?, ?, ?, 0)', [
+            (index, participant, 25) for index in range(1, events + 1) for participant in PARTICIPANTS
+        ])
+        connection.commit()
+        connection.close()
+
+    def connect(self, path, profile):
+        if profile == 'development':
+            return sqlite3.connect(path, isolation_level=None)
+        connection = sqlite3.connect(path, isolation_level=None, timeout=settings.SPLIT_IT_SQLITE_PRODUCTION_PRAGMAS['busy_timeout'] / 1000)
+        apply_pragmas(connection, settings.SPLIT_IT_SQLITE_PRODUCTION_PRAGMAS)
+        return connection
+
+    def run(self, path, profile, threads, options):
+        counts = {'reads': 0, 'writes': 0, 'failed': 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options['seconds']
+
+        def worker(seed):
+            rng = random.Random(seed)
+            persistent = self.connect(path, profile) if profile == 'production' else None
+            reads = writes = failed = 0
+            while time.perf_counter() < deadline:
+                # the development profile opens a connection per operation, like a request without CONN_MAX_AGE.
+                connection = persistent or self.connect(path, profile)
+                occasion_id = rng.randrange(options['occasions'])
+                try:
+                    if rng.random() < options['write_ratio']:
+                        if persistent is not None:
+                            retry_on_locked(lambda: self.write(connection, 'BEGIN IMMEDIATE', occasion_id, rng))
+                        else:
+                            self.write(connection, 'BEGIN', occasion_id, rng)
+                        writes += 1
+                    else:
+                        connection.execute(SUMMARY, (occasion_id,)).fetchall()
+                        reads += 1
+                except (sqlite3.OperationalError, DatabaseBusy):
+                    failed += 1
+                finally:
+                    if persistent is None:
+                        connection.close()
+            if persistent is not None:
+                persistent.close()
+            with lock:
+                counts['reads'] += reads
+                counts['writes'] += writes
+                counts['failed'] += failed
+
+        workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return counts['reads'], counts['writes'], counts['failed'], time.perf_counter() - start
+
+    def write(self, connection, begin, occasion_id, rng):
+        """ Reads the shares of an event, then adds an event with its shares and clears one share, in one transaction. """
+
+        connection.execute(begin)
+        try:
+            event_id = connection.execute('SELECT id FROM event WHERE occasion_id = ? LIMIT 1', (occasion_id,)).fetchone()[0]
+            connection.execute('SELECT participant, owed, cleared FROM share WHERE event_id = ?', (event_id,)).fetchall()
+            new_event = connection.execute('INSERT INTO event (occasion_id, amount) VALUES (?, ?)', (occasion_id, rng.randint(100, 100000))).lastrowid
+            connection.executemany('INSERT INTO share (event_id, participant, owed, cleared) VALUES (?, ?, ?, 0)', [
+                (new_event, participant, 25) for participant in PARTICIPANTS
+            ])
+            connection.execute('UPDATE share SET cleared = cleared + 1 WHERE event_id = ? AND participant = ?', (event_id, rng.choice(PARTICIPANTS)))
+            connection.execute('COMMIT')
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
@@ -0,0 +1,100 @@
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from split_it_app.models import Occasion, Event, Share, ExpenditureSummary
+
+PARTICIPANTS = ['alice', 'bob', 'carol', 'dave', 'erin', 'frank']
+
+def legacy_expenditure_summary(occasion):
+    """ The original python loop implementation of Occasion.get_expenditure_summary, kept for comparison.
+
+    The splits now live in Share, they are prefetched to stand in for the expense_split column the loop used to read.
+    """
+
+    events = occasion.event_occasions.prefetch_related('shares')
+
+    summary = {
+        'occasion': occasion.description,
+        'total_expense': float(sum(event.amount for event in events)),
+        'participants': occasion.participants,
+        'total_no_of_events': len(events),
+        'event_expense': {},
+        'total_individual_expense': {},
+        'cleared_expense': {},
+        'total_active_expense': {},
+    }
+
+    for event in events:
+        for user, amount in event.expense_split.items():
+            summary['total_active_expense'][user] = round(float(summary['total_active_expense'].get(user, 0.0) + amount), 2)
+
+    for event in events:
+        summary['event_expense'][event.description] = round(event.amount, 2)
+
+    cleared_expense = ExpenditureSummary.objects.filter(event__in=events).values("user").annotate(total_cleared=Sum("amount"))
+
+    for user, active_amount in summary['total_active_expense'].items():
+        summary['total_individual_expense'][user] = round(active_amount, 2)
+
+    for expense in cleared_expense:
+        user = expense['user']
+        cleared_amount = expense['total_cleared']
+        summary['total_individual_expense'][user] = round(summary['total_individual_expense'].get(user, 0.0) + float(cleared_amount), 2)
+        summary['cleared_expense'][user] = round(float(cleared_amount), 2)
+
+    return summary
+
+class Command(BaseCommand):
+    """ Benchmarks the python loop summary against the database aggregated one. """
+
+    help = 'Compares the legacy and the SQL aggregated occasion summary for occasions of different sizes. All data is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000], help='no of events in the benchmarked occasions.')
+        parser.add_argument('--repeat', type=int, default=3, help='no of timed runs per implementation, the best one is reported.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            owner = get_user_model().objects.create_user(username='bench_summary_owner')
+
+            self.stdout.write(f'{"events":>10} {"legacy (s)":>12} {"sql (s)":>12} {"speedup":>10}')
+            for size in options['sizes']:
+                occasion = self.create_occasion(owner, size)
+                legacy = self.best_of(options['repeat'], lambda: legacy_expenditure_summary(occasion))
+                aggregated = self.best_of(options['repeat'], occasion.get_expenditure_summary)
+
+                if legacy_expenditure_summary(occasion) != occasion.get_expenditure_summary():
+                    self.stderr.write(f'Summaries differ for {size} events.')
+                self.stdout.write(f'{size:>10} {legacy:>12.4f} {aggregated:>12.4f} {legacy / aggregated:>9.1f}x')
+
+            transaction.set_rollback(True)
+
+    def create_occasion(self, owner, size):
+        """ Bulk creates an occasion with the given no of equally split events and a few cleared expenses. """
+
+        occasion = Occasion.objects.create(description=f'bench summary {size}', participants=PARTICIPANTS, created_by=owner)
+        events = []
+        for index in range(size):
+            utiliser = PARTICIPANTS[:2 + index % (len(PARTICIPANTS) - 1)]
+            amount = 10 + index % 500
+            events.append(Event(
+                description=f'bench event {size}-{index}', amount=amount, expender=utiliser[0], utiliser=utiliser,
+                split_type='equal', occasion=occasion, created_by=owner
+            ))
+        events = Event.objects.bulk_create(events, batch_size=5000)
+        Share.objects.bulk_create([share for event in events for share in event.build_shares()], batch_size=5000)
+        ExpenditureSummary.objects.bulk_create(
+            [ExpenditureSummary(event=event, user=event.utiliser[1], amount=1) for event in events[::10]], batch_size=5000
+        )
+        Share.objects.filter(event__in=events[::10], participant=PARTICIPANTS[1]).update(cleared=1)
+        return occasion
+
+    def best_of(self, repeat, function):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from split_it_app.models import PairBalance
+
+class Command(BaseCommand):
+    """ Checks the pairwise balances against a rebuild from scratch. """
+    
+    help = (
+        'Computes the balance of every (debtor, creditor) pair from the outstanding shares, reports the pairs the '
+        'incrementally maintained table disagrees with, and rebuilds the table with --repair.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='rebuild the table from the shares when it differs.')
+        
+    def handle(self, *args, **options):
+        differences = PairBalance.differences()
+        for (debtor, creditor), (stored, expected) in sorted(differences.items()):
+            self.stdout.write(f'{debtor} owes {creditor}: stored {stored}, expected {expected}')
+            
+        if not differences:
+            self.stdout.write(self.style.SUCCESS('The pairwise balances are consistent.'))
+        elif options['repair']:
+            PairBalance.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt the pairwise balances, {len(differences)} pair(s) differed.'))
+        else:
+            raise CommandError(f'{len(differences)} pair(s) differ, rerun with --repair to rebuild the table.')
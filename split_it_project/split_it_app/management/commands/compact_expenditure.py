@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from split_it_app.models import ExpenditureSummary, ExpenditureSnapshot
+
+class Command(BaseCommand):
+    """ Folds the expenditure history into the snapshot the summaries read. """
+    
+    help = (
+        'Adds the cleared expenses written since the last snapshot to the per (event, user) snapshot totals and moves '
+        'the watermark to the newest history row, so the summaries only sum the history written after it. With '
+        '--archive the folded history rows are moved to the archive table. The snapshot is checked against a full '
+        'scan of the history and the archive, and nothing is saved when they differ.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--archive', action='store_true', help='move the folded history rows to the archive table.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='no of rows written per query.')
+        
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            watermark, folded, archived = ExpenditureSnapshot.compact(archive=options['archive'], batch_size=options['batch_size'])
+            if ExpenditureSummary.cleared_totals() != ExpenditureSummary.full_scan_totals():
+                raise CommandError('The snapshot does not match a full scan of the expenditure history, nothing was saved.')
+            
+        self.stdout.write(self.style.SUCCESS(
+            f'Folded {folded} history row(s) into the snapshot up to id {watermark}, archived {archived} row(s).'
+        ))
@@ -0,0 +1,178 @@
+import csv
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from split_it_app.models import Event
+from split_it_app.serializers import OccasionSerializer, BulkEventSerializer
+from split_it_app.splits import split_cents_batch
+
+# list valued columns of a CSV file hold JSON arrays, e.g. ["alice", "bob"].
+LIST_COLUMNS = ['participants', 'utiliser', 'split']
+
+class Command(BaseCommand):
+    """ Imports occasions and events from a CSV or JSON lines file in chunks, one transaction per chunk. """
+
+    help = (
+        'Streams occasion and event rows (record = occasion or event) from a CSV or JSON lines file, validates them like '
+        'event/bulk/, computes the splits in a process pool and bulk inserts every chunk in its own transaction. '
+        'With --resume the rows committed by a previous run are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='the CSV or JSON lines file to import.')
+        parser.add_argument('--owner', required=True, help='username of the user the imported rows are created by.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='format of the file, taken from its extension when omitted.')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='no of rows inserted per transaction.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='no of processes computing the splits, 1 computes them in this process.')
+        parser.add_argument('--resume', action='store_true', help='continue after the last chunk committed by a previous run.')
+        parser.add_argument('--checkpoint', help='file the no of committed rows is kept in, the path with .checkpoint appended by default.')
+
+    def handle(self, *args, **options):
+        try:
+            owner = get_user_model().objects.get(username=options['owner'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'No such user: {options["owner"]}.')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+
+        export_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'jsonl')
+        checkpoint = options['checkpoint'] or options['path'] + '.checkpoint'
+        committed = self.read_checkpoint(checkpoint) if options['resume'] else 0
+        if committed:
+            self.stdout.write(f'Resuming after {committed} committed rows.')
+
+        self.imported = self.occasions = self.skipped = 0
+        pool = ProcessPoolExecutor(max_workers=options['workers']) if options['workers'] > 1 else None
+        start = time.perf_counter()
+        rows = itertools.islice(self.read_rows(options['path'], export_format), committed, None)
+        try:
+            while True:
+                chunk = list(itertools.islice(rows, options['chunk_size']))
+                if not chunk:
+                    break
+                self.import_chunk(chunk, owner, pool, options['workers'])
+
+                # the checkpoint is only moved once the chunk is committed, a rerun of a chunk finds its events as duplicates.
+                committed += len(chunk)
+                self.write_checkpoint(checkpoint, committed)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f'{committed} rows: {self.imported} events and {self.occasions} occasions imported, {self.skipped} skipped, '
+                    f'{(self.imported + self.occasions + self.skipped) / elapsed:.0f} rows/s'
+                )
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.imported} events and {self.occasions} occasions, skipped {self.skipped} rows '
+            f'in {time.perf_counter() - start:.1f}s.'
+        ))
+
+    def read_rows(self, path, export_format):
+        """ Yields (line, row, error) for every row of the file without reading it all into memory. """
+
+        with open(path, newline='', encoding='utf-8') as file:
+            if export_format == 'csv':
+                reader = csv.DictReader(file)
+                for row in reader:
+                    yield self.parse_csv_row(reader.line_num, row)
+            else:
+                for line, text in enumerate(file, start=1):
+                    if not text.strip():
+                        continue
+                    try:
+                        yield line, json.loads(text), None
+                    except ValueError as error:
+                        yield line, None, f'Invalid JSON: {error}'
+
+    def parse_csv_row(self, line, row):
+        # empty cells are left out so the defaults of the serializers apply.
+        row = {column: value for column, value in row.items() if column and value not in (None, '')}
+        for column in LIST_COLUMNS:
+            if column in row:
+                try:
+                    row[column] = json.loads(row[column])
+                except ValueError:
+                    return line, None, f'{column} must be a JSON array.'
+        return line, row, None
+
+    def import_chunk(self, chunk, owner, pool, workers):
+        with transaction.atomic():
+            events = []
+            for line, row, error in chunk:
+                if error is not None:
+                    self.report(line, error)
+                    continue
+                record = row.pop('record', None) or 'event'
+                if record == 'occasion':
+                    # occasions come first in the transaction, so the events of the same chunk can refer to them.
+                    serializer = OccasionSerializer(data=row)
+                    if serializer.is_valid():
+                        serializer.save(created_by=owner)
+                        self.occasions += 1
+                    else:
+                        self.report(line, serializer.errors)
+                elif record == 'event':
+                    events.append((line, row))
+                else:
+                    self.report(line, f'Unknown record: {record}.')
+
+            validated_data = self.validate_events(events)
+            if validated_data:
+                splits = self.compute_splits(pool, workers, [
+                    (attrs['split_type'], attrs['amount'], attrs['utiliser'], attrs.get('split')) for attrs in validated_data
+                ])
+                Event.bulk_create_with_shares([Event(**attrs, created_by=owner) for attrs in validated_data], splits)
+                self.imported += len(validated_data)
+
+    def validate_events(self, events):
+        """ Validates the events with the rules of event/bulk/, the invalid rows are reported and left out. """
+
+        while events:
+            serializer = BulkEventSerializer(data=[row for _, row in events], many=True, max_length=None)
+            if serializer.is_valid():
+                return serializer.validated_data
+
+            valid = []
+            for (line, row), errors in zip(events, serializer.errors):
+                if errors:
+                    self.report(line, errors)
+                else:
+                    valid.append((line, row))
+            if len(valid) == len(events):
+                for line, _ in events:
+                    self.report(line, serializer.errors)
+                return []
+            events = valid
+        return []
+
+    def compute_splits(self, pool, workers, events):
+        """ split_cents_batch of the events, spread over the processes of the pool. """
+
+        if pool is None:
+            return split_cents_batch(events)
+        size = -(-len(events) // workers)
+        slices = [events[index:index + size] for index in range(0, len(events), size)]
+        return [split for splits in pool.map(split_cents_batch, slices) for split in splits]
+
+    def report(self, line, errors):
+        self.skipped += 1
+        self.stderr.write(f'Row at line {line} skipped: {json.dumps(errors) if not isinstance(errors, str) else errors}')
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as file:
+                return json.load(file)['rows']
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, path, rows):
+        with open(path + '.tmp', 'w') as file:
+            json.dump({'rows': rows}, file)
+        os.replace(path + '.tmp', path)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from split_it_app.models import Occasion, OccasionLedger
+
+class Command(BaseCommand):
+    """ Rebuilds the occasion ledgers from the events and the expenditure history. """
+    
+    help = 'Rebuilds the per occasion and per participant expense ledger from the raw tables.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('occasions', nargs='*', type=int, help='ids of the occasions to rebuild, all occasions when omitted.')
+        
+    def handle(self, *args, **options):
+        occasion_ids = options['occasions'] or list(Occasion.objects.values_list('pk', flat=True))
+        
+        rebuilt = 0
+        for occasion_id in occasion_ids:
+            OccasionLedger.rebuild(occasion_id)
+            rebuilt += 1
+            
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the ledger of {rebuilt} occasion(s).'))
@@ -0,0 +1,43 @@
+import sqlite3
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+from split_it_app.models import ReplicaHeartbeat
+
+def copy_to_replica(path):
+    """ Stamps the heartbeat on the primary, then copies the primary to the sqlite file at path with the backup api. """
+
+    ReplicaHeartbeat.objects.using(DEFAULT_DB_ALIAS).update_or_create(pk=1, defaults={'updated_at': time.time()})
+    primary = connections[DEFAULT_DB_ALIAS]
+    primary.ensure_connection()
+    replica = sqlite3.connect(path)
+    try:
+        primary.connection.backup(replica)
+    finally:
+        replica.close()
+
+class Command(BaseCommand):
+    """ Keeps a local sqlite replica in sync with the primary database. """
+
+    help = (
+        'Copies the primary sqlite database to the replica (SPLIT_IT_REPLICA_DATABASE) every --interval seconds, '
+        'stamping the heartbeat the replica lag is measured with first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1.0, help='seconds between two copies.')
+        parser.add_argument('--once', action='store_true', help='copy once and exit.')
+
+    def handle(self, *args, **options):
+        replica = settings.DATABASES.get(settings.SPLIT_IT_REPLICA_ALIAS)
+        if replica is None or not replica['ENGINE'].endswith('sqlite3'):
+            raise CommandError('No sqlite replica is configured, set SPLIT_IT_REPLICA_DATABASE to the path of the replica file.')
+
+        while True:
+            start = time.perf_counter()
+            copy_to_replica(replica['NAME'])
+            self.stdout.write(f'Copied the primary to {replica["NAME"]} in {time.perf_counter() - start:.3f}s.')
+            if options['once']:
+                break
+            time.sleep(max(0.0, options['interval'] - (time.perf_counter() - start)))
@@ -0,0 +1,222 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+# upper bounds of the histogram buckets, the last bucket (+Inf) is implied.
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+HISTOGRAMS = {
+    'split_it_request_duration_seconds': ('Total time spent in a request per view.', DURATION_BUCKETS),
+    'split_it_db_duration_seconds': ('Time spent executing database queries per request and view.', DURATION_BUCKETS),
+    'split_it_serialization_duration_seconds': ('Time spent rendering the response body per request and view.', DURATION_BUCKETS),
+    'split_it_db_queries': ('No of database queries per request and view.', QUERY_BUCKETS),
+}
+
+class RequestTimings:
+    """ What a single request spent in the database and on rendering its response. """
+
+    __slots__ = ('queries', 'db', 'serialization')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serialization = 0.0
+
+# the timings of the request being served, the context is copied into sync_to_async threads so they are shared.
+current_timings = contextvars.ContextVar('split_it_request_timings', default=None)
+
+def record_query(execute, sql, params, many, context):
+    """ Database execute wrapper timing the queries of instrumented requests, anything else passes straight through. """
+
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - start
+        timings.queries += 1
+
+def install_query_wrapper(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    install_query_wrapper(connection)
+
+class TimedRendererMixin:
+    """ Adds the time spent rendering to the timings of the request. """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        timings = current_timings.get()
+        if timings is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        start = time.perf_counter()
+        try:
+            return super().render(data, accepted_media_type, renderer_context)
+        finally:
+            timings.serialization += time.perf_counter() - start
+
+class MetricsStore:
+    """ Histograms of the requests served by this process, shared with the other workers through SPLIT_IT_METRICS_DIR.
+
+    Every process keeps its own histograms in memory and, at most every SPLIT_IT_METRICS_FLUSH_INTERVAL seconds,
+    writes them to a file of its own in the directory, /metrics adds up the files of all the processes. Without a
+    directory only the histograms of the process answering /metrics are exposed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.flushed = 0.0
+
+    def observe(self, view, total, timings):
+        with self.lock:
+            self.add('split_it_request_duration_seconds', view, total)
+            self.add('split_it_db_duration_seconds', view, timings.db)
+            self.add('split_it_serialization_duration_seconds', view, timings.serialization)
+            self.add('split_it_db_queries', view, timings.queries)
+        if settings.SPLIT_IT_METRICS_DIR and time.monotonic() - self.flushed >= settings.SPLIT_IT_METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def add(self, name, view, value):
+        buckets = HISTOGRAMS[name][1]
+        histogram = self.histograms.get((name, view))
+        if histogram is None:
+            # the counts of every bucket (not cumulative), then the sum of the values.
+            histogram = self.histograms[(name, view)] = [0] * (len(buckets) + 1) + [0.0]
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(buckets)
+        histogram[index] += 1
+        histogram[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {key: list(histogram) for key, histogram in self.histograms.items()}
+
+    def flush(self):
+        """ Atomically replaces the file of this process with its current histograms. """
+
+        self.flushed = time.monotonic()
+        directory = settings.SPLIT_IT_METRICS_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as file:
+            json.dump([[name, view, histogram] for (name, view), histogram in self.snapshot().items()], file)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        """ The histograms of all the processes added up, or of this process without a metrics directory. """
+
+        directory = settings.SPLIT_IT_METRICS_DIR
+        if not directory:
+            return self.snapshot()
+        self.flush()
+        merged = {}
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as file:
+                    rows = json.load(file)
+            except (OSError, ValueError): # a process exiting or writing its file right now
+                continue
+            for name, view, histogram in rows:
+                if name not in HISTOGRAMS:
+                    continue
+                total = merged.setdefault((name, view), [0] * len(histogram))
+                for index, value in enumerate(histogram):
+                    total[index] += value
+        return merged
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+metrics_store = MetricsStore()
+
+def render_metrics(histograms):
+    """ The histograms in the Prometheus text exposition format. """
+
+    lines = []
+    for name, (description, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+        for (histogram_name, view), histogram in sorted(histograms.items()):
+            if histogram_name != name:
+                continue
+            label = view.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip([*buckets, '+Inf'], histogram):
+                cumulative += count
+                lines.append(f'{name}_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{view="{label}"}} {histogram[-1]}')
+            lines.append(f'{name}_count{{view="{label}"}} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+def metrics_view(request):
+    """ Exposes the request histograms of all the worker processes for Prometheus. """
+
+    return HttpResponse(render_metrics(metrics_store.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class RequestMetricsMiddleware:
+    """ Times every request and its database queries and rendering, per view.
+
+    The timings are sent back in a Server-Timing header and added to the histograms of metrics_store. Queries are
+    counted by an execute wrapper on every connection and rendering by the timed renderers, both only do work while a
+    request is being instrumented.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # connections opened before this module was imported missed connection_created.
+        for connection in connections.all(initialized_only=True):
+            install_query_wrapper(connection)
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    def finish(self, request, response, timings, total):
+        match = request.resolver_match
+        metrics_store.observe(match.view_name if match is not None else 'unresolved', total, timings)
+        response['Server-Timing'] = (
+            f'db;dur={timings.db * 1000:.2f};desc="{timings.queries} queries", '
+            f'serialize;dur={timings.serialization * 1000:.2f}, total;dur={total * 1000:.2f}'
+        )
+        return response
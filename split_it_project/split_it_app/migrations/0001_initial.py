@@ -0,0 +1,58 @@
+# Generated by Django 5.1.7 on 2026-10-17 15:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Event',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.TextField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('expender', models.CharField(max_length=200)),
+                ('utiliser', models.JSONField(default=list)),
+                ('split_type', models.CharField(choices=[('equal', 'Equal'), ('unequal', 'Unequal')], max_length=10)),
+                ('split', models.JSONField(blank=True, default=list, null=True)),
+                ('expense_split', models.JSONField(default=dict)),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ExpenditureSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.CharField(max_length=255)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expenditure_history', to='split_it_app.event')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Occasion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.TextField(unique=True)),
+                ('participants', models.JSONField(default=list)),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occasions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='occasion',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='event_occasions', to='split_it_app.occasion'),
+        ),
+        migrations.AddConstraint(
+            model_name='event',
+            constraint=models.UniqueConstraint(fields=('description', 'amount'), name='unique_event'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('split_it_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OccasionLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_expense', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('event_count', models.PositiveIntegerField(default=0)),
+                ('occasion', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='ledger', to='split_it_app.occasion')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ParticipantLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('participant', models.CharField(max_length=255)),
+                ('active_expense', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('cleared_expense', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('occasion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participant_ledgers', to='split_it_app.occasion')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='participantledger',
+            constraint=models.UniqueConstraint(fields=('occasion', 'participant'), name='unique_participant_ledger'),
+        ),
+    ]
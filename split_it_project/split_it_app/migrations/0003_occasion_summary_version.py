@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('split_it_app', '0002_occasionledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='occasion',
+            name='summary_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
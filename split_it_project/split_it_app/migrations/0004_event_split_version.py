@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('split_it_app', '0003_occasion_summary_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='split_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-17 15:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('split_it_app', '0004_event_split_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Share',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('participant', models.CharField(max_length=255)),
+                ('owed', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('cleared', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shares', to='split_it_app.event')),
+            ],
+            options={
+                'ordering': ['pk'],
+                'indexes': [models.Index(fields=['participant', 'event'], name='share_participant_event_idx')],
+                'constraints': [models.UniqueConstraint(fields=('event', 'participant'), name='unique_share')],
+            },
+        ),
+    ]
@@ -0,0 +1,67 @@
+from decimal import Decimal
+from django.db import migrations, transaction
+from django.db.models import Sum
+
+CHUNK_SIZE = 1000
+
+def event_chunks(Event, fields):
+    """ Yields the events in primary key order, CHUNK_SIZE at a time. """
+
+    last_pk = 0
+    while True:
+        chunk = list(Event.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', *fields)[:CHUNK_SIZE])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1][0]
+
+def backfill_shares(apps, schema_editor):
+    """ Creates the shares from expense_split, which only holds the outstanding amounts, and the expenditure history. """
+
+    Event = apps.get_model('split_it_app', 'Event')
+    Share = apps.get_model('split_it_app', 'Share')
+    ExpenditureSummary = apps.get_model('split_it_app', 'ExpenditureSummary')
+
+    for chunk in event_chunks(Event, ['expense_split']):
+        cleared = {
+            (event_id, user): total
+            for event_id, user, total in ExpenditureSummary.objects.filter(event_id__in=[pk for pk, _ in chunk])
+            .values('event_id', 'user').annotate(total=Sum('amount')).values_list('event_id', 'user', 'total')
+        }
+        shares = []
+        for event_id, expense_split in chunk:
+            for participant, outstanding in expense_split.items():
+                cleared_amount = cleared.get((event_id, participant), Decimal('0'))
+                shares.append(Share(
+                    event_id=event_id, participant=participant,
+                    owed=Decimal(str(round(outstanding, 2))) + cleared_amount, cleared=cleared_amount
+                ))
+        with transaction.atomic():
+            Share.objects.bulk_create(shares)
+
+def restore_expense_split(apps, schema_editor):
+    """ Writes the outstanding amounts of the shares back to expense_split. """
+
+    Event = apps.get_model('split_it_app', 'Event')
+    Share = apps.get_model('split_it_app', 'Share')
+
+    for chunk in event_chunks(Event, []):
+        splits = {pk: {} for pk, in chunk}
+        for event_id, participant, owed, cleared in Share.objects.filter(event_id__in=splits).order_by('pk').values_list('event_id', 'participant', 'owed', 'cleared'):
+            splits[event_id][participant] = float(owed - cleared)
+        with transaction.atomic():
+            Event.objects.bulk_update([Event(pk=pk, expense_split=split) for pk, split in splits.items()], ['expense_split'])
+
+
+class Migration(migrations.Migration):
+
+    # every chunk commits on its own so large tables are not backfilled in one transaction.
+    atomic = False
+
+    dependencies = [
+        ('split_it_app', '0005_share'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_shares, restore_expense_split),
+    ]
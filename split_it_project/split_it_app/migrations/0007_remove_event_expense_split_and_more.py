@@ -0,0 +1,21 @@
+# Generated by Django 5.1.7 on 2026-10-17 15:51
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('split_it_app', '0006_backfill_shares'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='event',
+            name='expense_split',
+        ),
+        migrations.RemoveField(
+            model_name='event',
+            name='split_version',
+        ),
+    ]
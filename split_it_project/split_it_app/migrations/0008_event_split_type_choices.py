@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 15:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('split_it_app', '0007_remove_event_expense_split_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='event',
+            name='split_type',
+            field=models.CharField(choices=[('equal', 'Equal'), ('unequal', 'Unequal'), ('percentage', 'Percentage'), ('shares', 'Shares')], max_length=10),
+        ),
+    ]
@@ -0,0 +1,58 @@
+from django.db import migrations, models, transaction
+import split_it_app.models
+from split_it_app.lookup import description_key
+
+CHUNK_SIZE = 1000
+
+def backfill_description_keys(apps, schema_editor):
+    """ Hashes the descriptions of the existing occasions and events, CHUNK_SIZE rows at a time. """
+
+    for model_name in ['Occasion', 'Event']:
+        Model = apps.get_model('split_it_app', model_name)
+        last_pk = 0
+        while True:
+            chunk = list(Model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'description')[:CHUNK_SIZE])
+            if not chunk:
+                break
+            with transaction.atomic():
+                Model.objects.bulk_update(
+                    [Model(pk=pk, description_key=description_key(description)) for pk, description in chunk], ['description_key']
+                )
+            last_pk = chunk[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    # every chunk commits on its own so large tables are not backfilled in one transaction.
+    atomic = False
+
+    dependencies = [
+        ('split_it_app', '0008_event_split_type_choices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='occasion',
+            name='description_key',
+            field=models.BigIntegerField(default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='description_key',
+            field=models.BigIntegerField(default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_description_keys, migrations.RunPython.noop),
+        # the index is built once the keys are filled in.
+        migrations.AlterField(
+            model_name='occasion',
+            name='description_key',
+            field=split_it_app.models.DescriptionKeyField(db_index=True, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='description_key',
+            field=split_it_app.models.DescriptionKeyField(db_index=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.7 on 2026-10-17 17:29
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def backfill_pair_balances(apps, schema_editor):
+    """ Sums the outstanding shares of every (utiliser, expender) pair of the existing events. """
+
+    Share = apps.get_model('split_it_app', 'Share')
+    PairBalance = apps.get_model('split_it_app', 'PairBalance')
+
+    totals = (
+        Share.objects.exclude(participant=F('event__expender')).values('participant', 'event__expender')
+        .annotate(total=Sum(F('owed') - F('cleared'))).values_list('participant', 'event__expender', 'total')
+    )
+    PairBalance.objects.bulk_create(
+        [PairBalance(debtor=debtor, creditor=creditor, amount=total) for debtor, creditor, total in totals if total],
+        batch_size=5000
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('split_it_app', '0010_replicaheartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PairBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('debtor', models.CharField(max_length=255)),
+                ('creditor', models.CharField(max_length=255)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['creditor', 'debtor'], name='pair_balance_creditor_idx')],
+                'constraints': [models.UniqueConstraint(fields=('debtor', 'creditor'), name='unique_pair_balance')],
+            },
+        ),
+        migrations.RunPython(backfill_pair_balances, migrations.RunPython.noop),
+    ]
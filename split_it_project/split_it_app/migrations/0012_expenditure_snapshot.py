@@ -0,0 +1,42 @@
+# Generated by Django 5.1.7 on 2026-10-17 17:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('split_it_app', '0011_pairbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenditureWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('watermark', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ExpenditureArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.CharField(max_length=255)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_expenditure_history', to='split_it_app.event')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ExpenditureSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.CharField(max_length=255)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expenditure_snapshots', to='split_it_app.event')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('event', 'user'), name='unique_expenditure_snapshot')],
+            },
+        ),
+    ]
@@ -1,8 +1,18 @@
+import random
+import time
 from decimal import Decimal
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction, OperationalError
 from django.contrib.auth.models import User as user
-from rest_framework.exceptions import ValidationError
-from django.db.models import Sum
+from rest_framework import status
+from rest_framework.exceptions import ValidationError, APIException
+from .splits import SPLIT_TYPES, split_cents, split_cents_batch, to_cents, from_cents
+from .lookup import description_key, as_id
+from .authentication import forget_user
+from django.db.models import Sum, Count, Max, F, Q, Subquery, Value, prefetch_related_objects
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, pre_delete, post_delete
+from django.dispatch import receiver
 
 # # User Model
 # class User(models.Model):
@@ -12,69 +22,155 @@ from django.db.models import Sum
 #    def __str__(self):
 #       return self.username
 
+class SplitConflict(Exception):
+   """ Raised when the shares of an event changed between reading and writing them. """
+   
+class ExpenseBusy(APIException):
+   status_code = status.HTTP_409_CONFLICT
+   default_detail = {'message': 'The event is being updated by other requests, please retry.'}
+   default_code = 'conflict'
+   
+class DatabaseBusy(APIException):
+   status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+   default_detail = {'message': 'The database is busy, please retry.'}
+   default_code = 'busy'
+   
+def retry_on_conflict(operation, busy=ExpenseBusy):
+   """ Runs operation(retry) until it wins its optimistic update, backing off exponentially with jitter in between.
+   
+   SQLite reports a concurrent writer as a locked database, which is retried the same way as a version conflict.
+   busy is raised once the retries are used up.
+   """
+   
+   backoff = settings.SPLIT_IT_CONFLICT_BACKOFF
+   for attempt in range(settings.SPLIT_IT_CONFLICT_RETRIES):
+      try:
+         return operation(attempt > 0)
+      except OperationalError as error:
+         if 'locked' not in str(error):
+            raise
+      except SplitConflict:
+         pass
+      time.sleep(random.uniform(0, min(backoff * 2 ** attempt, settings.SPLIT_IT_CONFLICT_MAX_BACKOFF)))
+   raise busy()
+
+def retry_on_locked(operation):
+   """ Runs the write operation() again, with the same bounded backoff, while sqlite reports the database as locked. """
+   
+   return retry_on_conflict(lambda retry: operation(), busy=DatabaseBusy)
+
+class DescriptionKeyField(models.BigIntegerField):
+   """ The indexed 64 bit hash of the description, computed on every save and bulk_create. """
+   
+   def __init__(self, *args, **kwargs):
+      kwargs.setdefault('db_index', True)
+      kwargs.setdefault('editable', False)
+      super().__init__(*args, **kwargs)
+      
+   def pre_save(self, model_instance, add):
+      value = description_key(model_instance.description)
+      setattr(model_instance, self.attname, value)
+      return value
+
 # Occasion Model
 class Occasion(models.Model):
    description = models.TextField(unique=True)
+   description_key = DescriptionKeyField()
    participants = models.JSONField(default=list)
    created_by = models.ForeignKey(user, related_name='occasions', on_delete=models.CASCADE)
+   summary_version = models.PositiveIntegerField(default=0)
       
    def __str__(self):
       return self.description
    
+   @classmethod
+   def bump_summary_version(cls, *occasion_ids):
+      """ Marks the cached expenditure summaries of the occasions as stale. """
+      
+      occasion_ids = {occasion_id for occasion_id in occasion_ids if occasion_id is not None}
+      if occasion_ids:
+         cls.objects.filter(pk__in=occasion_ids).update(summary_version=F('summary_version') + 1)
+   
    def get_expenditure_summary(self):
-      """ Generates the expenditure summary for the occasion. """
+      """ Generates the expenditure summary for the occasion, aggregating the events in the database. """
       
       events = self.event_occasions.all()
+      totals = events.aggregate(total_expense=Sum('amount'), total_no_of_events=Count('pk'))
       
       summary = {
          'occasion': self.description,
-         'total_expense': float(sum(event.amount for event in events)),
+         'total_expense': float(totals['total_expense'] or 0),
          'participants': self.participants,
-         'total_no_of_events': len(events),
-         'event_expense': {},
+         'total_no_of_events': totals['total_no_of_events'],
+         'event_expense': dict(events.values_list('description', 'amount')),
          'total_individual_expense': {},
          'cleared_expense': {},
          'total_active_expense': {},
       }
       
-      for event in events:
-         for user, amount in event.expense_split.items():
-            summary['total_active_expense'][user] =  round(float(summary['total_active_expense'].get(user, 0.0) + amount), 2)
-      
-      for event in events:
-            summary['event_expense'][event.description] = round(event.amount, 2)
+      for user, active_amount in Event.active_expense_by_participant(self.pk).items():
+         summary['total_active_expense'][user] = round(float(active_amount), 2)
+         summary['total_individual_expense'][user] = round(float(active_amount), 2)
+         
+      # sums the cleared amount by user, from the latest snapshot and the history written after it.
+      for user, total_cleared in ExpenditureSummary.cleared_totals(event__occasion=self).items():
+         cleared_amount = float(total_cleared)
+         summary['total_individual_expense'][user] = round(summary['total_individual_expense'].get(user, 0.0) + cleared_amount, 2)
+         summary['cleared_expense'][user] = round(cleared_amount, 2)
             
-      cleared_expense = (
-         ExpenditureSummary.objects.filter(event__in=events).values("user").annotate(total_cleared=Sum("amount")) # sums the cleared amount by user
-      )
+      return summary
+   
+   def get_balances(self):
+      """ Net balance of every participant, what others still owe them for the events they paid minus what they still owe. """
       
-      for user, active_amount in summary['total_active_expense'].items():
-         summary['total_individual_expense'][user] = round(active_amount, 2)
-         
-         
-      for expense in cleared_expense:
-         user = expense['user']
-         cleared_amount = expense['total_cleared']
-         summary['total_individual_expense'][user] = round(summary['total_individual_expense'].get(user, 0.0) + float(cleared_amount), 2)
-         
-      for expense in cleared_expense:
-         user = expense['user']
-         cleared_amount = expense['total_cleared']
-         summary['cleared_expense'][user] = round(float(cleared_amount), 2)
+      outstanding = Share.objects.filter(event__occasion=self).exclude(participant=F('event__expender'))
+      owed = Sum(F('owed') - F('cleared'))
+      
+      balances = {}
+      for creditor, amount in outstanding.values('event__expender').annotate(total=owed).values_list('event__expender', 'total'):
+         balances[creditor] = balances.get(creditor, Decimal('0')) + amount
+      for debtor, amount in outstanding.values('participant').annotate(total=owed).values_list('participant', 'total'):
+         balances[debtor] = balances.get(debtor, Decimal('0')) - amount
+      return balances
+   
+   def get_ledger_summary(self):
+      """ Generates the expenditure summary from the occasion ledger, falls back to a full rebuild when no ledger exists. """
+      
+      try:
+         ledger = self.ledger
+      except OccasionLedger.DoesNotExist:
+         return self.get_expenditure_summary()
+      
+      summary = {
+         'occasion': self.description,
+         'total_expense': float(ledger.total_expense),
+         'participants': self.participants,
+         'total_no_of_events': ledger.event_count,
+         'event_expense': dict(self.event_occasions.values_list('description', 'amount')),
+         'total_individual_expense': {},
+         'cleared_expense': {},
+         'total_active_expense': {},
+      }
+      
+      for row in self.participant_ledgers.all():
+         summary['total_active_expense'][row.participant] = round(float(row.active_expense), 2)
+         summary['total_individual_expense'][row.participant] = round(float(row.active_expense + row.cleared_expense), 2)
+         if row.cleared_expense:
+            summary['cleared_expense'][row.participant] = round(float(row.cleared_expense), 2)
             
       return summary
       
 # Event Model
 class Event(models.Model):
    description = models.TextField()
+   description_key = DescriptionKeyField()
    amount = models.DecimalField(max_digits=20, decimal_places=2)
    expender = models.CharField(max_length=200)
    utiliser = models.JSONField(default=list)
    created_by = models.ForeignKey(user, related_name='events', on_delete=models.CASCADE)
-   split_type = models.CharField(max_length=10, choices=[('equal', 'Equal'), ('unequal', 'Unequal')])
+   split_type = models.CharField(max_length=10, choices=SPLIT_TYPES)
    occasion = models.ForeignKey(Occasion, related_name="event_occasions", on_delete=models.SET_NULL, null=True, blank=True)
    split = models.JSONField(default=list, null=True, blank=True)
-   expense_split = models.JSONField(default=dict)
    
    class Meta:
       constraints = [
@@ -84,42 +180,612 @@ class Event(models.Model):
    def __str__(self):
       return self.description
    
+   @property
+   def expense_split(self) -> dict:
+      """ The outstanding amount of every participant, derived from the shares of the event. """
+      
+      return {share.participant: float(share.owed - share.cleared) for share in self.shares.all()}
+   
+   @classmethod
+   def active_expense_by_participant(cls, occasion_id):
+      """ Sums the outstanding shares of every participant over the events of the occasion. """
+      
+      return dict(
+         Share.objects.filter(event__occasion_id=occasion_id).values('participant')
+         .annotate(active=Sum(F('owed') - F('cleared'))).values_list('participant', 'active')
+      )
+   
+   def calculate_split_cents(self):
+      """ Calculates the split of every utiliser in integer cents, the parts always add up to the amount. """
+      
+      return split_cents(self.split_type, self.amount, self.utiliser, self.split)
+   
    def calculate_split(self):
-      """ Calculates the split based on the no of utilisers. """
+      """ Calculates the split of every utiliser as exact amounts. """
+      
+      return {participant: from_cents(cents) for participant, cents in self.calculate_split_cents().items()}
       
-      if self.split_type == 'equal':
-         split_amount = float(self.amount) /len(self.utiliser)
-         return { participant: round(float(split_amount), 2) for participant in self.utiliser}
+   def build_shares(self, split=None):
+      """ Builds the unsaved shares of the event from its split in cents, computed here when not given. """
       
-      elif self.split_type == 'unequal':
-         return { participant: round(float(split_amount), 2) for participant, split_amount in zip(self.utiliser, self.split)}
+      split = self.calculate_split_cents() if split is None else split
+      return [Share(event=self, participant=participant, owed=from_cents(cents)) for participant, cents in split.items()]
+   
+   @classmethod
+   def bulk_create_with_shares(cls, events, splits=None):
+      """ Inserts the unsaved events and then all their shares, keeping the ledgers and caches in step, in the caller's transaction.
+      
+      splits are the cents of every event as computed by split_cents_batch, they are computed here when not given.
+      """
+      
+      events = cls.objects.bulk_create(events)
+      if splits is None:
+         splits = split_cents_batch([(event.split_type, event.amount, event.utiliser, event.split) for event in events])
+      Share.objects.bulk_create([share for event, split in zip(events, splits) for share in event.build_shares(split)])
+      prefetch_related_objects(events, 'shares')
+      OccasionLedger.apply_events(events)
+      PairBalance.apply_events(events)
+      Occasion.bump_summary_version(*{event.occasion_id for event in events})
+      return events
+   
+   def forget_shares(self):
+      """ Drops the prefetched shares so the next read of expense_split sees the database. """
+      
+      getattr(self, '_prefetched_objects_cache', {}).pop('shares', None)
       
    def save(self, *args, **kwargs):
-      super(Event, self).save(*args, **kwargs)
-      self.expense_split = self.calculate_split()
-      super(Event, self).save(update_fields=['expense_split'])
+      with transaction.atomic():
+         previous = None
+         if not self._state.adding:
+            previous = Event.objects.filter(pk=self.pk).only('occasion', 'amount', 'expender').prefetch_related('shares').first()
+            
+         super(Event, self).save(*args, **kwargs)
+         
+         # saving an event always starts its split afresh.
+         if previous is not None:
+            Share.objects.filter(event=self).delete()
+         Share.objects.bulk_create(self.build_shares())
+         self.forget_shares()
+         prefetch_related_objects([self], 'shares') # read once for both ledgers
+         
+         # keeping the occasion ledger and the pairwise balances in step with the saved event.
+         OccasionLedger.apply_events([self], removed=[previous] if previous else [])
+         PairBalance.apply_events([self], removed=[previous] if previous else [])
+         Occasion.bump_summary_version(self.occasion_id, previous.occasion_id if previous else None)
+      
+   def apply_clearance(self, user, amount):
+      """ clears the expense of the user on the in-memory shares of the event and returns the share, nothing is saved. """
+      
+      share = next((share for share in self.shares.all() if share.participant == user), None)
+      if share is not None:
+         amount = clearance_amount(amount)
+         outstanding = share.owed - share.cleared
+         if amount <= outstanding:
+            share.cleared += amount
+            return share
+         elif outstanding == Decimal("0.00"):
+            raise ValidationError({'message': f'Expense for this event is already cleared.'})
+         else:
+            raise ValidationError({'message': f'Amount provided is greater than expense split for user: {user}'})
+      return None
       
    def clear_expense(self, user, amount):
       """ clears the expense of the user for the provided event. """
       
-      if user in self.expense_split:
-         if amount <= self.expense_split[user]:
-            updated_expense_split = self.expense_split.copy()
-            updated_expense_split[user] = updated_expense_split[user] - float(amount)
-            self.expense_split = updated_expense_split
-            super(Event, self).save(update_fields=['expense_split'])
+      def clear(retry):
+         cleared_amount = clearance_amount(amount)
+         with transaction.atomic():
+            # checking and clearing in one statement, concurrent settlements can never overdraw a share.
+            updated = Share.objects.filter(event=self, participant=user, owed__gte=F('cleared') + cleared_amount).update(
+               cleared=F('cleared') + cleared_amount
+            )
+            if not updated:
+               share = Share.objects.filter(event=self, participant=user).first()
+               if share is None:
+                  return False
+               elif share.owed == share.cleared:
+                  raise ValidationError({'message': f'Expense for this event is already cleared.'})
+               else:
+                  raise ValidationError({'message': f'Amount provided is greater than expense split for user: {user}'})
             
             # adding log that this expense is cleared.
-            ExpenditureSummary.objects.create(event=self, user=user, amount=amount)
+            ExpenditureSummary.objects.create(event=self, user=user, amount=cleared_amount)
             
-            return True
-         elif Decimal(str(self.expense_split[user])) == Decimal("0.00"):
-            raise ValidationError({'message': f'Expense for this event is already cleared.'})
-         else:
-            raise ValidationError({'message': f'Amount provided is greater than expense split for user: {user}'})
-      return False   
+            if self.occasion_id is not None:
+               OccasionLedger.record_clearance(self.occasion_id, user, cleared_amount)
+               Occasion.bump_summary_version(self.occasion_id)
+            PairBalance.record_clearances([(user, self.expender, cleared_amount)])
+               
+         self.forget_shares()
+         return True
+      
+      return retry_on_conflict(clear)
+   
+   @classmethod
+   def clear_expenses(cls, entries, all_or_nothing=True):
+      """ clears a batch of {event, user, amount} entries, every affected event is locked once and every share written once.
+      
+      Returns the per entry results and whether the cleared entries were saved. In all or nothing mode a
+      single failing entry discards the whole batch, otherwise only the failing entries are skipped.
+      """
+      
+      return retry_on_conflict(lambda retry: cls._clear_expenses(entries, all_or_nothing))
+   
+   @classmethod
+   def _clear_expenses(cls, entries, all_or_nothing):
+      with transaction.atomic():
+         # events are named by id or description, both are resolved through indexes in one query.
+         names = {str(entry['event']) for entry in entries}
+         ids = {as_id(name) for name in names} - {None}
+         queryset = cls.objects.select_for_update().filter(
+            Q(pk__in=ids) | Q(description_key__in={description_key(name) for name in names})
+         ).prefetch_related('shares')
+         events = {}
+         for event in queryset:
+            if event.description in names:
+               events.setdefault(event.description, []).append(event)
+         by_id = {event.pk: event for event in queryset}
+         for name in names:
+            if name not in events and as_id(name) in by_id: # an id only when no description matches
+               events[name] = [by_id[as_id(name)]]
+            
+         results = []
+         cleared = []
+         original = {}
+         for entry in entries:
+            event_name, user, amount = entry['event'], entry['user'], entry['amount']
+            result = {'event': event_name, 'user': user, 'amount': amount, 'cleared': False}
+            results.append(result)
+            
+            matches = events.get(event_name, [])
+            if not matches:
+               result['message'] = 'Provided event does not exist.'
+               continue
+            if len(matches) > 1:
+               result['message'] = f'Multiple events found with name: {event_name}.'
+               continue
+            
+            event = matches[0]
+            original.update({share.pk: share.cleared for share in event.shares.all() if share.pk not in original})
+            try:
+               share = event.apply_clearance(user, amount)
+            except ValidationError as error:
+               result['message'] = str(error.detail['message'])
+               continue
+            if share is None:
+               result['message'] = f'No such user: {user} found for event: {event_name}.'
+               continue
+            
+            result.update(cleared=True, message=f'Updated expense for user: {user} for event: {event_name}.')
+            cleared.append((event, share, to_decimal(amount)))
+            
+         failed = any(not result['cleared'] for result in results)
+         if failed and all_or_nothing:
+            for result in results:
+               if result['cleared']:
+                  result.update(cleared=False, message='Not applied as another entry of the batch failed.')
+            return results, False
+         if not cleared:
+            return results, False
+         
+         for share in {share.pk: share for _, share, _ in cleared}.values():
+            # select_for_update already serializes the batch where the database supports it, the compare and set covers sqlite.
+            updated = Share.objects.filter(pk=share.pk, cleared=original[share.pk]).update(cleared=share.cleared)
+            if not updated:
+               raise SplitConflict()
+         ExpenditureSummary.objects.bulk_create(
+            [ExpenditureSummary(event=event, user=share.participant, amount=amount) for event, share, amount in cleared]
+         )
+         OccasionLedger.record_clearances(
+            [(event.occasion_id, share.participant, amount) for event, share, amount in cleared if event.occasion_id is not None]
+         )
+         Occasion.bump_summary_version(*{event.occasion_id for event, _, _ in cleared})
+         PairBalance.record_clearances([(share.participant, event.expender, amount) for event, share, amount in cleared])
+         
+         for result, (event, _, _) in zip([result for result in results if result['cleared']], cleared):
+            result['updated_expense'] = event.expense_split
+         return results, True
+   
+# Share Model
+class Share(models.Model):
+   """ The part of an event owed by a participant and how much of it is cleared, expense_split is derived from it. """
+   
+   event = models.ForeignKey(Event, related_name='shares', on_delete=models.CASCADE)
+   participant = models.CharField(max_length=255)
+   owed = models.DecimalField(max_digits=20, decimal_places=2)
+   cleared = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+   
+   class Meta:
+      ordering = ['pk']
+      constraints = [
+         # also serves as the (event, participant) index.
+         models.UniqueConstraint(fields=['event', 'participant'], name='unique_share')
+      ]
+      indexes = [
+         models.Index(fields=['participant', 'event'], name='share_participant_event_idx')
+      ]
+      
+   def __str__(self):
+      return f'{self.participant} in {self.event_id}'
    
 class ExpenditureSummary(models.Model):
+   """ The append only history of cleared expenses, ExpenditureSnapshot.compact folds it into snapshot totals up to a watermark id. """
+   
    event = models.ForeignKey(Event, related_name='expenditure_history', on_delete=models.CASCADE)
    user = models.CharField(max_length=255)
-   amount = models.DecimalField(max_digits=20, decimal_places=2)
\ No newline at end of file
+   amount = models.DecimalField(max_digits=20, decimal_places=2)
+   
+   @classmethod
+   def cleared_rows(cls, **filters):
+      """ The (user, total) cleared in the latest snapshot and in the history after its watermark, in one query.
+      
+      The filters apply to both, they are lookups on their event (e.g. event__occasion_id). A user can have a row of each.
+      """
+      
+      watermark = Coalesce(Subquery(ExpenditureWatermark.objects.filter(pk=1).values('watermark')[:1]), Value(0))
+      snapshot = ExpenditureSnapshot.objects.filter(**filters).values('user').annotate(total=Sum('amount')).values_list('user', 'total')
+      recent = cls.objects.filter(**filters).filter(pk__gt=watermark).values('user').annotate(total=Sum('amount')).values_list('user', 'total')
+      return snapshot.union(recent, all=True)
+   
+   @classmethod
+   def cleared_totals(cls, **filters):
+      """ The amount cleared by every user, ordered by user. """
+      
+      totals = {}
+      for user, amount in cls.cleared_rows(**filters):
+         totals[user] = totals.get(user, Decimal('0')) + amount
+      return dict(sorted(totals.items()))
+   
+   @classmethod
+   def full_scan_totals(cls, **filters):
+      """ cleared_totals summed over every history row instead, the archived ones included. """
+      
+      totals = {}
+      for model in (ExpenditureArchive, cls):
+         for user, amount in model.objects.filter(**filters).values('user').annotate(total=Sum('amount')).values_list('user', 'total'):
+            totals[user] = totals.get(user, Decimal('0')) + amount
+      return dict(sorted(totals.items()))
+
+# Expenditure Snapshot Model
+class ExpenditureSnapshot(models.Model):
+   """ The amount cleared by a user on an event over the history rows up to the watermark of ExpenditureWatermark. """
+   
+   event = models.ForeignKey(Event, related_name='expenditure_snapshots', on_delete=models.CASCADE)
+   user = models.CharField(max_length=255)
+   amount = models.DecimalField(max_digits=20, decimal_places=2)
+   
+   class Meta:
+      constraints = [
+         models.UniqueConstraint(fields=['event', 'user'], name='unique_expenditure_snapshot')
+      ]
+      
+   def __str__(self):
+      return f'{self.user} in {self.event_id}'
+   
+   @classmethod
+   def compact(cls, archive=False, batch_size=5000):
+      """ Folds the history written since the last watermark into the snapshot and moves the watermark to the newest row.
+      
+      With archive the folded history rows are moved to ExpenditureArchive. Ids are never reused (sqlite tables get
+      AUTOINCREMENT), so every row written later is above the watermark. Returns the watermark and the no of rows folded
+      and archived.
+      """
+      
+      with transaction.atomic():
+         state, _ = ExpenditureWatermark.objects.select_for_update().get_or_create(pk=1)
+         newest = ExpenditureSummary.objects.aggregate(newest=Max('pk'))['newest'] or 0
+         folded = 0
+         if newest > state.watermark:
+            deltas = {}
+            for event_id, user, total, count in (
+               ExpenditureSummary.objects.filter(pk__gt=state.watermark, pk__lte=newest).values('event_id', 'user')
+               .annotate(total=Sum('amount'), count=Count('pk')).values_list('event_id', 'user', 'total', 'count')
+            ):
+               deltas.setdefault(event_id, {})[user] = total
+               folded += count
+               
+            event_ids = sorted(deltas)
+            for start in range(0, len(event_ids), batch_size):
+               chunk = event_ids[start:start + batch_size]
+               existing = {(row.event_id, row.user): row for row in cls.objects.filter(event_id__in=chunk)}
+               updated = []
+               created = []
+               for event_id in chunk:
+                  for user, total in deltas[event_id].items():
+                     row = existing.get((event_id, user))
+                     if row is None:
+                        created.append(cls(event_id=event_id, user=user, amount=total))
+                     else:
+                        row.amount += total
+                        updated.append(row)
+               cls.objects.bulk_update(updated, ['amount'], batch_size=batch_size)
+               cls.objects.bulk_create(created, batch_size=batch_size)
+               
+            state.watermark = newest
+            state.save(update_fields=['watermark'])
+            
+         archived = 0
+         history = ExpenditureSummary.objects.filter(pk__lte=state.watermark).order_by('pk').values_list('pk', 'event_id', 'user', 'amount')
+         while archive and (rows := list(history[:batch_size])):
+            ExpenditureArchive.objects.bulk_create(
+               [ExpenditureArchive(pk=pk, event_id=event_id, user=user, amount=amount) for pk, event_id, user, amount in rows]
+            )
+            ExpenditureSummary.objects.filter(pk__lte=rows[-1][0]).delete()
+            archived += len(rows)
+            
+      return state.watermark, folded, archived
+   
+# Expenditure Watermark Model
+class ExpenditureWatermark(models.Model):
+   """ A single row with the id of the newest history row folded into ExpenditureSnapshot. """
+   
+   watermark = models.BigIntegerField(default=0)
+   
+   def __str__(self):
+      return f'Snapshot up to {self.watermark}'
+   
+# Expenditure Archive Model
+class ExpenditureArchive(models.Model):
+   """ The ExpenditureSummary rows moved out of the history after they were folded into the snapshot, with their ids. """
+   
+   event = models.ForeignKey(Event, related_name='archived_expenditure_history', on_delete=models.CASCADE)
+   user = models.CharField(max_length=255)
+   amount = models.DecimalField(max_digits=20, decimal_places=2)
+
+def to_decimal(value):
+   """ Converts the float/int/str amounts coming from requests and splits to exact cents without binary float noise. """
+   
+   return from_cents(to_cents(value))
+
+def clearance_amount(value):
+   """ The amount of a clearance in exact cents, only a positive amount of whole cents clears anything. """
+   
+   try:
+      amount = to_decimal(value)
+      exact = Decimal(str(value)) == amount
+   except (TypeError, ValueError, ArithmeticError):
+      raise ValidationError({'message': 'Amount must be a number.'})
+   if not exact:
+      raise ValidationError({'message': 'Amount can have at most 2 decimal places.'})
+   if amount <= 0:
+      raise ValidationError({'message': 'Amount must be greater than zero.'})
+   return amount
+
+# Occasion Ledger Model
+class OccasionLedger(models.Model):
+   """ Denormalized running totals of an occasion, maintained by Event.save and Event.clear_expense. """
+   
+   occasion = models.OneToOneField(Occasion, related_name='ledger', on_delete=models.CASCADE)
+   total_expense = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+   event_count = models.PositiveIntegerField(default=0)
+   
+   def __str__(self):
+      return f'Ledger of {self.occasion_id}'
+   
+   @classmethod
+   def apply_events(cls, events, removed=()):
+      """ Adds the contribution of the events to their occasion ledgers and subtracts the removed ones. """
+      
+      totals = {}
+      shares = {}
+      for sign, group in ((1, events), (-1, removed)):
+         for event in group:
+            if event.occasion_id is None:
+               continue
+            total, count = totals.get(event.occasion_id, (Decimal('0'), 0))
+            totals[event.occasion_id] = (total + sign * to_decimal(event.amount), count + sign)
+            for participant, amount in event.expense_split.items():
+               key = (event.occasion_id, participant)
+               shares[key] = shares.get(key, Decimal('0')) + sign * to_decimal(amount)
+               
+      for occasion_id, (total, count) in totals.items():
+         updated = cls.objects.filter(occasion_id=occasion_id).update(
+            total_expense=F('total_expense') + total, event_count=F('event_count') + count
+         )
+         if not updated:
+            # no ledger yet for this occasion, the raw tables already hold the saved events so rebuild from them.
+            cls.rebuild(occasion_id)
+            shares = {key: amount for key, amount in shares.items() if key[0] != occasion_id}
+            
+      ParticipantLedger.objects.bulk_create(
+         [ParticipantLedger(occasion_id=occasion_id, participant=participant) for occasion_id, participant in shares],
+         ignore_conflicts=True
+      )
+      for (occasion_id, participant), amount in shares.items():
+         ParticipantLedger.objects.filter(occasion_id=occasion_id, participant=participant).update(
+            active_expense=F('active_expense') + amount
+         )
+      # a participant only part of the removed events leaves the summary with them.
+      for event in removed:
+         if event.occasion_id is not None:
+            ParticipantLedger.objects.filter(
+               occasion_id=event.occasion_id, participant__in=list(event.expense_split), active_expense=0, cleared_expense=0
+            ).delete()
+   
+   @classmethod
+   def record_clearance(cls, occasion_id, participant, amount):
+      """ Moves the cleared amount of the participant from active to cleared expense. """
+      
+      cls.record_clearances([(occasion_id, participant, amount)])
+      
+   @classmethod
+   def record_clearances(cls, clearances):
+      """ Moves the cleared amounts of a batch of (occasion, participant, amount) from active to cleared expense. """
+      
+      totals = {}
+      for occasion_id, participant, amount in clearances:
+         totals[(occasion_id, participant)] = totals.get((occasion_id, participant), Decimal('0')) + to_decimal(amount)
+         
+      rebuilt = set()
+      for (occasion_id, participant), amount in totals.items():
+         if occasion_id in rebuilt:
+            continue
+         updated = ParticipantLedger.objects.filter(occasion_id=occasion_id, participant=participant).update(
+            active_expense=F('active_expense') - amount, cleared_expense=F('cleared_expense') + amount
+         )
+         if not updated:
+            # the expenditure history is already saved, so the rebuild accounts for the whole batch of the occasion.
+            cls.rebuild(occasion_id)
+            rebuilt.add(occasion_id)
+   
+   @classmethod
+   def rebuild(cls, occasion_id):
+      """ Rebuilds the ledger of the occasion from the events and the expenditure history. """
+      
+      with transaction.atomic():
+         totals = Event.objects.filter(occasion_id=occasion_id).aggregate(total=Sum('amount'), count=Count('pk'))
+         total = totals['total'] or Decimal('0')
+         count = totals['count']
+         active = Event.active_expense_by_participant(occasion_id)
+         
+         cleared = ExpenditureSummary.cleared_totals(event__occasion_id=occasion_id)
+         
+         cls.objects.update_or_create(occasion_id=occasion_id, defaults={'total_expense': total, 'event_count': count})
+         ParticipantLedger.objects.filter(occasion_id=occasion_id).delete()
+         ParticipantLedger.objects.bulk_create([
+            ParticipantLedger(
+               occasion_id=occasion_id, participant=participant,
+               active_expense=active.get(participant, Decimal('0')), cleared_expense=cleared.get(participant, Decimal('0'))
+            )
+            for participant in {**active, **cleared}
+         ])
+   
+# Participant Ledger Model
+class ParticipantLedger(models.Model):
+   """ Running active and cleared totals of a participant within an occasion. """
+   
+   occasion = models.ForeignKey(Occasion, related_name='participant_ledgers', on_delete=models.CASCADE)
+   participant = models.CharField(max_length=255)
+   active_expense = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+   cleared_expense = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+   
+   class Meta:
+      constraints = [
+         models.UniqueConstraint(fields=['occasion', 'participant'], name='unique_participant_ledger')
+      ]
+      
+   def __str__(self):
+      return f'{self.participant} in {self.occasion_id}'
+
+# Pair Balance Model
+class PairBalance(models.Model):
+   """ What the debtor still owes the creditor over all occasions and standalone events, maintained by Event.save and Event.clear_expense.
+   
+   A utiliser owes the outstanding part of their share to the expender of the event, only pairs that ever owed anything have a row.
+   """
+   
+   debtor = models.CharField(max_length=255)
+   creditor = models.CharField(max_length=255)
+   amount = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+   
+   class Meta:
+      constraints = [
+         # also serves as the debtor index.
+         models.UniqueConstraint(fields=['debtor', 'creditor'], name='unique_pair_balance')
+      ]
+      indexes = [
+         models.Index(fields=['creditor', 'debtor'], name='pair_balance_creditor_idx')
+      ]
+      
+   def __str__(self):
+      return f'{self.debtor} owes {self.creditor}'
+   
+   @classmethod
+   def apply_events(cls, events, removed=()):
+      """ Adds what the utilisers of the events owe their expender and subtracts what they still owed for the removed ones. """
+      
+      deltas = {}
+      for sign, group in ((1, events), (-1, removed)):
+         for event in group:
+            for participant, amount in event.expense_split.items():
+               if participant != event.expender:
+                  key = (participant, event.expender)
+                  deltas[key] = deltas.get(key, Decimal('0')) + sign * to_decimal(amount)
+      cls.apply_deltas(deltas)
+      
+   @classmethod
+   def record_clearances(cls, clearances):
+      """ Subtracts a batch of (debtor, creditor, amount) clearances, a participant clearing their own share owes nobody. """
+      
+      deltas = {}
+      for debtor, creditor, amount in clearances:
+         if debtor != creditor:
+            deltas[(debtor, creditor)] = deltas.get((debtor, creditor), Decimal('0')) - to_decimal(amount)
+      cls.apply_deltas(deltas)
+      
+   @classmethod
+   def apply_deltas(cls, deltas):
+      deltas = {key: amount for key, amount in deltas.items() if amount}
+      cls.objects.bulk_create([cls(debtor=debtor, creditor=creditor) for debtor, creditor in deltas], ignore_conflicts=True)
+      for (debtor, creditor), amount in deltas.items():
+         cls.objects.filter(debtor=debtor, creditor=creditor).update(amount=F('amount') + amount)
+         
+   @classmethod
+   def counterparties(cls, participant):
+      """ The (debtor, creditor, amount) of every open balance the participant is part of, read through the two indexes. """
+      
+      return cls.objects.filter(Q(debtor=participant) | Q(creditor=participant)).exclude(amount=0).values_list('debtor', 'creditor', 'amount')
+   
+   @classmethod
+   def expected(cls):
+      """ The balance of every pair computed from scratch from the outstanding shares. """
+      
+      return {
+         (debtor, creditor): total
+         for debtor, creditor, total in Share.objects.exclude(participant=F('event__expender')).values('participant', 'event__expender')
+         .annotate(total=Sum(F('owed') - F('cleared'))).values_list('participant', 'event__expender', 'total')
+         if total
+      }
+      
+   @classmethod
+   def differences(cls):
+      """ The pairs whose stored balance differs from the one computed from scratch, as {(debtor, creditor): (stored, expected)}. """
+      
+      expected = cls.expected()
+      stored = {(debtor, creditor): amount for debtor, creditor, amount in cls.objects.exclude(amount=0).values_list('debtor', 'creditor', 'amount')}
+      return {
+         key: (stored.get(key, Decimal('0')), expected.get(key, Decimal('0')))
+         for key in {**stored, **expected} if stored.get(key) != expected.get(key)
+      }
+      
+   @classmethod
+   def rebuild(cls):
+      """ Rebuilds the whole table from the outstanding shares. """
+      
+      with transaction.atomic():
+         cls.objects.all().delete()
+         cls.objects.bulk_create(
+            [cls(debtor=debtor, creditor=creditor, amount=amount) for (debtor, creditor), amount in cls.expected().items()],
+            batch_size=5000
+         )
+
+# Replica Heartbeat Model
+class ReplicaHeartbeat(models.Model):
+   """ A single row stamped on the primary before every replica sync, its age on the replica is the replication lag. """
+   
+   updated_at = models.FloatField()
+   
+   def __str__(self):
+      return f'Heartbeat at {self.updated_at}'
+
+@receiver(pre_delete, sender=Event)
+def forget_deleted_event(sender, instance, **kwargs):
+   """ Removes a deleted event from the ledger of its occasion and marks its cached summaries stale, its shares are deleted with it. """
+   
+   prefetch_related_objects([instance], 'shares')
+   # an occasion without a ledger is summed from the raw tables, which no longer hold the event.
+   if instance.occasion_id is not None and OccasionLedger.objects.filter(occasion_id=instance.occasion_id).exists():
+      OccasionLedger.apply_events([], removed=[instance])
+   Occasion.bump_summary_version(instance.occasion_id)
+
+@receiver(pre_delete, sender=Event)
+def forget_pair_balances(sender, instance, **kwargs):
+   """ Subtracts what is still owed for a deleted event, its shares are deleted with it. """
+   
+   PairBalance.apply_events([], removed=[instance])
+
+@receiver([post_save, post_delete], sender=user)
+def forget_authenticated_user(sender, instance, **kwargs):
+   """ Drops the cached state of a changed or deleted user used by CachedJWTAuthentication. """
+   
+   forget_user(instance.pk)
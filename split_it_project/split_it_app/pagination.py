@@ -0,0 +1,103 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+
+class PrimaryKeyCursorPagination(CursorPagination):
+    """ Keyset pagination on the primary key, every page is a range scan on the index so deep pages cost the same as the first. """
+
+    ordering = 'pk'
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = settings.SPLIT_IT_PAGE_SIZE
+        self.max_page_size = settings.SPLIT_IT_MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """ paginate_queryset for the async views, the page is fetched with the async ORM. """
+
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page([obj async for obj in queryset])
+
+    def page_queryset(self, queryset, request, view=None):
+        """ The first half of CursorPagination.paginate_queryset, returns the unevaluated queryset of the page. """
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (self.offset, self.reverse, self.current_position) = (0, False, None)
+        else:
+            (self.offset, self.reverse, self.current_position) = self.cursor
+
+        # cursor pagination always enforces an ordering.
+        if self.reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        # if we have a cursor with a fixed position then filter by that.
+        if self.current_position is not None:
+            order = self.ordering[0]
+            is_reversed = order.startswith('-')
+            order_attr = order.lstrip('-')
+
+            # test for: (cursor reversed) XOR (queryset reversed)
+            if self.cursor.reverse != is_reversed:
+                kwargs = {order_attr + '__lt': self.current_position}
+            else:
+                kwargs = {order_attr + '__gt': self.current_position}
+
+            queryset = queryset.filter(**kwargs)
+
+        # one extra item is fetched to know whether a page follows this one.
+        return queryset[self.offset:self.offset + self.page_size + 1]
+
+    def set_page(self, results):
+        """ The second half of CursorPagination.paginate_queryset, works out the page and its cursors from the results. """
+
+        self.page = list(results[:self.page_size])
+
+        # determine the position of the final item following the page.
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if self.reverse:
+            # the query ordering was reversed, so the items are reversed again before returning them.
+            self.page = list(reversed(self.page))
+
+            self.has_next = (self.current_position is not None) or (self.offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = self.current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (self.current_position is not None) or (self.offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = self.current_position
+
+        # display page controls in the browsable API if there is more than one page.
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
@@ -0,0 +1,136 @@
+import cProfile
+import json
+import os
+import random
+import re
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from rest_framework.exceptions import APIException
+from .authentication import CachedJWTAuthentication
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_NAME = re.compile(r'^[0-9]+-[0-9]+\.prof$')
+
+def profile_dir():
+    return str(settings.SPLIT_IT_PROFILE_DIR)
+
+def sampled():
+    rate = settings.SPLIT_IT_PROFILE_SAMPLE_RATE
+    return bool(rate) and random.random() < rate
+
+def is_staff_request(request):
+    """ Whether the request is made by a staff user, through the session or a bearer token. """
+
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        # the api authenticates inside its views, the bearer token is checked here only for requests asking for a profile.
+        try:
+            user_auth_tuple = CachedJWTAuthentication().authenticate(request)
+        except APIException:
+            return False
+        user = user_auth_tuple[0] if user_auth_tuple is not None else None
+    return user is not None and user.is_staff
+
+def save_profile(profiler, request, response, duration):
+    """ Writes the profile and its details to the profile directory, dropping the oldest beyond SPLIT_IT_PROFILE_KEEP. """
+
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    name = f'{time.time_ns()}-{os.getpid()}.prof'
+    profiler.dump_stats(os.path.join(directory, name))
+    with open(os.path.join(directory, name + '.json'), 'w') as file:
+        json.dump({
+            'name': name,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'created': time.time(),
+        }, file)
+
+    for stale in list_profiles()[settings.SPLIT_IT_PROFILE_KEEP:]:
+        for path in (profile_path(stale['name']), profile_path(stale['name']) + '.json'):
+            try:
+                os.remove(path)
+            except FileNotFoundError: # removed by another process pruning at the same time
+                pass
+    return name
+
+def profile_path(name):
+    """ The file of a profile, None for anything that is not the name of a profile. """
+
+    if not PROFILE_NAME.match(name):
+        return None
+    return os.path.join(profile_dir(), name)
+
+def list_profiles():
+    """ The details of the stored profiles, newest first. """
+
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for filename in os.listdir(directory):
+        if not filename.endswith('.prof.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as file:
+                profiles.append(json.load(file))
+        except (OSError, ValueError): # pruned or still being written
+            continue
+    return sorted(profiles, key=lambda profile: profile['name'], reverse=True)
+
+class ProfilingMiddleware:
+    """ Runs cProfile around the requests of staff users sending X-Profile, and a SPLIT_IT_PROFILE_SAMPLE_RATE of all.
+
+    The profile is kept in a bounded ring of files in SPLIT_IT_PROFILE_DIR and named in the X-Profile-Id response
+    header, the admin only profiles/ endpoints list and download them. Other requests only pay for the header check.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not (sampled() or PROFILE_HEADER in request.headers and is_staff_request(request)):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+        except ValueError: # another profiler is already running on this thread
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        return self.finish(profiler, request, response, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if not (sampled() or PROFILE_HEADER in request.headers and await sync_to_async(is_staff_request)(request)):
+            return await self.get_response(request)
+
+        # only the event loop thread is profiled, the work done in sync_to_async threads shows as waiting.
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+        except ValueError:
+            return await self.get_response(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.disable()
+        return self.finish(profiler, request, response, time.perf_counter() - start)
+
+    def finish(self, profiler, request, response, duration):
+        response['X-Profile-Id'] = save_profile(profiler, request, response, duration)
+        return response
@@ -0,0 +1,51 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from .metrics import TimedRendererMixin
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+class ORJSONRenderer(JSONRenderer):
+    """ JSONRenderer encoding with orjson when it is installed, decoding to the same values as JSONRenderer.
+
+    The bytes are the same except for floats: orjson writes exponents without padding (1e16, 1e-7 where JSONRenderer
+    writes 1e+16, 1e-07) and renders NaN and Infinity as null where JSONRenderer raises ValueError. Indented output
+    and the data orjson can not encode (integers over 64 bits) are left to JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            # dates go through the encoder of JSONRenderer like everything orjson does not know, for the same format.
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # escaped like JSONRenderer does, they are valid json but not valid javascript.
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+class MessagePackRenderer(BaseRenderer):
+    """ Renders MessagePack, the values it has no type for (decimals, dates) encoded as JSONRenderer encodes them. """
+
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    encoder_class = JSONRenderer.encoder_class
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=self.encoder_class().default, use_bin_type=True)
+
+class TimedORJSONRenderer(TimedRendererMixin, ORJSONRenderer):
+    pass
+
+class TimedMessagePackRenderer(TimedRendererMixin, MessagePackRenderer):
+    pass
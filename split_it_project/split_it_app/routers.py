@@ -0,0 +1,163 @@
+import contextvars
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, DEFAULT_DB_ALIAS, DatabaseError
+from django.utils.functional import SimpleLazyObject
+
+PIN_COOKIE = 'split_it_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+def pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+def authenticated_user_id(request):
+    """ The id of the user the request is authenticated as, None while that is not known without a query.
+
+    The lazy session user of AuthenticationMiddleware is not resolved, it would read the database from the router.
+    DRF replaces it with the user it authenticated (e.g. from a JWT) once the view runs.
+    """
+
+    user = request.__dict__.get('user')
+    if user is None or isinstance(user, SimpleLazyObject) or not user.is_authenticated:
+        return None
+    return user.pk
+
+class RequestRouting:
+    """ Whether the reads of a request have to see the primary, and whether the request wrote to it. """
+
+    __slots__ = ('pinned', 'wrote', 'request', 'user_checked')
+
+    def __init__(self, pinned=False, request=None):
+        self.pinned = pinned
+        self.wrote = False
+        self.request = request
+        self.user_checked = False
+
+    def reads_primary(self):
+        """ Pinned requests, and the requests of a user who wrote within SPLIT_IT_REPLICA_PIN_SECONDS, read the primary.
+
+        The pin of the user is looked up once, on the first read after the request was authenticated, so clients that
+        do not keep cookies (JWT clients) read their writes as well.
+        """
+
+        if not self.pinned and not self.user_checked and self.request is not None:
+            user_id = authenticated_user_id(self.request)
+            if user_id is not None:
+                self.user_checked = True
+                self.pinned = caches[settings.SPLIT_IT_REPLICA_PIN_CACHE].get(pin_key(user_id)) is not None
+        return self.pinned
+
+# the routing of the request being served, shared with its sync_to_async threads like the request timings.
+current_routing = contextvars.ContextVar('split_it_request_routing', default=None)
+
+class ReplicaLag:
+    """ The replication lag of the replica, the age of its heartbeat, read at most every SPLIT_IT_REPLICA_LAG_CHECK_INTERVAL seconds. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked = None
+        self.value = float('inf')
+
+    def get(self):
+        now = time.monotonic()
+        if self.checked is None or now - self.checked >= settings.SPLIT_IT_REPLICA_LAG_CHECK_INTERVAL:
+            with self.lock:
+                if self.checked is None or now - self.checked >= settings.SPLIT_IT_REPLICA_LAG_CHECK_INTERVAL:
+                    self.value = self.measure()
+                    self.checked = now
+        return self.value
+
+    def measure(self):
+        from .models import ReplicaHeartbeat
+
+        try:
+            updated_at = ReplicaHeartbeat.objects.using(settings.SPLIT_IT_REPLICA_ALIAS).values_list('updated_at', flat=True).first()
+        except DatabaseError: # the replica is missing or being replaced, the primary answers meanwhile
+            return float('inf')
+        return float('inf') if updated_at is None else max(0.0, time.time() - updated_at)
+
+    def reset(self):
+        with self.lock:
+            self.checked = None
+
+replica_lag = ReplicaLag()
+
+class ReplicaRouter:
+    """ Sends the reads to the SPLIT_IT_REPLICA_ALIAS database and the writes to the primary.
+
+    Reads stay on the primary inside transactions, for requests that write or wrote recently (read your writes), and
+    while the replica lags more than SPLIT_IT_REPLICA_MAX_LAG seconds behind.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = current_routing.get()
+        if routing is not None and routing.reads_primary() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if replica_lag.get() > settings.SPLIT_IT_REPLICA_MAX_LAG:
+            return DEFAULT_DB_ALIAS
+        return settings.SPLIT_IT_REPLICA_ALIAS
+
+    def db_for_write(self, model, **hints):
+        routing = current_routing.get()
+        if routing is not None:
+            routing.pinned = routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True # the replica is a copy of the primary
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != settings.SPLIT_IT_REPLICA_ALIAS # the replica gets its schema with the copy
+
+class ReplicaPinningMiddleware:
+    """ Pins the reads of unsafe requests to the primary, and of the requests of a client for a while after it wrote.
+
+    A request that wrote sets a cookie for SPLIT_IT_REPLICA_PIN_SECONDS, long enough for the replica to catch up,
+    the requests sending it back read from the primary. The user it was authenticated as is pinned for as long in
+    SPLIT_IT_REPLICA_PIN_CACHE, for the clients that do not send cookies back.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        routing = self.start(request)
+        token = current_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        user_id = authenticated_user_id(request) if routing.wrote else None
+        if user_id is not None:
+            caches[settings.SPLIT_IT_REPLICA_PIN_CACHE].set(pin_key(user_id), 1, settings.SPLIT_IT_REPLICA_PIN_SECONDS)
+        return self.finish(routing, response)
+
+    async def __acall__(self, request):
+        routing = self.start(request)
+        token = current_routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        user_id = authenticated_user_id(request) if routing.wrote else None
+        if user_id is not None:
+            await caches[settings.SPLIT_IT_REPLICA_PIN_CACHE].aset(pin_key(user_id), 1, settings.SPLIT_IT_REPLICA_PIN_SECONDS)
+        return self.finish(routing, response)
+
+    def start(self, request):
+        return RequestRouting(pinned=request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES, request=request)
+
+    def finish(self, routing, response):
+        if routing.wrote:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.SPLIT_IT_REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
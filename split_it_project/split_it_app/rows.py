@@ -0,0 +1,81 @@
+from .models import Event, Share
+from .splits import CENT
+
+# the columns of an event in the listings, pk is the position of the cursor pagination.
+EVENT_FIELDS = ('pk', 'description', 'occasion__description', 'amount', 'expender', 'utiliser', 'split_type')
+OCCASION_FIELDS = ('pk', 'description', 'participants')
+
+def event_values(queryset):
+    return queryset.values(*EVENT_FIELDS)
+
+def occasion_values(queryset):
+    return queryset.values(*OCCASION_FIELDS)
+
+def shares_of(event_ids):
+    return Share.objects.filter(event_id__in=event_ids).order_by('pk').values_list('event_id', 'participant', 'owed', 'cleared')
+
+def events_of(occasion_ids):
+    # the occasion name is taken from the occasion row, no join needed.
+    fields = [field for field in EVENT_FIELDS if field != 'occasion__description']
+    return Event.objects.filter(occasion_id__in=occasion_ids).order_by('pk').values('occasion_id', *fields)
+
+def event_dict(row, splits, occasion_name=None):
+    """ The representation of EventSerializer, built from a values() row and the expense splits by event. """
+
+    return {
+        'id': row['pk'],
+        'description': row['description'],
+        'occasion_name': (row['occasion__description'] if occasion_name is None else occasion_name) or '',
+        'amount': f'{row["amount"].quantize(CENT):f}',
+        'expender': row['expender'],
+        'utiliser': row['utiliser'],
+        'split_type': row['split_type'],
+        'expense_split': splits.get(row['pk'], {}),
+    }
+
+def expense_splits(shares):
+    """ expense_split of every event from its (event, participant, owed, cleared) shares. """
+
+    splits = {}
+    for event_id, participant, owed, cleared in shares:
+        splits.setdefault(event_id, {})[participant] = float(owed - cleared)
+    return splits
+
+def event_dicts(rows, shares):
+    splits = expense_splits(shares)
+    return [event_dict(row, splits) for row in rows]
+
+def occasion_dicts(rows, events, shares):
+    """ The representation of OccasionSerializer, its events listed under every occasion or {} when it has none. """
+
+    splits = expense_splits(shares)
+    by_occasion = {}
+    for event in events:
+        by_occasion.setdefault(event['occasion_id'], []).append(event)
+    return [
+        {
+            'id': row['pk'],
+            'description': row['description'],
+            'participants': row['participants'],
+            'events': [event_dict(event, splits, row['description']) for event in by_occasion[row['pk']]] if row['pk'] in by_occasion else {},
+        }
+        for row in rows
+    ]
+
+def event_list(rows):
+    """ The EventSerializer list of the values() rows of a page, with one more query for the shares. """
+
+    return event_dicts(rows, shares_of([row['pk'] for row in rows]))
+
+async def aevent_list(rows):
+    return event_dicts(rows, [share async for share in shares_of([row['pk'] for row in rows])])
+
+def occasion_list(rows):
+    """ The OccasionSerializer list of the values() rows of a page, with two more queries for the events and shares. """
+
+    events = list(events_of([row['pk'] for row in rows]))
+    return occasion_dicts(rows, events, shares_of([event['pk'] for event in events]))
+
+async def aoccasion_list(rows):
+    events = [event async for event in events_of([row['pk'] for row in rows])]
+    return occasion_dicts(rows, events, [share async for share in shares_of([event['pk'] for event in events])])
@@ -1,6 +1,12 @@
+from decimal import Decimal
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction, IntegrityError
+from django.db.models import Q
 from .models import Occasion, Event
+from .splits import validate_split
+from .lookup import description_key, as_id, resolve
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -15,7 +21,20 @@ class RegisterSerializer(serializers.ModelSerializer):
         fields = ('username', 'email', 'password')
         
     def create(self, validated_data):
-        return get_user_model().objects.create_user(**validated_data)
+        password_hash = validated_data.pop('password_hash', None)
+        if password_hash is None:
+            return get_user_model().objects.create_user(**validated_data)
+        
+        # the password was already hashed off the request worker, see AsyncRegisterApi.
+        validated_data.pop('password')
+        user_model = get_user_model()
+        user = user_model(
+            username=user_model.normalize_username(validated_data['username']),
+            email=user_model.objects.normalize_email(validated_data.get('email')),
+            password=password_hash,
+        )
+        user.save()
+        return user
     
 class LoginSerializer(serializers.Serializer):
     username = serializers.CharField()
@@ -36,8 +55,8 @@ class OccasionSerializer(serializers.ModelSerializer):
     def get_events(self, obj) -> dict:
         """ lists all the events created by the authenticated user. """
         
-        events = Event.objects.filter(occasion=obj)
-        if events.exists():
+        events = obj.event_occasions.all() # served from the prefetch cache when the queryset was prefetched
+        if events:
             return EventSerializer(events, many=True).data
         return  {}
     
@@ -51,18 +70,16 @@ class EventSerializer(serializers.ModelSerializer):
         model = Event
         fields = ('id', 'description', 'occasion', 'occasion_name', 'amount', 'expender', 'utiliser', 'split_type', 'expense_split', 'split')
     
-    def validate_event(self, attrs):
-        """ Validates the amount provided and events for duplicacy. """
+    def validate(self, attrs):
+        """ Checks that the amount is positive and that the split can be computed for the split type. """
         
-        description = attrs.get('description')
         amount = attrs.get('amount')
-        
-        if self.instance is None and Event.objects.filter(description=description, amount=amount):
-            raise serializers.ValidationError(f'Event with name: {description} and amount: {amount} already exists.')
-        
-        if amount is not None and amount <=0:
+        if amount is not None and amount <= 0:
             raise serializers.ValidationError('Amount must be greater than zero.')
         
+        error = validate_split(attrs.get('split_type'), attrs.get('amount'), attrs.get('utiliser'), attrs.get('split'))
+        if error:
+            raise serializers.ValidationError({'split': error})
         return attrs
     
     def get_occasion_name(self, obj) -> str:
@@ -76,9 +93,82 @@ class EventSerializer(serializers.ModelSerializer):
         
         if occasion_description:
             try:
-                occasion =  Occasion.objects.get(description=occasion_description)
+                occasion = resolve(Occasion.objects.all(), occasion_description)
                 validated_data['occasion'] = occasion
             except Occasion.DoesNotExist:
                 raise serializers.ValidationError("Provided Occasion does not exist.")
             
-        return Event.objects.create(**validated_data)
\ No newline at end of file
+        return Event.objects.create(**validated_data)
+    
+class EventListSerializer(serializers.ListSerializer):
+    """ Validates and creates a batch of events with a constant number of queries. """
+    
+    def to_internal_value(self, data):
+        """ Resolves the occasions by id or description and checks the batch for duplicates with one query each. """
+        
+        validated_data = super().to_internal_value(data)
+        
+        names = {attrs['occasion'] for attrs in validated_data if attrs.get('occasion')}
+        ids = {as_id(name) for name in names} - {None}
+        found = Occasion.objects.filter(Q(pk__in=ids) | Q(description_key__in={description_key(name) for name in names}))
+        by_description = {occasion.description: occasion for occasion in found}
+        by_id = {occasion.pk: occasion for occasion in found}
+        occasions = {}
+        for name in names:
+            occasion = by_description.get(name, by_id.get(as_id(name))) # an id only when no description matches
+            if occasion is not None:
+                occasions[name] = occasion
+        existing = set(
+            Event.objects.filter(description_key__in={description_key(attrs['description']) for attrs in validated_data})
+            .values_list('description', 'amount')
+        )
+        
+        errors = [{} for _ in validated_data]
+        for attrs, item_errors in zip(validated_data, errors):
+            description = attrs.get('description')
+            amount = attrs.get('amount')
+            if (description, amount) in existing:
+                item_errors['non_field_errors'] = [f'Event with name: {description} and amount: {amount} already exists.']
+            existing.add((description, amount)) # catches duplicates within the batch as well
+            
+            occasion_description = attrs.pop('occasion', None)
+            if occasion_description:
+                if occasion_description not in occasions:
+                    item_errors['occasion'] = ['Provided Occasion does not exist.']
+                attrs['occasion'] = occasions.get(occasion_description)
+                
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return validated_data
+    
+    def create(self, validated_data):
+        """ Inserts all the events and then all their shares in one transaction. """
+        
+        try:
+            with transaction.atomic():
+                events = Event.bulk_create_with_shares([Event(**attrs) for attrs in validated_data])
+        except IntegrityError:
+            raise serializers.ValidationError({'non_field_errors': ['The fields description, amount must make a unique set.']})
+        return events
+    
+class BulkEventSerializer(EventSerializer):
+    """ Event serializer used for the items of a bulk creation, the batch level checks live in EventListSerializer. """
+    
+    class Meta(EventSerializer.Meta):
+        list_serializer_class = EventListSerializer
+        validators = [] # the unique_event check is done once for the whole batch
+        
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        kwargs.setdefault('max_length', settings.SPLIT_IT_MAX_BULK_EVENTS)
+        kwargs.setdefault('allow_empty', False)
+        return super().many_init(*args, **kwargs)
+    
+class ExpenseEntrySerializer(serializers.Serializer):
+    event = serializers.CharField()
+    user = serializers.CharField()
+    amount = serializers.DecimalField(max_digits=20, decimal_places=2, min_value=Decimal('0.01'))
+    
+class ExpenseBatchSerializer(serializers.Serializer):
+    entries = ExpenseEntrySerializer(many=True, allow_empty=False)
+    mode = serializers.ChoiceField(choices=['all_or_nothing', 'best_effort'], default='all_or_nothing')
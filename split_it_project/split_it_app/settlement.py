@@ -0,0 +1,38 @@
+import heapq
+from decimal import Decimal
+
+CENT = Decimal('0.01')
+
+def settle_plan(balances):
+    """ Computes a short list of transfers that settles everyone, greedy min cash flow over two heaps.
+
+    balances maps every participant to their net balance, positive when they are owed money and negative when
+    they owe it. The largest debtor always pays the largest creditor, so each transfer settles at least one of
+    the two and there are at most n - 1 transfers, in O(n log n) without any pairwise matrix.
+    """
+
+    # heapq is a min-heap, amounts are negated integer cents so the largest balance pops first and nothing drifts.
+    creditors = []
+    debtors = []
+    for participant, balance in balances.items():
+        cents = int((Decimal(str(balance)) / CENT).to_integral_value())
+        if cents > 0:
+            creditors.append((-cents, participant))
+        elif cents < 0:
+            debtors.append((cents, participant))
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debit, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debit)
+        transfers.append({'from': debtor, 'to': creditor, 'amount': float(amount * CENT)})
+
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debit > amount:
+            heapq.heappush(debtors, (debit + amount, debtor))
+
+    return transfers
@@ -0,0 +1,126 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+try:
+    import numpy as np
+except ImportError: # the batch mode falls back to the per event engine
+    np = None
+
+SPLIT_TYPES = [('equal', 'Equal'), ('unequal', 'Unequal'), ('percentage', 'Percentage'), ('shares', 'Shares')]
+CENT = Decimal('0.01')
+
+def to_cents(amount):
+    """ Converts an amount (Decimal, int, float or str) to integer cents, rounding half up. """
+
+    return int((Decimal(str(amount)) / CENT).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+def from_cents(cents):
+    """ Converts integer cents back to an exact two decimal places amount. """
+
+    return Decimal(cents) * CENT
+
+def split_weights(split_type, utiliser, split):
+    """ Integer weights of every utiliser, or their fixed cents for an unequal split. """
+
+    if split_type == 'equal':
+        return [1] * len(utiliser)
+    # percentages and share weights may have decimals, scaling them like cents keeps them exact integers.
+    return [to_cents(value) for value in split]
+
+def allocate(total, weights):
+    """ Distributes total cents in proportion to the weights so that the parts always add up to the total.
+
+    Every part is rounded down and the cents left over go to the largest remainders, ties to the earlier utiliser.
+    """
+
+    weight_sum = sum(weights)
+    parts = [total * weight // weight_sum for weight in weights]
+    remainders = [total * weight % weight_sum for weight in weights]
+    leftover = total - sum(parts)
+    for index in sorted(range(len(weights)), key=lambda index: (-remainders[index], index))[:leftover]:
+        parts[index] += 1
+    return parts
+
+def to_split(utiliser, parts):
+    split = {}
+    for participant, cents in zip(utiliser, parts):
+        split[participant] = split.get(participant, 0) + cents
+    return split
+
+def split_cents(split_type, amount, utiliser, split=None):
+    """ Splits the amount between the utilisers, returns the cents owed by every utiliser. """
+
+    weights = split_weights(split_type, utiliser, split)
+    if split_type == 'unequal':
+        return to_split(utiliser, weights)
+    return to_split(utiliser, allocate(to_cents(amount), weights))
+
+def split_cents_batch(events):
+    """ Computes split_cents for many (split_type, amount, utiliser, split) events in one vectorized pass. """
+
+    if not events:
+        return []
+    if np is None or not all(event[2] for event in events):
+        return [split_cents(*event) for event in events]
+
+    counts, totals, weights, fixed = [], [], [], []
+    for split_type, amount, utiliser, split in events:
+        event_weights = split_weights(split_type, utiliser, split)
+        counts.append(len(event_weights))
+        totals.append(to_cents(amount))
+        weights.extend(event_weights)
+        fixed.extend([split_type == 'unequal'] * len(event_weights))
+
+    counts = np.array(counts, dtype=np.int64)
+    totals = np.array(totals, dtype=np.int64)
+    weights = np.array(weights, dtype=np.int64)
+    owner = np.repeat(np.arange(len(events)), counts)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    # the same largest remainder allocation as allocate(), for every share of every event at once.
+    weight_sums = np.maximum(np.add.reduceat(weights, starts), 1)
+    numerators = totals[owner] * weights
+    parts = numerators // weight_sums[owner]
+    remainders = numerators % weight_sums[owner]
+    leftover = totals - np.add.reduceat(parts, starts)
+
+    positions = np.arange(len(weights)) - starts[owner]
+    order = np.lexsort((positions, -remainders, owner))
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(weights)) - starts[owner[order]]
+    parts += rank < leftover[owner]
+
+    parts = np.where(fixed, weights, parts).tolist()
+    return [
+        to_split(event[2], parts[start:start + count])
+        for event, start, count in zip(events, starts.tolist(), counts.tolist())
+    ]
+
+def validate_split(split_type, amount, utiliser, split):
+    """ Returns the reason the split can not be computed, None when it is valid. """
+
+    if not utiliser:
+        return 'At least one utiliser is required.'
+    if split_type == 'equal':
+        return None
+    if not isinstance(split, list) or len(split) != len(utiliser):
+        return 'Split must have one value for every utiliser.'
+    try:
+        values = [Decimal(str(value)) for value in split]
+        # the values are turned into integer cents, anything finer would be rounded away after the sum was checked.
+        # quantize fails for Infinity and for values with more digits than the decimal context holds.
+        fractional = any(value != value.quantize(CENT) for value in values)
+    except ArithmeticError:
+        return 'Split values must be numbers.'
+    if not all(value.is_finite() for value in values):
+        return 'Split values must be numbers.'
+    if fractional:
+        return 'Split values can have at most 2 decimal places.'
+    if any(value < 0 for value in values):
+        return 'Split values can not be negative.'
+    if split_type == 'unequal' and amount is not None and sum(values) != Decimal(str(amount)):
+        return 'Split amounts must add up to the amount.'
+    if split_type == 'percentage' and sum(values) != 100:
+        return 'Split percentages must add up to 100.'
+    if split_type == 'shares' and sum(values) <= 0:
+        return 'Split shares must add up to more than zero.'
+    return None
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+def apply_pragmas(cursor, pragmas):
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """ Applies SPLIT_IT_SQLITE_PRAGMAS to every new sqlite connection. """
+
+    if connection.vendor == 'sqlite' and settings.SPLIT_IT_SQLITE_PRAGMAS:
+        with connection.cursor() as cursor:
+            apply_pragmas(cursor, settings.SPLIT_IT_SQLITE_PRAGMAS)
@@ -1,15 +1,66 @@
-from django.test import TestCase
+from io import StringIO
+import csv
+import gzip
+import json
+import os
+import pstats
+import sqlite3
+import tempfile
+from decimal import Decimal
+import threading
+import time
+from django.test import TestCase, TransactionTestCase, RequestFactory
+from django.http import HttpResponse
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APIClient
-from .models import Occasion, Event
+from rest_framework.test import APIClient, APIRequestFactory
+from django.db import connection, connections, OperationalError
+from django.db.migrations.executor import MigrationExecutor
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.db.models import Sum
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.cache import caches
+from django.conf import settings
+from django.utils import timezone
+from .models import Occasion, Event, Share, ExpenditureSummary, OccasionLedger, ParticipantLedger, ReplicaHeartbeat, PairBalance
+from .models import ExpenditureSnapshot, ExpenditureWatermark, ExpenditureArchive
+from .management.commands.bench_summary import legacy_expenditure_summary
+from .management.commands.bench import compare
+from .benchdata import generate
+from .settlement import settle_plan
+from .splits import split_cents, split_cents_batch, validate_split
+from .lookup import description_key, resolve
+from .authentication import CachedJWTAuthentication
+from .views import get_tokens_for_user
+from .hashing import HashingPool, HashingBusy
+from .metrics import metrics_store
+from .serializers import EventSerializer, OccasionSerializer
+from .sqlite import apply_pragmas
+from .routers import ReplicaRouter, ReplicaPinningMiddleware, ReplicaLag, replica_lag, PIN_COOKIE
+from .management.commands.sync_replica import copy_to_replica
+from .rows import event_values, occasion_values, event_list, occasion_list
+from .renderers import ORJSONRenderer, MessagePackRenderer, orjson, msgpack
+from rest_framework.renderers import JSONRenderer
+from unittest import mock, skipUnless
+from django.urls import path, include, resolve as resolve_url
+from .urls import build_urlpatterns
+from .views import AsyncAPIView
+from drf_spectacular.views import SpectacularAPIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
 
 REGISTER_USER_URL = reverse('split_it_app:register_users')
 LOGIN_USER_URL = reverse('split_it_app:login_users')
+ASYNC_REGISTER_USER_URL = reverse('split_it_app:register_users_async')
+ASYNC_LOGIN_USER_URL = reverse('split_it_app:login_users_async')
 OCCASION_URL = reverse('split_it_app:occasion-view-create')
 EVENT_URL = reverse('split_it_app:event-view-create')
 EXPENSE_URL = reverse('split_it_app:expense-clear')
+EVENT_BULK_URL = reverse('split_it_app:event-bulk-create')
+EXPENSE_BATCH_URL = reverse('split_it_app:expense-clear-batch')
+BALANCES_URL = reverse('split_it_app:user-balances')
 
 class RegisterApiTest(TestCase):
     """ This testcase tests the RegisterApi. """
@@ -147,7 +198,7 @@ class OccasionApiTest(TestCase):
         response = self.client.get(self.occasion_url, format='json') # viewing the occasion
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertTrue(self.occasion.objects.filter(description='testing occasion').exists())
-        self.assertIn('id', response.data[0])
+        self.assertIn('id', response.data['results'][0])
         
     def test_create_duplicate_occasion_fail(self):
         self.client.post(self.occasion_url, self.occasion_data, format='json')
@@ -221,6 +272,19 @@ class EventApiTest(TestCase):
         self.assertTrue(self.event.objects.filter(description='test event').exists())
         self.assertEqual(response.data['expense_split'], expected_split)
         
+    def test_create_event_with_sub_cent_or_non_finite_split_failure(self):
+        data = {
+            "description": "test event",
+            "amount": 30,
+            "expender": "test1",
+            "utiliser" : ["test1", "test2"],
+            "split_type": "unequal",
+        }
+        for split in ([10.005, 19.995], ["NaN", 30], ["Infinity", "-Infinity"], [1e30, 1]):
+            response = self.client.post(self.event_url, {**data, "split": split}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(self.event.objects.filter(description='test event').exists())
+        
     def test_create_event_with_occasion_with_equal_split_success(self):
         self.client.post(self.occasion_url, self.occasion_data, format='json')  # creating an occasion
         data = {
@@ -281,7 +345,7 @@ class EventApiTest(TestCase):
         response = self.client.get(self.event_url, format='json') # viewing the event
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertTrue(self.event.objects.filter(description='test event').exists())
-        self.assertIn('id', response.data[0])
+        self.assertIn('id', response.data['results'][0])
         
     def test_create_event_with_occasion_fail(self):
         self.client.post(self.occasion_url, self.occasion_data, format='json')  # creating an occasion
@@ -422,6 +486,7 @@ class OccasionSummaryApiTest(TestCase):
     """ This testcase tests the OccasionSummaryApi. """
     
     def setUp(self):
+        caches[settings.SPLIT_IT_SUMMARY_CACHE].clear() # primary keys are reused between tests, so are the cache keys.
         self.user = get_user_model()
         self.occasion = Occasion
         self.event = Event
@@ -452,7 +517,7 @@ class OccasionSummaryApiTest(TestCase):
         }
         self.client.post(self.occasion_url, data, format='json')  # creating an occasion
         response = self.client.get(self.occasion_url, format='json')
-        self.occasion_id = response.data[0]['id']
+        self.occasion_id = response.data['results'][0]['id']
         
         self.summary_url = reverse('split_it_app:occasion-summary', args=[self.occasion_id])
         
@@ -500,9 +565,9 @@ class OccasionSummaryApiTest(TestCase):
         }
         self.client.post(self.expense_url, data, format='json') # clearing the expense for test1 user
         expected_total_expense = 280.0
-        expected_individual_expense = {'test1': 128.33, 'test2': 88.33, 'ab11c': 63.33}
+        expected_individual_expense = {'test1': 128.34, 'test2': 88.33, 'ab11c': 63.33} # the left over cent of 100 / 3 goes to test1
         expected_cleared_expense = {'test1': 50.0}
-        expected_total_active_expense = {'test1': 78.33, 'test2': 88.33, 'ab11c': 63.33}
+        expected_total_active_expense = {'test1': 78.34, 'test2': 88.33, 'ab11c': 63.33}
         response = self.client.get(self.summary_url, format='json') # getting the occasion expenditure summary
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['occasion'], 'test occasion')
@@ -510,15 +575,1575 @@ class OccasionSummaryApiTest(TestCase):
         self.assertEqual(response.data['total_no_of_events'], 3)
         self.assertEqual(response.data['total_individual_expense'], expected_individual_expense)
         self.assertEqual(response.data['cleared_expense'], expected_cleared_expense)
-        self.assertEqual(response.data['total_active_expense'], expected_total_active_expense)        
+        self.assertEqual(response.data['total_active_expense'], expected_total_active_expense)
+        
+    def test_summary_of_unknown_occasion(self):
+        response = self.client.get(reverse('split_it_app:occasion-summary', args=[self.occasion_id + 1000]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class ListQueryCountTest(TestCase):
+    """ This testcase checks that the OccasionApi and EventApi listings run a constant number of queries. """
+    
+    def setUp(self):
+        self.user = get_user_model()
+        self.client = APIClient()
+        
+        data = {
+            'username': 'testuser',
+            'email': 'testuser@example.com',
+            'password': 'testpassword'
+        }
+        self.client.post(REGISTER_USER_URL, data, format='json') # registering the user
+        data = {
+            'username': 'testuser',
+            'password': 'testpassword'
+        }
+        response = self.client.post(LOGIN_USER_URL, data, format='json') # logging in the user
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access']) # setting jwt token
+        self.owner = self.user.objects.get(username='testuser')
+        
+    def tearDown(self):
+        self.user.objects.all().delete()
+        Occasion.objects.all().delete()
+        Event.objects.all().delete()
+        
+    def create_occasions(self, count, events_per_occasion=3):
+        """ Creates the given number of occasions, each with a few tagged events. """
+        
+        start = Occasion.objects.count()
+        for index in range(start, start + count):
+            occasion = Occasion.objects.create(description=f'occasion {index}', participants=['test1', 'test2'], created_by=self.owner)
+            for event_index in range(events_per_occasion):
+                Event.objects.create(
+                    description=f'event {index}-{event_index}', amount=10 + event_index, expender='test1',
+                    utiliser=['test1', 'test2'], split_type='equal', occasion=occasion, created_by=self.owner
+                )
+                
+    def count_queries(self, url):
+        self.client.get(url, format='json') # the first request of the token caches its user
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries)
+    
+    def test_occasion_list_query_count_is_constant(self):
+        self.create_occasions(1)
+        small = self.count_queries(OCCASION_URL)
+        self.create_occasions(20)
+        self.assertEqual(self.count_queries(OCCASION_URL), small)
+        
+    def test_occasion_list_includes_prefetched_events(self):
+        self.create_occasions(2)
+        Occasion.objects.create(description='empty occasion', participants=[], created_by=self.owner)
+        response = self.client.get(OCCASION_URL, format='json')
+        events = {occasion['description']: occasion['events'] for occasion in response.data['results']}
+        self.assertEqual(len(events['occasion 0']), 3)
+        self.assertEqual(events['occasion 1'][0]['occasion_name'], 'occasion 1')
+        self.assertEqual(events['empty occasion'], {})
+        
+    def test_event_list_query_count_is_constant(self):
+        self.create_occasions(1)
+        small = self.count_queries(EVENT_URL)
+        self.create_occasions(20)
+        self.assertEqual(self.count_queries(EVENT_URL), small)
+
+class OccasionLedgerTest(TestCase):
+    """ This testcase tests the ledger maintained behind the OccasionSummaryApi. """
+    
+    def setUp(self):
+        caches[settings.SPLIT_IT_SUMMARY_CACHE].clear()
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.occasion = Occasion.objects.create(description='test occasion', participants=['test1', 'test2', 'ab11c'], created_by=self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+        self.summary_url = reverse('split_it_app:occasion-summary', args=[self.occasion.pk])
+        
+    def tearDown(self):
+        get_user_model().objects.all().delete()
+        Occasion.objects.all().delete()
+        Event.objects.all().delete()
+        
+    def create_event(self, description, amount, utiliser, split_type='equal', split=None):
+        return Event.objects.create(
+            description=description, amount=amount, expender='test1', utiliser=utiliser,
+            split_type=split_type, split=split, occasion=self.occasion, created_by=self.owner
+        )
+        
+    def test_ledger_matches_full_summary(self):
+        self.create_event('test event1', 30, ['test1', 'test2'])
+        self.create_event('test event2', 100, ['test1', 'test2', 'ab11c'])
+        event = self.create_event('test event', 150, ['test1', 'test2', 'ab11c'], 'unequal', [80, 40, 30])
+        event.clear_expense('test1', 50.0)
+        
+        ledger = OccasionLedger.objects.get(occasion=self.occasion)
+        self.assertEqual(ledger.event_count, 3)
+        self.assertEqual(ledger.total_expense, 280)
+        self.assertEqual(self.occasion.get_ledger_summary(), self.occasion.get_expenditure_summary())
+        
+    def test_ledger_follows_updated_event(self):
+        event = self.create_event('test event', 30, ['test1', 'test2'])
+        event.amount = 60
+        event.save()
+        self.assertEqual(OccasionLedger.objects.get(occasion=self.occasion).total_expense, 60)
+        self.assertEqual(ParticipantLedger.objects.get(occasion=self.occasion, participant='test2').active_expense, 30)
+        
+    def test_ledger_forgets_deleted_event(self):
+        self.create_event('test event1', 30, ['test1', 'test2'])
+        self.create_event('test event2', 30, ['test1', 'test2', 'ab11c']).delete()
+        ledger = OccasionLedger.objects.get(occasion=self.occasion)
+        self.assertEqual((ledger.total_expense, ledger.event_count), (30, 1))
+        self.assertFalse(ParticipantLedger.objects.filter(occasion=self.occasion, participant='ab11c').exists())
+        self.assertEqual(self.occasion.get_ledger_summary(), self.occasion.get_expenditure_summary())
         
+    def test_deleted_event_changes_the_summary_etag(self):
+        self.create_event('test event1', 30, ['test1', 'test2'])
+        event = self.create_event('test event2', 30, ['test1', 'test2'])
+        etag = self.client.get(self.summary_url, format='json')['ETag']
+        event.delete()
+        
+        response = self.client.get(self.summary_url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual((response.data['total_expense'], response.data['total_no_of_events']), (30.0, 1))
+        
+    def test_summary_query_count_is_constant(self):
+        self.create_event('test event0', 30, ['test1', 'test2'])
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(self.summary_url, format='json')
+        for index in range(1, 20):
+            self.create_event(f'test event{index}', 30 + index, ['test1', 'test2', 'ab11c'])
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(self.summary_url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_no_of_events'], 20)
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+        
+    def test_rebuild_ledger_command(self):
+        self.create_event('test event1', 30, ['test1', 'test2']).clear_expense('test2', 10.0)
+        self.create_event('test event2', 100, ['test1', 'test2', 'ab11c'])
+        expected = self.occasion.get_expenditure_summary()
+        ParticipantLedger.objects.all().update(active_expense=0, cleared_expense=0)
+        OccasionLedger.objects.all().update(total_expense=0, event_count=0)
+        
+        call_command('rebuild_ledger', stdout=StringIO())
+        self.assertEqual(Occasion.objects.get(pk=self.occasion.pk).get_ledger_summary(), expected)
+        
+    def test_aggregated_summary_matches_legacy_loop(self):
+        self.create_event('test event1', 30, ['test1', 'test2'])
+        self.create_event('test event2', 100, ['test1', 'test2', 'ab11c']).clear_expense('ab11c', 13.33)
+        self.create_event('test event3', 150, ['test1', 'test2', 'ab11c'], 'unequal', [80, 40, 30]).clear_expense('test1', 50.0)
+        self.assertEqual(self.occasion.get_expenditure_summary(), legacy_expenditure_summary(self.occasion))
+        
+    def test_legacy_loop_prefetches_the_shares(self):
+        for index in range(5):
+            self.create_event(f'test event{index}', 30, ['test1', 'test2'])
+        # the events, their shares and the cleared totals, however many events there are.
+        with self.assertNumQueries(3):
+            legacy_expenditure_summary(self.occasion)
+        
+    def test_aggregated_summary_of_empty_occasion(self):
+        summary = self.occasion.get_expenditure_summary()
+        self.assertEqual(summary['total_expense'], 0.0)
+        self.assertEqual(summary['total_no_of_events'], 0)
+        self.assertEqual(summary['total_active_expense'], {})
 
+class CursorPaginationTest(TestCase):
+    """ This testcase tests the cursor pagination of the EventApi, OccasionApi and UserApi. """
+    
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+        for index in range(7):
+            Event.objects.create(
+                description=f'test event{index}', amount=30, expender='test1', utiliser=['test1', 'test2'],
+                split_type='equal', created_by=self.owner
+            )
+            
+    def tearDown(self):
+        get_user_model().objects.all().delete()
+        Event.objects.all().delete()
+        
+    def test_walk_event_pages(self):
+        url = EVENT_URL + '?page_size=3'
+        ids = []
+        pages = 0
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse(any('OFFSET' in query['sql'] for query in context.captured_queries))
+            ids += [event['id'] for event in response.data['results']]
+            url = response.data['next']
+            pages += 1
+        self.assertEqual(pages, 3)
+        self.assertEqual(ids, list(Event.objects.order_by('pk').values_list('pk', flat=True)))
+        
+    def test_previous_cursor(self):
+        first = self.client.get(EVENT_URL + '?page_size=3', format='json')
+        second = self.client.get(first.data['next'], format='json')
+        self.assertIsNone(first.data['previous'])
+        previous = self.client.get(second.data['previous'], format='json')
+        self.assertEqual(previous.data['results'], first.data['results'])
+        
+    def test_user_list_is_paginated(self):
+        response = self.client.get(reverse('split_it_app:get_users'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['username'], 'testuser')
+        self.assertIn('next', response.data)
+        
+    def test_schema_documents_cursor(self):
+        response = self.client.get(reverse('schema'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('name: cursor', response.content.decode())
+
+class EventBulkApiTest(TestCase):
+    """ This testcase tests the EventBulkApi and the single write event creation. """
+    
+    def setUp(self):
+        caches[settings.SPLIT_IT_SUMMARY_CACHE].clear()
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.occasion = Occasion.objects.create(description='test occasion', participants=['test1', 'test2', 'ab11c'], created_by=self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
         
+    def tearDown(self):
+        get_user_model().objects.all().delete()
+        Occasion.objects.all().delete()
+        Event.objects.all().delete()
+        
+    def events(self, count, start=0):
+        return [
+            {
+                "description": f"test event{index}",
+                "amount": 30 + index,
+                "expender": "test1",
+                "utiliser" : ["test1", "test2"],
+                "split_type": "equal",
+                "occasion": "test occasion"
+            }
+            for index in range(start, start + count)
+        ]
+        
+    def test_bulk_create_events_success(self):
+        data = self.events(2) + [{
+            "description": "test event",
+            "amount": 150,
+            "expender": "test1",
+            "utiliser" : ["test1", "test2", "ab11c"],
+            "split_type": "unequal",
+            "split": [80, 40, 30]
+        }]
+        response = self.client.post(EVENT_BULK_URL, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(response.data[0]['occasion_name'], 'test occasion')
+        self.assertEqual(response.data[2]['expense_split'], {'test1': 80.0, 'test2': 40.0, 'ab11c': 30.0})
+        self.assertEqual(Event.objects.count(), 3)
+        self.assertEqual(self.occasion.get_ledger_summary(), self.occasion.get_expenditure_summary())
         
+    def test_bulk_create_query_count_is_constant(self):
+        self.client.post(EVENT_BULK_URL, self.events(1), format='json') # the first event of an occasion builds its ledger
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(EVENT_BULK_URL, self.events(2, start=1), format='json')
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.post(EVENT_BULK_URL, self.events(40, start=3), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
         
+    def test_bulk_create_duplicate_events_fail(self):
+        self.client.post(EVENT_BULK_URL, self.events(1), format='json')
+        data = self.events(2) + self.events(1, start=1) # first one already exists, last one repeats the second
+        response = self.client.post(EVENT_BULK_URL, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('already exists', response.data[0]['non_field_errors'][0])
+        self.assertEqual(response.data[1], {})
+        self.assertIn('already exists', response.data[2]['non_field_errors'][0])
+        self.assertEqual(Event.objects.count(), 1)
         
+    def test_create_events_with_non_positive_amount_fail(self):
+        for amount in [0, -10]:
+            data = self.events(1)
+            data[0]['amount'] = amount
+            response = self.client.post(EVENT_BULK_URL, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data[0]['non_field_errors'][0], 'Amount must be greater than zero.')
+            response = self.client.post(EVENT_URL, data[0], format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data['non_field_errors'][0], 'Amount must be greater than zero.')
+        self.assertFalse(Event.objects.exists())
         
+    def test_bulk_create_unknown_occasion_fail(self):
+        data = self.events(2)
+        data[1]['occasion'] = 'no such occasion'
+        response = self.client.post(EVENT_BULK_URL, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[1]['occasion'][0], 'Provided Occasion does not exist.')
+        self.assertFalse(Event.objects.exists())
         
+    def test_single_event_is_written_once(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(EVENT_URL, self.events(1)[0], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        event_writes = [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith(('INSERT INTO "split_it_app_event"', 'UPDATE "split_it_app_event"'))
+        ]
+        self.assertEqual(len(event_writes), 1)
+        self.assertEqual(response.data['expense_split'], {'test1': 15.0, 'test2': 15.0})
+
+class ExpenseBatchApiTest(TestCase):
+    """ This testcase tests the ExpenseBatchApi. """
+    
+    def setUp(self):
+        caches[settings.SPLIT_IT_SUMMARY_CACHE].clear()
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.occasion = Occasion.objects.create(description='test occasion', participants=['test1', 'test2', 'ab11c'], created_by=self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+        for index in range(3):
+            Event.objects.create(
+                description=f'test event{index}', amount=30, expender='test1', utiliser=['test1', 'test2', 'ab11c'],
+                split_type='equal', occasion=self.occasion, created_by=self.owner
+            )
+            
+    def tearDown(self):
+        get_user_model().objects.all().delete()
+        Occasion.objects.all().delete()
+        Event.objects.all().delete()
+        
+    def test_clear_batch_success(self):
+        data = {
+            "entries": [
+                {"event": "test event0", "user": "test2", "amount": 10.0},
+                {"event": "test event0", "user": "ab11c", "amount": 4.0},
+                {"event": "test event1", "user": "test2", "amount": 10.0},
+            ]
+        }
+        response = self.client.post(EXPENSE_BATCH_URL, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['cleared'], 3)
+        self.assertEqual(Event.objects.get(description='test event0').expense_split, {'test1': 10.0, 'test2': 0.0, 'ab11c': 6.0})
+        self.assertEqual(ExpenditureSummary.objects.count(), 3)
+        self.assertEqual(self.occasion.get_ledger_summary(), self.occasion.get_expenditure_summary())
+        
+    def test_clear_batch_rejects_zero_and_sub_cent_amounts(self):
+        for amount in [0, -1.0, 0.001]:
+            response = self.client.post(EXPENSE_BATCH_URL, {"entries": [{"event": "test event0", "user": "test2", "amount": amount}]}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(EXPENSE_URL, {"event": "test event0", "user": "test2", "amount": 0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['message'], 'Amount must be greater than zero.')
+        for amount in ["0.005", "1.006"]:
+            response = self.client.post(EXPENSE_URL, {"event": "test event0", "user": "test2", "amount": amount}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data['message'], 'Amount can have at most 2 decimal places.')
+        self.assertFalse(ExpenditureSummary.objects.exists())
         
+    def test_clear_batch_writes_each_share_once(self):
+        entries = [{"event": f"test event{index % 3}", "user": "test2", "amount": 1.0} for index in range(9)]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(EXPENSE_BATCH_URL, {"entries": entries}, format='json')
+        self.assertEqual(response.data['cleared'], 9)
+        self.assertEqual(Event.objects.get(description='test event2').expense_split['test2'], 7.0)
+        share_updates = [query for query in context.captured_queries if query['sql'].startswith('UPDATE "split_it_app_share"')]
+        self.assertEqual(len(share_updates), 3) # one write per share, however many entries touch it
         
+    def test_clear_batch_all_or_nothing_fail(self):
+        data = {
+            "entries": [
+                {"event": "test event0", "user": "test2", "amount": 10.0},
+                {"event": "test event1", "user": "test2", "amount": 20.0}, # greater than the split of the user
+                {"event": "no such event", "user": "test2", "amount": 1.0},
+            ]
+        }
+        response = self.client.post(EXPENSE_BATCH_URL, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['cleared'], 0)
+        self.assertEqual(response.data['results'][1]['message'], 'Amount provided is greater than expense split for user: test2')
+        self.assertEqual(response.data['results'][2]['message'], 'Provided event does not exist.')
+        self.assertFalse(ExpenditureSummary.objects.exists())
+        self.assertEqual(Event.objects.get(description='test event0').expense_split['test2'], 10.0)
+        
+    def test_clear_batch_best_effort(self):
+        data = {
+            "mode": "best_effort",
+            "entries": [
+                {"event": "test event0", "user": "test2", "amount": 10.0},
+                {"event": "test event0", "user": "test2", "amount": 10.0}, # already cleared by the previous entry
+                {"event": "test event1", "user": "test341", "amount": 1.0},
+            ]
+        }
+        response = self.client.post(EXPENSE_BATCH_URL, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['cleared'], 1)
+        self.assertEqual(response.data['results'][1]['message'], 'Expense for this event is already cleared.')
+        self.assertEqual(response.data['results'][2]['message'], 'No such user: test341 found for event: test event1.')
+        self.assertEqual(ExpenditureSummary.objects.count(), 1)
+
+class ClearExpenseConcurrencyTest(TransactionTestCase):
+    """ This testcase hammers a single event with concurrent settlements and checks that no update is lost. """
+    
+    threads = 8
+    clearances_per_thread = 10
+    
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.occasion = Occasion.objects.create(description='test occasion', participants=['test1', 'test2'], created_by=self.owner)
+        self.event = Event.objects.create(
+            description='test event', amount=400, expender='test1', utiliser=['test1', 'test2'],
+            split_type='equal', occasion=self.occasion, created_by=self.owner
+        )
+        
+    def hammer(self, clear):
+        errors = []
+        barrier = threading.Barrier(self.threads)
+        
+        def worker():
+            try:
+                event = Event.objects.get(pk=self.event.pk) # every thread settles from its own, soon stale, copy
+                barrier.wait()
+                for _ in range(self.clearances_per_thread):
+                    clear(event)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+                
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.assertEqual(errors, [])
+        
+    def assert_exact_balances(self, cleared):
+        event = Event.objects.get(pk=self.event.pk)
+        self.assertEqual(event.expense_split['test2'], 200.0 - cleared)
+        self.assertEqual(ExpenditureSummary.objects.filter(event=event).count(), self.threads * self.clearances_per_thread)
+        self.assertEqual(ExpenditureSummary.objects.filter(event=event).aggregate(total=Sum('amount'))['total'], cleared)
+        self.assertEqual(ParticipantLedger.objects.get(occasion=self.occasion, participant='test2').cleared_expense, cleared)
+        
+    @override_settings(SPLIT_IT_CONFLICT_RETRIES=200)
+    def test_concurrent_clear_expense(self):
+        self.hammer(lambda event: event.clear_expense('test2', 1.0))
+        self.assert_exact_balances(self.threads * self.clearances_per_thread)
+        
+    @override_settings(SPLIT_IT_CONFLICT_RETRIES=200)
+    def test_concurrent_clear_expense_batches(self):
+        entries = [{'event': 'test event', 'user': 'test2', 'amount': 0.5}, {'event': 'test event', 'user': 'test1', 'amount': 0.5}]
+        self.hammer(lambda event: Event.clear_expenses(entries))
+        event = Event.objects.get(pk=self.event.pk)
+        self.assertEqual(event.expense_split, {'test1': 160.0, 'test2': 160.0})
+
+# the tables of the app before it shipped migrations, as created by migrate --run-syncdb.
+BASELINE_SCHEMA = [
+    'CREATE TABLE "split_it_app_occasion" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT, "description" text NOT NULL UNIQUE, "participants" text NOT NULL CHECK ((JSON_VALID("participants") OR "participants" IS NULL)), "created_by_id" integer NOT NULL REFERENCES "auth_user" ("id") DEFERRABLE INITIALLY DEFERRED)',
+    'CREATE TABLE "split_it_app_event" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT, "description" text NOT NULL, "amount" decimal NOT NULL, "expender" varchar(200) NOT NULL, "utiliser" text NOT NULL CHECK ((JSON_VALID("utiliser") OR "utiliser" IS NULL)), "created_by_id" integer NOT NULL REFERENCES "auth_user" ("id") DEFERRABLE INITIALLY DEFERRED, "split_type" varchar(10) NOT NULL, "occasion_id" bigint NULL REFERENCES "split_it_app_occasion" ("id") DEFERRABLE INITIALLY DEFERRED, "split" text NULL CHECK ((JSON_VALID("split") OR "split" IS NULL)), "expense_split" text NOT NULL CHECK ((JSON_VALID("expense_split") OR "expense_split" IS NULL)), CONSTRAINT "unique_event" UNIQUE ("description", "amount"))',
+    'CREATE TABLE "split_it_app_expendituresummary" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT, "event_id" bigint NOT NULL REFERENCES "split_it_app_event" ("id") DEFERRABLE INITIALLY DEFERRED, "user" varchar(255) NOT NULL, "amount" decimal NOT NULL)',
+    'CREATE INDEX "split_it_app_occasion_created_by_id_1709c1df" ON "split_it_app_occasion" ("created_by_id")',
+    'CREATE INDEX "split_it_app_event_created_by_id_2d79321e" ON "split_it_app_event" ("created_by_id")',
+    'CREATE INDEX "split_it_app_event_occasion_id_546e3e42" ON "split_it_app_event" ("occasion_id")',
+    'CREATE INDEX "split_it_app_expendituresummary_event_id_67676961" ON "split_it_app_expendituresummary" ("event_id")',
+]
+
+class ShareBackfillMigrationTest(TransactionTestCase):
+    """ This testcase tests that the share backfill migration turns expense_split into shares and back, and the upgrade of a baseline database. """
+    
+    before = [('split_it_app', '0004_event_split_version')]
+    after = [('split_it_app', '0007_remove_event_expense_split_and_more')]
+    
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+    
+    def tearDown(self):
+        # back to the latest migrations, the testcases that follow need all the tables.
+        executor = MigrationExecutor(connection)
+        self.migrate(executor.loader.graph.leaf_nodes('split_it_app'))
+        
+    def test_backfill_and_restore(self):
+        apps = self.migrate(self.before)
+        owner = apps.get_model('auth', 'User').objects.create(username='testuser')
+        Event = apps.get_model('split_it_app', 'Event')
+        event = Event.objects.create(
+            description='test event', amount=100, expender='test1', utiliser=['test1', 'test2', 'ab11c'], split_type='equal',
+            created_by_id=owner.pk, expense_split={'test1': 33.33, 'test2': 20.0, 'ab11c': 0.0}
+        )
+        ExpenditureSummary = apps.get_model('split_it_app', 'ExpenditureSummary')
+        ExpenditureSummary.objects.create(event=event, user='test2', amount=13.33)
+        ExpenditureSummary.objects.create(event=event, user='ab11c', amount=33.33)
+        
+        apps = self.migrate(self.after)
+        shares = apps.get_model('split_it_app', 'Share').objects.filter(event_id=event.pk)
+        self.assertEqual(
+            {share.participant: (share.owed, share.cleared) for share in shares},
+            {'test1': (Decimal('33.33'), 0), 'test2': (Decimal('33.33'), Decimal('13.33')), 'ab11c': (Decimal('33.33'), Decimal('33.33'))}
+        )
+        
+        apps = self.migrate(self.before)
+        restored = apps.get_model('split_it_app', 'Event').objects.get(pk=event.pk)
+        self.assertEqual(restored.expense_split, {'test1': 33.33, 'test2': 20.0, 'ab11c': 0.0})
+        
+    @skipUnless(connection.vendor == 'sqlite', 'the baseline schema is the sqlite one')
+    def test_upgrade_from_baseline_schema(self):
+        MigrationExecutor(connection).migrate([('split_it_app', None)])
+        owner = get_user_model().objects.create(username='testuser')
+        with connection.cursor() as cursor:
+            for statement in BASELINE_SCHEMA:
+                cursor.execute(statement)
+            cursor.execute('INSERT INTO split_it_app_occasion (id, description, participants, created_by_id) VALUES (1, %s, %s, %s)', ['trip', '["test1", "test2"]', owner.pk])
+            cursor.execute(
+                'INSERT INTO split_it_app_event (id, description, amount, expender, utiliser, created_by_id, split_type, occasion_id, split, expense_split) '
+                'VALUES (1, %s, 30, %s, %s, %s, %s, 1, %s, %s)', ['dinner', 'test1', '["test1", "test2"]', owner.pk, 'equal', '[]', '{"test1": 15.0, "test2": 10.0}']
+            )
+            cursor.execute('INSERT INTO split_it_app_expendituresummary (event_id, user, amount) VALUES (1, %s, 5)', ['test2'])
+            
+        call_command('migrate', 'split_it_app', fake_initial=True, stdout=StringIO())
+        self.assertEqual(
+            {share.participant: (share.owed, share.cleared) for share in Share.objects.all()},
+            {'test1': (Decimal('15.00'), 0), 'test2': (Decimal('15.00'), Decimal('5.00'))}
+        )
+        summary = Occasion.objects.get().get_expenditure_summary()
+        self.assertEqual((summary['total_active_expense'], summary['cleared_expense']), ({'test1': 15.0, 'test2': 10.0}, {'test2': 5.0}))
+        self.assertEqual(list(PairBalance.objects.values_list('debtor', 'creditor', 'amount')), [('test2', 'test1', Decimal('10.00'))])
+
+class OccasionSettlePlanApiTest(TestCase):
+    """ This testcase tests the settlement plan of an occasion. """
+    
+    def setUp(self):
+        caches[settings.SPLIT_IT_SUMMARY_CACHE].clear()
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.occasion = Occasion.objects.create(description='test occasion', participants=['test1', 'test2', 'ab11c'], created_by=self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+        self.settle_plan_url = reverse('split_it_app:occasion-settle-plan', args=[self.occasion.pk])
+        
+    def tearDown(self):
+        get_user_model().objects.all().delete()
+        Occasion.objects.all().delete()
+        Event.objects.all().delete()
+        
+    def create_event(self, description, amount, expender, utiliser):
+        return Event.objects.create(
+            description=description, amount=amount, expender=expender, utiliser=utiliser,
+            split_type='equal', occasion=self.occasion, created_by=self.owner
+        )
+        
+    def test_settle_plan(self):
+        self.create_event('test event1', 90, 'test1', ['test1', 'test2', 'ab11c'])
+        self.create_event('test event2', 60, 'test2', ['test1', 'test2'])
+        self.create_event('test event3', 30, 'ab11c', ['test2', 'ab11c']).clear_expense('test2', 15.0)
+        response = self.client.get(self.settle_plan_url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['balances'], {'test1': 30.0, 'test2': 0.0, 'ab11c': -30.0})
+        self.assertEqual(response.data['transfers'], [{'from': 'ab11c', 'to': 'test1', 'amount': 30.0}])
+        
+    def test_settle_plan_unknown_occasion(self):
+        response = self.client.get(reverse('split_it_app:occasion-settle-plan', args=[self.occasion.pk + 1000]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        
+    def test_settle_plan_not_modified(self):
+        self.create_event('test event1', 90, 'test1', ['test1', 'test2', 'ab11c'])
+        etag = self.client.get(self.settle_plan_url, format='json')['ETag']
+        response = self.client.get(self.settle_plan_url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        
+        Event.objects.get(description='test event1').clear_expense('test2', 30.0)
+        response = self.client.get(self.settle_plan_url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['transfers'], [{'from': 'ab11c', 'to': 'test1', 'amount': 30.0}])
+        
+    def test_settle_plan_settles_everyone_with_few_transfers(self):
+        balances = {'a': 50.0, 'b': 25.5, 'c': -10.25, 'd': -40.0, 'e': -25.25, 'f': 0.0}
+        transfers = settle_plan(balances)
+        remaining = {participant: round(balance * 100) for participant, balance in balances.items()}
+        for transfer in transfers:
+            self.assertGreater(transfer['amount'], 0)
+            remaining[transfer['from']] += round(transfer['amount'] * 100)
+            remaining[transfer['to']] -= round(transfer['amount'] * 100)
+        self.assertFalse(any(remaining.values()))
+        self.assertLessEqual(len(transfers), len([balance for balance in balances.values() if balance]) - 1)
+
+class SplitEngineTest(TestCase):
+    """ This testcase tests the integer cents split engine and the split types of the EventApi. """
+    
+    def setUp(self):
+        caches[settings.SPLIT_IT_SUMMARY_CACHE].clear()
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.occasion = Occasion.objects.create(description='test occasion', participants=['test1', 'test2', 'ab11c'], created_by=self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+        
+    def tearDown(self):
+        get_user_model().objects.all().delete()
+        Occasion.objects.all().delete()
+        Event.objects.all().delete()
+        
+    def test_split_always_adds_up_to_amount(self):
+        for amount in ['0.01', '0.02', '1', '10', '99.99', '100', '1234.57']:
+            for count in range(1, 8):
+                utiliser = [f'user{index}' for index in range(count)]
+                split = split_cents('equal', Decimal(amount), utiliser)
+                self.assertEqual(sum(split.values()), round(Decimal(amount) * 100))
+                self.assertLessEqual(max(split.values()) - min(split.values()), 1)
+                
+    def test_percentage_and_shares_split(self):
+        self.assertEqual(split_cents('percentage', 100, ['test1', 'test2', 'ab11c'], [50, 25.5, 24.5]), {'test1': 5000, 'test2': 2550, 'ab11c': 2450})
+        self.assertEqual(split_cents('percentage', 10, ['test1', 'test2', 'ab11c'], [33.33, 33.33, 33.34]), {'test1': 333, 'test2': 333, 'ab11c': 334})
+        self.assertEqual(split_cents('shares', 100, ['test1', 'test2', 'ab11c'], [1, 1, 1]), {'test1': 3334, 'test2': 3333, 'ab11c': 3333})
+        self.assertEqual(split_cents('shares', 90, ['test1', 'test2'], [2, 1]), {'test1': 6000, 'test2': 3000})
+        
+    def test_batch_split_matches_per_event_split(self):
+        events = [
+            ('equal', 100, ['test1', 'test2', 'ab11c'], None),
+            ('unequal', 150, ['test1', 'test2', 'ab11c'], [80, 40, 30]),
+            ('percentage', 10, ['test1', 'test2', 'ab11c'], [33.33, 33.33, 33.34]),
+            ('shares', 7.77, ['test1', 'test2', 'ab11c', 'test1'], [3, 0, 2.5, 1]),
+            ('equal', 0.05, ['test1', 'test2', 'ab11c', 'x', 'y', 'z', 'w'], None),
+        ]
+        self.assertEqual(split_cents_batch(events), [split_cents(*event) for event in events])
+        self.assertEqual(split_cents_batch([]), [])
+        
+    def test_validate_split(self):
+        self.assertIsNone(validate_split('equal', 100, ['test1'], None))
+        self.assertEqual(validate_split('equal', 100, [], None), 'At least one utiliser is required.')
+        self.assertEqual(validate_split('unequal', 100, ['test1', 'test2'], [50]), 'Split must have one value for every utiliser.')
+        self.assertEqual(validate_split('unequal', 100, ['test1', 'test2'], [50, 40]), 'Split amounts must add up to the amount.')
+        self.assertEqual(validate_split('percentage', 100, ['test1', 'test2'], [50, 40]), 'Split percentages must add up to 100.')
+        self.assertEqual(validate_split('shares', 100, ['test1', 'test2'], [0, 0]), 'Split shares must add up to more than zero.')
+        self.assertEqual(validate_split('shares', 100, ['test1', 'test2'], ['a', 1]), 'Split values must be numbers.')
+        self.assertEqual(validate_split('shares', 100, ['test1', 'test2'], ['NaN', 1]), 'Split values must be numbers.')
+        self.assertEqual(validate_split('percentage', 100, ['test1', 'test2'], [float('inf'), 1]), 'Split values must be numbers.')
+        self.assertEqual(validate_split('unequal', 30, ['test1', 'test2'], [10.005, 19.995]), 'Split values can have at most 2 decimal places.')
+        self.assertEqual(validate_split('shares', 30, ['test1', 'test2'], [1e30, 1]), 'Split values must be numbers.')
+        self.assertIsNone(validate_split('unequal', 30, ['test1', 'test2'], [10.5, '19.500']))
+        
+    def test_create_event_with_percentage_split(self):
+        data = {
+            "description": "test event",
+            "amount": 100,
+            "expender": "test1",
+            "utiliser" : ["test1", "test2", "ab11c"],
+            "split_type": "percentage",
+            "split": [50, 30, 20],
+            "occasion": "test occasion"
+        }
+        response = self.client.post(EVENT_URL, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['expense_split'], {'test1': 50.0, 'test2': 30.0, 'ab11c': 20.0})
+        
+    def test_create_event_with_invalid_split(self):
+        data = {
+            "description": "test event",
+            "amount": 100,
+            "expender": "test1",
+            "utiliser" : ["test1", "test2"],
+            "split_type": "unequal",
+            "split": [80, 40],
+            "occasion": "test occasion"
+        }
+        response = self.client.post(EVENT_URL, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['split'], ['Split amounts must add up to the amount.'])
+        self.assertFalse(Event.objects.exists())
+        
+    def test_bulk_create_uses_same_split(self):
+        data = [
+            {"description": f"test event{index}", "amount": 100 + index, "expender": "test1", "utiliser" : ["test1", "test2", "ab11c"],
+             "split_type": "shares", "split": [1, 1, 1], "occasion": "test occasion"}
+            for index in range(3)
+        ]
+        response = self.client.post(EVENT_BULK_URL, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        for event in Event.objects.prefetch_related('shares'):
+            self.assertEqual(sum(share.owed for share in event.shares.all()), event.amount)
+            self.assertEqual({share.participant: share.owed for share in event.shares.all()}, event.calculate_split())
+
+class DescriptionLookupTest(TestCase):
+    """ This testcase tests resolving occasions and events by numeric id or by the hashed description key. """
+    
+    def setUp(self):
+        caches[settings.SPLIT_IT_SUMMARY_CACHE].clear()
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.occasion = Occasion.objects.create(description='test occasion', participants=['test1', 'test2'], created_by=self.owner)
+        self.event = Event.objects.create(
+            description='test event', amount=30, expender='test1', utiliser=['test1', 'test2'],
+            split_type='equal', occasion=self.occasion, created_by=self.owner
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+        
+    def tearDown(self):
+        get_user_model().objects.all().delete()
+        Occasion.objects.all().delete()
+        Event.objects.all().delete()
+        
+    def test_description_key_is_saved(self):
+        self.assertEqual(Occasion.objects.get(pk=self.occasion.pk).description_key, description_key('test occasion'))
+        self.assertEqual(Event.objects.get(pk=self.event.pk).description_key, description_key('test event'))
+        response = self.client.post(EVENT_BULK_URL, [{
+            "description": "test bulk event", "amount": 10, "expender": "test1", "utiliser" : ["test1"], "split_type": "equal"
+        }], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Event.objects.get(description='test bulk event').description_key, description_key('test bulk event'))
+        
+    def test_resolve_uses_key_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(resolve(Event.objects.all(), 'test event'), self.event)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"description_key" =', queries.captured_queries[0]['sql'])
+        
+    def test_resolve_follows_writes(self):
+        resolve(Occasion.objects.all(), 'test occasion')
+        self.occasion.description = 'renamed occasion'
+        self.occasion.save()
+        self.assertEqual(resolve(Occasion.objects.all(), 'renamed occasion'), self.occasion)
+        with self.assertRaises(Occasion.DoesNotExist):
+            resolve(Occasion.objects.all(), 'test occasion')
+            
+        resolve(Event.objects.all(), 'test event')
+        self.client.post(EVENT_BULK_URL, [{
+            "description": "test event", "amount": 10, "expender": "test1", "utiliser" : ["test1"], "split_type": "equal"
+        }], format='json')
+        with self.assertRaises(Event.MultipleObjectsReturned):
+            resolve(Event.objects.all(), 'test event')
+        response = self.client.post(EXPENSE_URL, {"event": "test event", "user": "test2", "amount": 5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['message'], 'Multiple events found with name: test event.')
+            
+    def test_endpoints_accept_numeric_id(self):
+        response = self.client.post(EVENT_URL, {
+            "description": "test event2", "amount": 20, "expender": "test1", "utiliser" : ["test1", "test2"],
+            "split_type": "equal", "occasion": self.occasion.pk
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['occasion_name'], 'test occasion')
+        
+        response = self.client.post(EVENT_BULK_URL, [{
+            "description": "test event3", "amount": 20, "expender": "test1", "utiliser" : ["test1"],
+            "split_type": "equal", "occasion": str(self.occasion.pk)
+        }], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data[0]['occasion_name'], 'test occasion')
         
+        response = self.client.post(EXPENSE_URL, {"event": self.event.pk, "user": "test2", "amount": 5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated_expense'], {'test1': 15.0, 'test2': 10.0})
+        
+        response = self.client.post(EXPENSE_BATCH_URL, {'entries': [
+            {"event": self.event.pk, "user": "test2", "amount": 5}, {"event": "test event", "user": "test1", "amount": 5}
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['cleared'], 2)
+        
+    def test_description_is_preferred_over_numeric_id(self):
+        named = Occasion.objects.create(description=str(self.occasion.pk), participants=['test1'], created_by=self.owner)
+        self.assertEqual(resolve(Occasion.objects.all(), str(self.occasion.pk)), named)
+        self.assertEqual(resolve(Occasion.objects.all(), str(named.pk)), named) # no description matches, so it is the id
+        
+        response = self.client.post(EVENT_URL, {
+            "description": "test event2", "amount": 20, "expender": "test1", "utiliser" : ["test1"],
+            "split_type": "equal", "occasion": str(self.occasion.pk)
+        }, format='json')
+        self.assertEqual(response.data['occasion_name'], str(self.occasion.pk))
+        response = self.client.post(EVENT_BULK_URL, [{
+            "description": "test event3", "amount": 20, "expender": "test1", "utiliser" : ["test1"],
+            "split_type": "equal", "occasion": str(self.occasion.pk)
+        }], format='json')
+        self.assertEqual(response.data[0]['occasion_name'], str(self.occasion.pk))
+        
+        Event.objects.create(
+            description=str(self.event.pk), amount=40, expender='test1', utiliser=['test1', 'test2'],
+            split_type='equal', created_by=self.owner
+        )
+        response = self.client.post(EXPENSE_URL, {"event": str(self.event.pk), "user": "test2", "amount": 5}, format='json')
+        self.assertEqual(response.data['updated_expense'], {'test1': 20.0, 'test2': 15.0})
+        response = self.client.post(EXPENSE_BATCH_URL, {'entries': [
+            {"event": str(self.event.pk), "user": "test2", "amount": 5}
+        ]}, format='json')
+        self.assertEqual(response.data['cleared'], 1)
+        self.assertEqual(Share.objects.get(event__description=str(self.event.pk), participant='test2').cleared, 10)
+        self.assertEqual(Share.objects.get(event=self.event, participant='test2').cleared, 0)
+
+class CachedJWTAuthenticationTest(TestCase):
+    """ This testcase tests that CachedJWTAuthentication serves tokens from the cache and follows changes of the user. """
+    
+    def setUp(self):
+        caches[settings.SPLIT_IT_AUTH_CACHE].clear()
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.access = get_tokens_for_user(self.owner)['access']
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.access)
+        
+    def tearDown(self):
+        get_user_model().objects.all().delete()
+        Occasion.objects.all().delete()
+        
+    def authenticate(self, authentication=None):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION='Bearer ' + self.access)
+        return (authentication or CachedJWTAuthentication()).authenticate(request)[0]
+        
+    def test_cached_user_needs_no_query(self):
+        with self.assertNumQueries(1):
+            user = self.authenticate()
+        with self.assertNumQueries(0):
+            cached_user = self.authenticate()
+        for found in [user, cached_user]:
+            self.assertEqual((found.pk, found.username, found.is_active), (self.owner.pk, 'testuser', True))
+        with self.assertNumQueries(1):
+            self.authenticate(JWTAuthentication())
+            
+    def test_user_changes_are_followed(self):
+        self.authenticate()
+        self.owner.username = 'renameduser'
+        self.owner.save()
+        self.assertEqual(self.authenticate().username, 'renameduser')
+        
+        self.owner.is_active = False
+        self.owner.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+        self.assertEqual(self.client.get(OCCASION_URL, format='json').status_code, status.HTTP_401_UNAUTHORIZED)
+        
+    def test_deleted_user_is_refused(self):
+        self.authenticate()
+        self.owner.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+            
+    def test_lightweight_user_can_create_and_list(self):
+        response = self.client.post(OCCASION_URL, {'description': 'test occasion', 'participants': ['test1']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Occasion.objects.get(description='test occasion').created_by, self.owner)
+        response = self.client.get(OCCASION_URL, format='json')
+        self.assertEqual(len(response.data['results']), 1)
+
+@override_settings(SPLIT_IT_PBKDF2_ITERATIONS=1000)
+class AsyncAuthApiTest(TestCase):
+    """ This testcase tests the async register and login endpoints hashing on the bounded pool. """
+    
+    def setUp(self):
+        self.client = APIClient()
+        
+    def tearDown(self):
+        get_user_model().objects.all().delete()
+        
+    def register(self):
+        data = {
+            'username': 'testuser',
+            'email': 'testuser@example.com',
+            'password': 'testpassword'
+        }
+        return self.client.post(ASYNC_REGISTER_USER_URL, data, format='json')
+        
+    def test_register_and_login(self):
+        response = self.register()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json(), {'username': 'testuser', 'email': 'testuser@example.com'})
+        self.assertTrue(get_user_model().objects.get(username='testuser').password.startswith('pbkdf2_sha256$1000$'))
+        self.assertEqual(self.register().status_code, status.HTTP_400_BAD_REQUEST)
+        
+        for url in [ASYNC_LOGIN_USER_URL, LOGIN_USER_URL]:
+            response = self.client.post(url, {'username': 'testuser', 'password': 'testpassword'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertIn('access', response.json())
+            
+    def test_login_invalid_credentials(self):
+        self.register()
+        for data in [{'username': 'testuser', 'password': 'wrongpassword'}, {'username': 'nouser', 'password': 'testpassword'}]:
+            response = self.client.post(ASYNC_LOGIN_USER_URL, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertEqual(response.json(), {'message': 'Invalid Credentials'})
+        response = self.client.post(ASYNC_LOGIN_USER_URL, {'username': 'testuser'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        get_user_model().objects.filter(username='testuser').update(is_active=False)
+        response = self.client.post(ASYNC_LOGIN_USER_URL, {'username': 'testuser', 'password': 'testpassword'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        
+    def test_login_upgrades_hash_iterations(self):
+        self.register()
+        with override_settings(SPLIT_IT_PBKDF2_ITERATIONS=2000):
+            response = self.client.post(ASYNC_LOGIN_USER_URL, {'username': 'testuser', 'password': 'testpassword'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(get_user_model().objects.get(username='testuser').password.startswith('pbkdf2_sha256$2000$'))
+        
+    @override_settings(SPLIT_IT_HASHING_WORKERS=1, SPLIT_IT_HASHING_QUEUE=0)
+    def test_full_pool_answers_503(self):
+        self.register()
+        pool = HashingPool()
+        release = threading.Event()
+        pool.submit(release.wait)
+        try:
+            with self.assertRaises(HashingBusy):
+                pool.submit(release.wait)
+            with mock.patch('split_it_app.views.hashing_pool', pool):
+                response = self.client.post(ASYNC_LOGIN_USER_URL, {'username': 'testuser', 'password': 'testpassword'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '1')
+        finally:
+            release.set()
+            pool.shutdown()
+        self.assertEqual(pool.submit(int).result(), 0)
+        pool.shutdown()
+
+class OccasionExportApiTest(TestCase):
+    """ This testcase tests the streaming NDJSON and CSV export of an occasion. """
+    
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.occasion = Occasion.objects.create(description='test occasion', participants=['test1', 'test2', 'ab11c'], created_by=self.owner)
+        for index in range(5):
+            Event.objects.create(
+                description=f'test event{index}', amount=30 + index, expender='test1', utiliser=['test1', 'test2'],
+                split_type='equal', occasion=self.occasion, created_by=self.owner
+            )
+        Event.objects.get(description='test event0').clear_expense('test2', 5)
+        self.export_url = reverse('split_it_app:occasion-export', args=[self.occasion.pk])
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+        
+    def tearDown(self):
+        get_user_model().objects.all().delete()
+        Occasion.objects.all().delete()
+        Event.objects.all().delete()
+        
+    def export(self, export_format, **headers):
+        response = self.client.get(self.export_url, {'format': export_format}, **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+        
+    @override_settings(SPLIT_IT_EXPORT_CHUNK_SIZE=2)
+    def test_export_ndjson(self):
+        response, content = self.export('ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([record['record'] for record in records], ['event'] * 5 + ['settlement'])
+        self.assertEqual(records[0], {
+            'record': 'event', 'event_id': Event.objects.get(description='test event0').pk, 'description': 'test event0',
+            'expender': 'test1', 'split_type': 'equal', 'amount': '30.00',
+            'shares': [{'participant': 'test1', 'owed': '15.00', 'cleared': '0.00'}, {'participant': 'test2', 'owed': '15.00', 'cleared': '5.00'}],
+        })
+        self.assertEqual(records[-1], {'record': 'settlement', 'event_id': records[0]['event_id'], 'description': 'test event0', 'participant': 'test2', 'amount': '5.00'})
+        
+    def test_export_csv(self):
+        response, content = self.export('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn(f'occasion-{self.occasion.pk}.csv', response['Content-Disposition'])
+        rows = list(csv.DictReader(content.decode().splitlines()))
+        self.assertEqual(len(rows), 5 + 10 + 1)
+        self.assertEqual([row['record'] for row in rows[:3]], ['event', 'share', 'share'])
+        self.assertEqual((rows[2]['participant'], rows[2]['amount'], rows[2]['cleared']), ('test2', '15.00', '5.00'))
+        self.assertEqual((rows[-1]['record'], rows[-1]['participant'], rows[-1]['amount']), ('settlement', 'test2', '5.00'))
+        
+    def test_export_gzip(self):
+        _, plain = self.export('ndjson')
+        response, compressed = self.export('ndjson', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed), plain)
+        
+    def test_export_missing_occasion_or_format(self):
+        response = self.client.get(reverse('split_it_app:occasion-export', args=[self.occasion.pk + 1]), {'format': 'csv'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(self.export_url, {'format': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        
+    def test_export_of_another_user_occasion(self):
+        self.client.force_authenticate(user=get_user_model().objects.create_user(username='otheruser', password='testpassword'))
+        response = self.client.get(self.export_url, {'format': 'ndjson'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class ImportSplitDataTest(TestCase):
+    """ This testcase tests the chunked import of occasions and events with the import_split_data command. """
+
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'import.jsonl')
+        rows = [{'record': 'occasion', 'description': 'test occasion', 'participants': ['test1', 'test2', 'ab11c']}]
+        rows += [
+            {'description': f'test event{index}', 'amount': 100 + index, 'expender': 'test1', 'utiliser': ['test1', 'test2', 'ab11c'],
+             'split_type': 'equal', 'occasion': 'test occasion'}
+            for index in range(5)
+        ]
+        rows.append({'description': 'test event0', 'amount': 100, 'expender': 'test1', 'utiliser': ['test1'], 'split_type': 'equal'})
+        with open(self.path, 'w') as file:
+            file.writelines(json.dumps(row) + '\n' for row in rows)
+            file.write('not json\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+        get_user_model().objects.all().delete()
+        Occasion.objects.all().delete()
+        Event.objects.all().delete()
+
+    def import_data(self, *args):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_split_data', self.path, '--owner', 'testuser', '--workers', '1', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_in_chunks(self):
+        stdout, stderr = self.import_data('--chunk-size', '3')
+        self.assertIn('Imported 5 events and 1 occasions, skipped 2 rows', stdout)
+        self.assertIn('line 7 skipped', stderr)
+        self.assertIn('line 8 skipped: Invalid JSON', stderr)
+        occasion = Occasion.objects.get(description='test occasion')
+        self.assertEqual(occasion.event_occasions.count(), 5)
+        for event in Event.objects.prefetch_related('shares'):
+            self.assertEqual(event.created_by, self.owner)
+            self.assertEqual({share.participant: share.owed for share in event.shares.all()}, event.calculate_split())
+        self.assertEqual(occasion.get_ledger_summary(), occasion.get_expenditure_summary())
+
+    def test_resume_skips_committed_rows(self):
+        with open(self.path + '.checkpoint', 'w') as file:
+            json.dump({'rows': 4}, file)
+        Occasion.objects.create(description='test occasion', participants=['test1', 'test2', 'ab11c'], created_by=self.owner)
+        stdout, _ = self.import_data('--resume')
+        self.assertIn('Resuming after 4 committed rows.', stdout)
+        self.assertEqual(sorted(Event.objects.values_list('description', flat=True)), ['test event0', 'test event3', 'test event4'])
+        with open(self.path + '.checkpoint') as file:
+            self.assertEqual(json.load(file), {'rows': 8})
+
+    def test_unknown_owner(self):
+        with self.assertRaises(CommandError):
+            call_command('import_split_data', self.path, '--owner', 'nobody', stdout=StringIO())
+
+@override_settings(SPLIT_IT_PBKDF2_ITERATIONS=1000)
+class BenchTest(TestCase):
+    """ This testcase tests the deterministic data generator and the route benchmark. """
+
+    def tearDown(self):
+        get_user_model().objects.all().delete()
+        Occasion.objects.all().delete()
+        Event.objects.all().delete()
+
+    def snapshot(self):
+        return (
+            list(Event.objects.order_by('description').values_list('description', 'amount', 'expender', 'utiliser', 'split', 'occasion__description')),
+            list(ExpenditureSummary.objects.order_by('event__description').values_list('event__description', 'user', 'amount')),
+        )
+
+    def test_generate_is_deterministic(self):
+        counts = generate(seed=7, users=5, occasions=3, events=40, settlements=10, batch_size=16)
+        self.assertEqual((counts['events'], counts['settlements']), (40, 10))
+        self.assertEqual(Share.objects.count(), counts['shares'])
+        first = self.snapshot()
+        for occasion in Occasion.objects.all():
+            self.assertEqual(occasion.get_ledger_summary(), occasion.get_expenditure_summary())
+
+        self.tearDown()
+        generate(seed=7, users=5, occasions=3, events=40, settlements=10)
+        self.assertEqual(self.snapshot(), first)
+
+    def test_bench_writes_results_and_finds_regressions(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        output = os.path.join(directory.name, 'bench.json')
+        arguments = ['--users', '5', '--occasions', '2', '--events', '30', '--settlements', '5', '--requests', '3']
+        call_command('bench', *arguments, '--output', output, stderr=StringIO())
+
+        with open(output) as file:
+            results = json.load(file)
+        self.assertEqual(set(results['routes']), {
+            'POST register_users', 'POST login_users', 'POST register_users_async', 'POST login_users_async', 'GET get_users',
+            'GET user-balances', 'GET occasion-view-create', 'POST occasion-view-create', 'GET occasion-summary', 'GET occasion-settle-plan',
+            'GET occasion-export', 'GET event-view-create', 'POST event-view-create', 'POST event-bulk-create',
+            'POST expense-clear', 'POST expense-clear-batch',
+        })
+        summary = results['routes']['GET occasion-summary']
+        self.assertTrue(summary['p50_ms'] <= summary['p95_ms'] <= summary['p99_ms'])
+        self.assertIn('active expense', results['explain'])
+        self.assertFalse(Event.objects.exists()) # everything is rolled back
+
+        baseline = {'routes': {route: dict(result, p95_ms=result['p95_ms'] * 10) for route, result in results['routes'].items()}}
+        self.assertEqual(compare(results, baseline, 0.2), [])
+        baseline['routes']['GET occasion-summary'].update(p95_ms=summary['p95_ms'] / 10, queries=summary['queries'] - 1)
+        self.assertEqual(len(compare(results, baseline, 0.2)), 2)
+
+class RequestMetricsTest(TestCase):
+    """ This testcase tests the Server-Timing header and the /metrics histograms of RequestMetricsMiddleware. """
+    
+    def setUp(self):
+        metrics_store.clear()
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        Event.objects.create(description='test event', amount=30, expender='test1', utiliser=['test1', 'test2'], split_type='equal', created_by=self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+        
+    def tearDown(self):
+        metrics_store.clear()
+        get_user_model().objects.all().delete()
+        Event.objects.all().delete()
+        
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(EVENT_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timing = response['Server-Timing']
+        self.assertIn(f'desc="{len(queries)} queries"', timing)
+        self.assertRegex(timing, r'^db;dur=[0-9.]+;desc="[0-9]+ queries", serialize;dur=[0-9.]+, total;dur=[0-9.]+$')
+        
+    def test_metrics_histograms(self):
+        self.client.get(EVENT_URL)
+        self.client.get(EVENT_URL)
+        content = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('# TYPE split_it_request_duration_seconds histogram', content)
+        self.assertIn('split_it_request_duration_seconds_count{view="split_it_app:event-view-create"} 2', content)
+        self.assertIn('split_it_db_queries_bucket{view="split_it_app:event-view-create",le="+Inf"} 2', content)
+        
+    def test_metrics_are_shared_between_processes(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with override_settings(SPLIT_IT_METRICS_DIR=directory.name):
+            self.client.get(EVENT_URL)
+            other = [[name, view, list(histogram)] for (name, view), histogram in metrics_store.snapshot().items()]
+            with open(os.path.join(directory.name, 'metrics-0.json'), 'w') as file:
+                json.dump(other, file)
+            content = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('split_it_request_duration_seconds_count{view="split_it_app:event-view-create"} 2', content)
+        
+class ProfilingTest(TestCase):
+    """ This testcase tests the on demand profiling of requests and the admin only profiles endpoints. """
+    
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        profile_settings = override_settings(SPLIT_IT_PROFILE_DIR=directory.name, SPLIT_IT_PROFILE_KEEP=2, SPLIT_IT_PROFILE_SAMPLE_RATE=0)
+        profile_settings.enable()
+        self.addCleanup(profile_settings.disable)
+        self.staff = get_user_model().objects.create_user(username='staffuser', password='testpassword', is_staff=True)
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.client = APIClient()
+        
+    def tearDown(self):
+        get_user_model().objects.all().delete()
+        
+    def get_events(self, user, **headers):
+        return self.client.get(EVENT_URL, HTTP_AUTHORIZATION='Bearer ' + get_tokens_for_user(user)['access'], **headers)
+        
+    def test_staff_request_is_profiled(self):
+        response = self.get_events(self.staff, HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        name = response['X-Profile-Id']
+        
+        self.client.force_authenticate(user=self.staff)
+        profiles = self.client.get(reverse('split_it_app:profile-list')).data
+        self.assertEqual([(profile['name'], profile['path'], profile['status']) for profile in profiles], [(name, EVENT_URL, 200)])
+        response = self.client.get(reverse('split_it_app:profile-download', args=[name]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with tempfile.NamedTemporaryFile() as file:
+            file.write(b''.join(response.streaming_content))
+            file.flush()
+            self.assertTrue(pstats.Stats(file.name).total_calls)
+        
+    def test_other_requests_are_not_profiled(self):
+        self.assertNotIn('X-Profile-Id', self.get_events(self.owner, HTTP_X_PROFILE='1'))
+        self.assertNotIn('X-Profile-Id', self.get_events(self.staff))
+        with override_settings(SPLIT_IT_PROFILE_SAMPLE_RATE=1):
+            self.assertIn('X-Profile-Id', self.get_events(self.owner))
+        
+    def test_profiles_are_a_bounded_ring(self):
+        names = [self.get_events(self.staff, HTTP_X_PROFILE='1')['X-Profile-Id'] for _ in range(3)]
+        self.client.force_authenticate(user=self.staff)
+        self.assertEqual([profile['name'] for profile in self.client.get(reverse('split_it_app:profile-list')).data], names[:0:-1])
+        response = self.client.get(reverse('split_it_app:profile-download', args=[names[0]]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('split_it_app:profile-download', args=['..']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        
+    def test_profiles_are_admin_only(self):
+        self.client.force_authenticate(user=self.owner)
+        self.assertEqual(self.client.get(reverse('split_it_app:profile-list')).status_code, status.HTTP_403_FORBIDDEN)
+        
+class SqliteProductionProfileTest(TestCase):
+    """ This testcase tests the sqlite pragmas of the production profile and the retries of locked writes. """
+    
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+        
+    def tearDown(self):
+        get_user_model().objects.all().delete()
+        Event.objects.all().delete()
+        
+    def test_production_pragmas(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = sqlite3.connect(os.path.join(directory, 'db.sqlite3'))
+            apply_pragmas(database, settings.SPLIT_IT_SQLITE_PRODUCTION_PRAGMAS)
+            self.assertEqual(database.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(database.execute('PRAGMA synchronous').fetchone()[0], 1) # normal
+            self.assertEqual(database.execute('PRAGMA busy_timeout').fetchone()[0], settings.SPLIT_IT_SQLITE_PRODUCTION_PRAGMAS['busy_timeout'])
+            database.close()
+            
+    @override_settings(SPLIT_IT_SQLITE_PRAGMAS={'cache_size': -1234})
+    def test_pragmas_are_applied_to_new_connections(self):
+        new_connection = connections.create_connection('default')
+        try:
+            with new_connection.cursor() as cursor:
+                cursor.execute('PRAGMA cache_size')
+                self.assertEqual(cursor.fetchone()[0], -1234)
+        finally:
+            new_connection.close()
+            
+    def create_event(self, failures):
+        create = EventSerializer.create
+        attempts = []
+        
+        def locked_create(serializer, validated_data):
+            attempts.append(1)
+            if len(attempts) <= failures:
+                raise OperationalError('database is locked')
+            return create(serializer, validated_data)
+        
+        data = {"description": "test event", "amount": 30, "expender": "test1", "utiliser": ["test1", "test2"], "split_type": "equal"}
+        with mock.patch.object(EventSerializer, 'create', locked_create):
+            return self.client.post(EVENT_URL, data, format='json')
+        
+    @override_settings(SPLIT_IT_CONFLICT_BACKOFF=0)
+    def test_locked_write_is_retried(self):
+        response = self.create_event(failures=2)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Event.objects.get(description='test event').expense_split, {'test1': 15.0, 'test2': 15.0})
+        
+    @override_settings(SPLIT_IT_CONFLICT_BACKOFF=0, SPLIT_IT_CONFLICT_RETRIES=3)
+    def test_busy_database_answers_503(self):
+        response = self.create_event(failures=3)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(Event.objects.exists())
+        
+@override_settings(SPLIT_IT_REPLICA_ALIAS='replica', SPLIT_IT_REPLICA_MAX_LAG=5, SPLIT_IT_REPLICA_PIN_SECONDS=10)
+class ReplicaRouterTest(TestCase):
+    """ This testcase tests routing the reads to the replica and pinning them to the primary. """
+    
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+        lag = mock.patch.object(replica_lag, 'get', return_value=0.5)
+        self.lag = lag.start()
+        self.addCleanup(lag.stop)
+        # every testcase runs in a transaction, which would keep all reads on the primary.
+        atomic = mock.patch.object(connection, 'in_atomic_block', False)
+        atomic.start()
+        self.addCleanup(atomic.stop)
+        
+    def serve(self, request, write=False, user=None):
+        def view(request):
+            if user is not None:
+                request.user = user # as DRF does once it authenticated the request
+            reads = [self.router.db_for_read(Event)]
+            if write:
+                self.router.db_for_write(Event)
+                reads.append(self.router.db_for_read(Event)) # the request reads its own write
+            return HttpResponse(' '.join(reads))
+        return ReplicaPinningMiddleware(view)(request)
+        
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(self.router.db_for_read(Event), 'replica')
+        self.assertEqual(self.serve(self.factory.get('/')).content, b'replica')
+        self.assertEqual(self.router.db_for_write(Event), 'default')
+        
+    def test_writes_pin_reads_to_the_primary(self):
+        self.assertEqual(self.serve(self.factory.post('/')).content, b'default')
+        response = self.serve(self.factory.get('/'), write=True)
+        self.assertEqual(response.content, b'replica default') # read before and after the write
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 10)
+        self.assertNotIn(PIN_COOKIE, self.serve(self.factory.get('/')).cookies)
+        
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        self.assertEqual(self.serve(request).content, b'default')
+        
+    def test_writes_pin_the_reads_of_the_user_without_cookies(self):
+        caches[settings.SPLIT_IT_REPLICA_PIN_CACHE].clear()
+        writer = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        reader = get_user_model().objects.create_user(username='otheruser', password='testpassword')
+        self.assertEqual(self.serve(self.factory.get('/'), user=writer).content, b'replica')
+        self.serve(self.factory.get('/'), write=True, user=writer)
+        self.assertEqual(self.serve(self.factory.get('/'), user=writer).content, b'default')
+        self.assertEqual(self.serve(self.factory.get('/'), user=reader).content, b'replica')
+        self.assertEqual(self.serve(self.factory.get('/')).content, b'replica')
+        
+    def test_lagging_replica_falls_back_to_the_primary(self):
+        self.lag.return_value = 6
+        self.assertEqual(self.serve(self.factory.get('/')).content, b'default')
+        
+    def test_migrations_skip_the_replica(self):
+        self.assertFalse(self.router.allow_migrate('replica', 'split_it_app'))
+        self.assertTrue(self.router.allow_migrate('default', 'split_it_app'))
+        
+class SyncReplicaTest(TransactionTestCase):
+    """ This testcase tests copying the primary to a sqlite replica and measuring its lag. """
+    
+    def test_copy_to_replica(self):
+        owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        Occasion.objects.create(description='test occasion', participants=['test1'], created_by=owner)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'replica.sqlite3')
+            copy_to_replica(path)
+            replica = sqlite3.connect(path)
+            try:
+                self.assertEqual(replica.execute('SELECT description FROM split_it_app_occasion').fetchall(), [('test occasion',)])
+                updated_at = replica.execute('SELECT updated_at FROM split_it_app_replicaheartbeat').fetchone()[0]
+                self.assertAlmostEqual(updated_at, ReplicaHeartbeat.objects.get().updated_at)
+            finally:
+                replica.close()
+                
+    def test_lag_of_missing_heartbeat_is_infinite(self):
+        with override_settings(SPLIT_IT_REPLICA_ALIAS='default'):
+            self.assertEqual(ReplicaLag().measure(), float('inf'))
+            ReplicaHeartbeat.objects.create(pk=1, updated_at=time.time() - 3)
+            self.assertAlmostEqual(ReplicaLag().measure(), 3, delta=1)
+        
+class FastReadSerializationTest(TestCase):
+    """ This testcase checks that the values() rows and the orjson and MessagePack renderers give what the serializers do. """
+    
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        occasion = Occasion.objects.create(description='trip \u2028 é', participants=['test1', 'test2', 'test3'], created_by=self.owner)
+        Occasion.objects.create(description='empty occasion', participants=[], created_by=self.owner)
+        Event.objects.create(description='dinner', amount=Decimal('100.10'), expender='test1', utiliser=['test1', 'test2', 'test3'], split_type='equal', occasion=occasion, created_by=self.owner)
+        Event.objects.create(
+            description='taxi', amount=90, expender='test2', utiliser=['test1', 'test2'], split_type='percentage',
+            split=[25, 75], occasion=occasion, created_by=self.owner
+        )
+        Event.objects.create(description='standalone', amount=Decimal('7.5'), expender='test3', utiliser=['test3', 'test1'], split_type='equal', created_by=self.owner)
+        Share.objects.filter(participant='test2').update(cleared=Decimal('10.05'))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+        
+    def tearDown(self):
+        get_user_model().objects.all().delete()
+        Occasion.objects.all().delete()
+        Event.objects.all().delete()
+        
+    def test_rows_match_the_serializers(self):
+        events = Event.objects.order_by('pk')
+        self.assertEqual(
+            json.dumps(event_list(list(event_values(events)))),
+            json.dumps(EventSerializer(events.select_related('occasion').prefetch_related('shares'), many=True).data)
+        )
+        occasions = Occasion.objects.order_by('pk')
+        self.assertEqual(
+            json.dumps(occasion_list(list(occasion_values(occasions)))),
+            json.dumps(OccasionSerializer(occasions.prefetch_related('event_occasions__shares'), many=True).data)
+        )
+        
+    def test_listings_match_the_serializers(self):
+        response = self.client.get(EVENT_URL, format='json')
+        self.assertEqual(response.json()['results'], json.loads(json.dumps(EventSerializer(Event.objects.order_by('pk'), many=True).data)))
+        response = self.client.get(OCCASION_URL, format='json')
+        self.assertEqual(response.json()['results'], json.loads(json.dumps(OccasionSerializer(Occasion.objects.order_by('pk'), many=True).data)))
+        
+    @skipUnless(orjson, 'orjson is not installed')
+    def test_orjson_renders_the_values_of_the_json_renderer(self):
+        data = {
+            'results': EventSerializer(Event.objects.all(), many=True).data, 'occasion': OccasionSerializer(Occasion.objects.first()).data,
+            'amount': Decimal('1.50'), 'created': timezone.now(), 'ids': {1: 'one'}, 'float': 0.1, 'big': 2 ** 70,
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(ORJSONRenderer().render(data, 'application/json; indent=2'), JSONRenderer().render(data, 'application/json; indent=2'))
+        
+    @skipUnless(orjson, 'orjson is not installed')
+    def test_orjson_float_differences(self):
+        data = {'large': 1e16, 'small': 1e-7}
+        self.assertEqual(ORJSONRenderer().render(data), b'{"large":1e16,"small":1e-7}')
+        self.assertEqual(JSONRenderer().render(data), b'{"large":1e+16,"small":1e-07}')
+        self.assertEqual(json.loads(ORJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+        
+        self.assertEqual(ORJSONRenderer().render({'nan': float('nan'), 'inf': float('inf')}), b'{"nan":null,"inf":null}')
+        with self.assertRaises(ValueError):
+            JSONRenderer().render({'nan': float('nan')})
+        
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_msgpack_is_negotiated(self):
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_RENDERER_CLASSES': ('split_it_app.renderers.TimedORJSONRenderer', 'split_it_app.renderers.TimedMessagePackRenderer')}):
+            response = self.client.get(EVENT_URL, HTTP_ACCEPT='application/msgpack')
+            self.assertEqual(response['Content-Type'], 'application/msgpack')
+            self.assertEqual(msgpack.unpackb(response.content), self.client.get(EVENT_URL).json())
+        data = {'amount': Decimal('1.50'), 'created': timezone.now()}
+        self.assertEqual(msgpack.unpackb(MessagePackRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+        
+class PairBalanceTest(TestCase):
+    """ This testcase tests the incrementally maintained pairwise balances, users/me/balances and check_balances. """
+    
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.occasion = Occasion.objects.create(description='trip', participants=['testuser', 'test1', 'test2'], created_by=self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+        
+    def tearDown(self):
+        get_user_model().objects.all().delete()
+        Occasion.objects.all().delete()
+        Event.objects.all().delete()
+        
+    def create_event(self, description, amount, expender, utiliser, occasion=None):
+        return Event.objects.create(
+            description=description, amount=amount, expender=expender, utiliser=utiliser, split_type='equal',
+            occasion=occasion, created_by=self.owner
+        )
+        
+    def balances(self):
+        return {(row.debtor, row.creditor): row.amount for row in PairBalance.objects.exclude(amount=0)}
+        
+    def test_balances_follow_events_and_clearances(self):
+        dinner = self.create_event('dinner', 30, 'testuser', ['testuser', 'test1', 'test2'], self.occasion)
+        self.create_event('taxi', 10, 'test1', ['testuser', 'test1'])
+        Event.bulk_create_with_shares([Event(description='museum', amount=8, expender='test1', utiliser=['test1', 'test2'], split_type='equal', created_by=self.owner)])
+        self.assertEqual(self.balances(), {('test1', 'testuser'): 10, ('test2', 'testuser'): 10, ('testuser', 'test1'): 5, ('test2', 'test1'): 4})
+        
+        dinner.clear_expense('test1', 4)
+        Event.clear_expenses([{'event': 'dinner', 'user': 'test2', 'amount': 10}, {'event': 'taxi', 'user': 'test1', 'amount': 5}])
+        self.assertEqual(self.balances(), {('test1', 'testuser'): 6, ('testuser', 'test1'): 5, ('test2', 'test1'): 4})
+        
+        dinner.expender = 'test2'
+        dinner.save() # saving starts the split afresh
+        Event.objects.get(description='museum').delete()
+        self.assertEqual(self.balances(), {('test1', 'test2'): 10, ('testuser', 'test2'): 10, ('testuser', 'test1'): 5})
+        self.assertEqual(PairBalance.differences(), {})
+        
+    def test_balances_api(self):
+        self.create_event('dinner', 30, 'testuser', ['testuser', 'test1', 'test2'], self.occasion)
+        self.create_event('taxi', 10, 'test1', ['testuser', 'test1'])
+        self.create_event('unrelated', 10, 'test1', ['test2', 'test1'])
+        with self.assertNumQueries(1):
+            response = self.client.get(BALANCES_URL, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'user': 'testuser', 'owes': {'test1': 5.0}, 'owed_by': {'test1': 10.0, 'test2': 10.0}, 'net': {'test1': 5.0, 'test2': 10.0}
+        })
+        
+    def test_check_balances(self):
+        self.create_event('dinner', 30, 'testuser', ['testuser', 'test1', 'test2'], self.occasion)
+        call_command('check_balances', stdout=StringIO())
+        
+        PairBalance.objects.filter(debtor='test1').update(amount=3)
+        PairBalance.objects.create(debtor='test2', creditor='test1', amount=1)
+        with self.assertRaises(CommandError):
+            call_command('check_balances', stdout=StringIO())
+        self.assertEqual(len(PairBalance.differences()), 2)
+        call_command('check_balances', '--repair', stdout=StringIO())
+        self.assertEqual(self.balances(), {('test1', 'testuser'): 10, ('test2', 'testuser'): 10})
+        
+class ExpenditureSnapshotTest(TestCase):
+    """ This testcase checks that the summaries read from the compacted expenditure history match a full scan. """
+    
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.occasion = Occasion.objects.create(description='trip', participants=['test1', 'test2', 'test3'], created_by=self.owner)
+        self.events = [
+            Event.objects.create(
+                description=f'event {index}', amount=90, expender='test1', utiliser=['test1', 'test2', 'test3'],
+                split_type='equal', occasion=self.occasion, created_by=self.owner
+            )
+            for index in range(3)
+        ]
+        self.standalone = Event.objects.create(description='standalone', amount=20, expender='test2', utiliser=['test1', 'test2'], split_type='equal', created_by=self.owner)
+        
+    def tearDown(self):
+        get_user_model().objects.all().delete()
+        Occasion.objects.all().delete()
+        Event.objects.all().delete()
+        
+    def clear(self, amount):
+        for event in self.events:
+            event.clear_expense('test2', amount)
+            event.clear_expense('test3', amount)
+        self.standalone.clear_expense('test1', amount)
+        
+    def assert_matches_full_scan(self, summary):
+        self.assertEqual(ExpenditureSummary.cleared_totals(event__occasion=self.occasion), ExpenditureSummary.full_scan_totals(event__occasion=self.occasion))
+        self.assertEqual(ExpenditureSummary.cleared_totals(), ExpenditureSummary.full_scan_totals())
+        self.assertEqual(self.occasion.get_expenditure_summary(), summary)
+        
+    def test_snapshot_and_delta_match_full_scan(self):
+        self.clear(5)
+        summary = self.occasion.get_expenditure_summary()
+        self.assertEqual(ExpenditureSnapshot.compact(), (ExpenditureSummary.objects.latest('pk').pk, 7, 0))
+        self.assertEqual(ExpenditureSnapshot.objects.get(event=self.events[0], user='test2').amount, 5)
+        self.assert_matches_full_scan(summary)
+        
+        self.clear(2) # read from the history after the watermark
+        summary['cleared_expense'] = {'test2': 21.0, 'test3': 21.0}
+        summary['total_active_expense'] = {'test1': 90.0, 'test2': 69.0, 'test3': 69.0}
+        self.assert_matches_full_scan(summary)
+        with self.assertNumQueries(1):
+            ExpenditureSummary.cleared_totals(event__occasion=self.occasion)
+            
+        self.assertEqual(ExpenditureSnapshot.compact(archive=True)[1:], (7, 14))
+        self.assertFalse(ExpenditureSummary.objects.exists())
+        self.assertEqual(ExpenditureSnapshot.objects.get(event=self.events[0], user='test2').amount, 7)
+        self.assert_matches_full_scan(summary)
+        self.assertEqual(ExpenditureSnapshot.compact(), (ExpenditureWatermark.objects.get().watermark, 0, 0))
+        
+        self.clear(1) # ids keep growing after the history was archived
+        self.assertFalse(ExpenditureSummary.objects.filter(pk__lte=ExpenditureWatermark.objects.get().watermark).exists())
+        self.assertEqual(ExpenditureSummary.cleared_totals(event__occasion=self.occasion), {'test2': Decimal('24'), 'test3': Decimal('24')})
+        self.assert_matches_full_scan(self.occasion.get_expenditure_summary())
+        
+    def test_ledger_rebuild_and_export_read_the_archive(self):
+        self.clear(5)
+        ledger = list(ParticipantLedger.objects.filter(occasion=self.occasion).order_by('participant').values_list('participant', 'active_expense', 'cleared_expense'))
+        call_command('compact_expenditure', '--archive', stdout=StringIO())
+        self.assertEqual(ExpenditureArchive.objects.count(), 7)
+        
+        OccasionLedger.rebuild(self.occasion.pk)
+        self.assertEqual(list(ParticipantLedger.objects.filter(occasion=self.occasion).order_by('participant').values_list('participant', 'active_expense', 'cleared_expense')), ledger)
+        response = self.client.get(reverse('split_it_app:occasion-export', args=[self.occasion.pk]), {'format': 'ndjson'}, HTTP_AUTHORIZATION='Bearer ' + get_tokens_for_user(self.owner)['access'])
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len([record for record in records if record['record'] == 'settlement']), 6)
+        
+# the split_it_app routes with every async view selected, the async test cases below run against them.
+urlpatterns = [
+    path('split_it_app/schema/', SpectacularAPIView.as_view(), name='schema'),
+    path('split_it_app/', include((build_urlpatterns({'*'}), 'split_it_app'))),
+]
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncStackTest(TestCase):
+    """ This testcase checks that the async urlconf serves the read endpoints with the async views. """
+    
+    def test_async_views_are_selected(self):
+        for url in [OCCASION_URL, EVENT_URL, reverse('split_it_app:get_users'), BALANCES_URL, reverse('split_it_app:occasion-summary', args=[1])]:
+            self.assertTrue(issubclass(resolve_url(url).func.view_class, AsyncAPIView))
+        self.assertFalse(issubclass(resolve_url(EVENT_BULK_URL).func.view_class, AsyncAPIView))
+        
+    def test_unauthenticated_request_is_refused(self):
+        response = APIClient().get(OCCASION_URL, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+        response = APIClient().get(OCCASION_URL, format='json', HTTP_AUTHORIZATION='Bearer invalid')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncOccasionApiTest(OccasionApiTest):
+    """ OccasionApiTest against the async OccasionApi. """
+    
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncEventApiTest(EventApiTest):
+    """ EventApiTest against the async EventApi. """
+    
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncOccasionSummaryApiTest(OccasionSummaryApiTest):
+    """ OccasionSummaryApiTest against the async OccasionSummaryApi. """
+    
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncListQueryCountTest(ListQueryCountTest):
+    """ ListQueryCountTest against the async OccasionApi and EventApi. """
+    
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncCursorPaginationTest(CursorPaginationTest):
+    """ CursorPaginationTest against the async views. """
+    
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncPairBalanceTest(PairBalanceTest):
+    """ PairBalanceTest against the async UserBalanceApi. """
+    
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncCachedJWTAuthenticationTest(CachedJWTAuthenticationTest):
+    """ CachedJWTAuthenticationTest against the async views. """
@@ -1,14 +1,36 @@
 from django.urls import path, include
-from .views import RegisterApi, LoginApi, UserApi, OccasionApi, EventApi, ExpenseApi, OccasionSummaryApi
+from django.conf import settings
+from .views import RegisterApi, LoginApi, AsyncRegisterApi, AsyncLoginApi, UserApi, UserBalanceApi, OccasionApi, EventApi, EventBulkApi, ExpenseApi, ExpenseBatchApi, OccasionSummaryApi, OccasionSettlePlanApi, OccasionExportApi
+from .views import ProfileListApi, ProfileDownloadApi
+from .views import AsyncUserApi, AsyncUserBalanceApi, AsyncOccasionApi, AsyncEventApi, AsyncOccasionSummaryApi
 
 app_name = 'split_it_app'
 
-urlpatterns = [
-    path('register/', RegisterApi.as_view(), name = 'register_users'),
-    path('login/', LoginApi.as_view(), name = 'login_users'),
-    path('users/', UserApi.as_view(), name = 'get_users'),  
-    path('occasion/', OccasionApi.as_view(), name = 'occasion-view-create'),
-    path('occasion/<int:pk>/summary', OccasionSummaryApi.as_view(), name = 'occasion-summary'),
-    path('event/', EventApi.as_view(), name = 'event-view-create'),
-    path('event/clear_expense', ExpenseApi.as_view(), name = 'expense-clear'),
-]
+def select_view(sync_view, async_view, name, async_routes):
+    """ The async variant of the view when its route is listed in async_routes (SPLIT_IT_ASYNC_ROUTES). """
+    
+    if name in async_routes or '*' in async_routes:
+        return async_view.as_view()
+    return sync_view.as_view()
+
+def build_urlpatterns(async_routes):
+    return [
+        path('register/', RegisterApi.as_view(), name = 'register_users'),
+        path('login/', LoginApi.as_view(), name = 'login_users'),
+        path('register/async/', AsyncRegisterApi.as_view(), name = 'register_users_async'),
+        path('login/async/', AsyncLoginApi.as_view(), name = 'login_users_async'),
+        path('users/', select_view(UserApi, AsyncUserApi, 'get_users', async_routes), name = 'get_users'),  
+        path('users/me/balances', select_view(UserBalanceApi, AsyncUserBalanceApi, 'user-balances', async_routes), name = 'user-balances'),
+        path('occasion/', select_view(OccasionApi, AsyncOccasionApi, 'occasion-view-create', async_routes), name = 'occasion-view-create'),
+        path('occasion/<int:pk>/summary', select_view(OccasionSummaryApi, AsyncOccasionSummaryApi, 'occasion-summary', async_routes), name = 'occasion-summary'),
+        path('occasion/<int:pk>/settle-plan', OccasionSettlePlanApi.as_view(), name = 'occasion-settle-plan'),
+        path('occasion/<int:pk>/export', OccasionExportApi.as_view(), name = 'occasion-export'),
+        path('event/', select_view(EventApi, AsyncEventApi, 'event-view-create', async_routes), name = 'event-view-create'),
+        path('event/bulk/', EventBulkApi.as_view(), name = 'event-bulk-create'),
+        path('event/clear_expense', ExpenseApi.as_view(), name = 'expense-clear'),
+        path('event/clear_expense/batch', ExpenseBatchApi.as_view(), name = 'expense-clear-batch'),
+        path('profiles/', ProfileListApi.as_view(), name = 'profile-list'),
+        path('profiles/<str:name>', ProfileDownloadApi.as_view(), name = 'profile-download'),
+    ]
+
+urlpatterns = build_urlpatterns(settings.SPLIT_IT_ASYNC_ROUTES)
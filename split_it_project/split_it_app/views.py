@@ -1,13 +1,32 @@
+import json
+import os
+from decimal import Decimal
 from rest_framework.response import Response
 from rest_framework import status, generics
 from django.contrib.auth.models import User
-from .serializers import UserSerializer, RegisterSerializer, LoginSerializer, OccasionSerializer, EventSerializer
-from .models import Occasion, Event
+from .serializers import UserSerializer, RegisterSerializer, LoginSerializer, OccasionSerializer, EventSerializer, BulkEventSerializer, ExpenseBatchSerializer
+from .models import Occasion, Event, PairBalance, retry_on_locked
+from .pagination import PrimaryKeyCursorPagination
+from .settlement import settle_plan
+from .lookup import resolve
 from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.http import JsonResponse, StreamingHttpResponse, FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.decorators import method_decorator
+from asgiref.sync import sync_to_async
+from .hashing import hashing_pool, verify_password, HashingBusy
+from .export import NDJSONRenderer, CSVRenderer, export_stream
+from .profiling import list_profiles, profile_path
+from .rows import event_values, occasion_values, event_list, aevent_list, occasion_list, aoccasion_list
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.exceptions import APIException
+from django.conf import settings
+from django.core.cache import caches
 
 # Generates Token
 def get_tokens_for_user(user):
@@ -19,20 +38,47 @@ def get_tokens_for_user(user):
         'access': str(refresh.access_token),
     }
 
-class UserApi(generics.GenericAPIView):
-    """ List all the users in the application. """
+class UserApi(generics.ListAPIView):
+    """ List all the users in the application, a page at a time. """
     
-    authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = PrimaryKeyCursorPagination
     
-    queryset = User.objects.all()
+    queryset = User.objects.only('id', 'username', 'email')
     serializer_class = UserSerializer
+
+def balance_summary(participant, rows):
+    """ What the participant owes and is owed by every counterparty from the (debtor, creditor, amount) balances, and the net per counterparty. """
     
-    def get(self, request):
-        """ Return a list of all users. """
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    owes = {}
+    owed_by = {}
+    net = {}
+    for debtor, creditor, amount in rows:
+        if debtor == participant:
+            owes[creditor] = round(float(amount), 2)
+            net[creditor] = net.get(creditor, Decimal('0')) - amount
+        else:
+            owed_by[debtor] = round(float(amount), 2)
+            net[debtor] = net.get(debtor, Decimal('0')) + amount
+    return {
+        'user': participant,
+        'owes': owes,
+        'owed_by': owed_by,
+        'net': {counterparty: round(float(amount), 2) for counterparty, amount in net.items()},
+    }
+
+class UserBalanceApi(APIView):
+    """ Allows the user to view what they owe and are owed by every participant, over all occasions and standalone events.
+    
+    A positive net means the counterparty owes the user. The balances are read from PairBalance, one row per counterparty.
+    """
+    
+    permission_classes = [IsAuthenticated]
+    serializer_class = None
+    
+    def get(self, request, format=None):
+        username = request.user.username
+        return Response(balance_summary(username, PairBalance.counterparties(username)))
 
 class RegisterApi(generics.CreateAPIView):
     """ Registers a new user in the application. """
@@ -65,36 +111,146 @@ class LoginApi(generics.GenericAPIView):
         else:
             return Response({'message': 'Invalid Credentials'}, status.HTTP_401_UNAUTHORIZED)
                    
-class OccasionApi(generics.ListCreateAPIView):
+def parse_body(request):
+    """ Returns the JSON or form data of a plain django request, None when it can not be parsed. """
+    
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+    return request.POST
+
+def busy_response(error):
+    response = JsonResponse(error.detail, status=error.status_code)
+    response['Retry-After'] = '1'
+    return response
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncRegisterApi(View):
+    """ Registers a new user like RegisterApi, the password is hashed on the hashing pool instead of the worker. """
+    
+    async def post(self, request):
+        data = parse_body(request)
+        if data is None:
+            return JsonResponse({'detail': 'JSON parse error'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = RegisterSerializer(data=data)
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            password_hash = await hashing_pool.run(make_password, serializer.validated_data['password'])
+        except HashingBusy as error:
+            return busy_response(error)
+        await sync_to_async(serializer.save)(password_hash=password_hash)
+        return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+    
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncLoginApi(View):
+    """ Logs in a registered user like LoginApi, the password is checked on the hashing pool instead of the worker. """
+    
+    async def post(self, request):
+        data = parse_body(request)
+        if data is None:
+            return JsonResponse({'detail': 'JSON parse error'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = LoginSerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        username = serializer.validated_data.get('username')
+        password = serializer.validated_data.get('password')
+        
+        try:
+            user = await User.objects.filter(username=username).afirst()
+            if user is None:
+                # hashing anyway, like ModelBackend, so unknown usernames take as long as wrong passwords.
+                await hashing_pool.run(make_password, password)
+                valid = False
+            else:
+                valid, upgrade = await hashing_pool.run(verify_password, password, user.password)
+                if valid and upgrade:
+                    password_hash = await hashing_pool.run(make_password, password)
+                    await User.objects.filter(pk=user.pk).aupdate(password=password_hash)
+        except HashingBusy as error:
+            return busy_response(error)
+        
+        if valid and user.is_active:
+            return JsonResponse(get_tokens_for_user(user), status=status.HTTP_202_ACCEPTED)
+        return JsonResponse({'message': 'Invalid Credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+                   
+class RowListMixin:
+    """ Lists a page of QuerySet.values() rows turned into the representation of serializer_class by rows.py.
+    
+    The rows skip the per field machinery of the serializers, which is only used to validate and create.
+    """
+    
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_row_queryset())
+        return self.get_paginated_response(self.build_rows(page))
+        
+class OccasionApi(RowListMixin, generics.ListCreateAPIView):
     """ Allows the user to create and view the occasion. """
     
-    authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = PrimaryKeyCursorPagination
     serializer_class = OccasionSerializer 
     
     def get_queryset(self):
-        return Occasion.objects.filter(created_by=self.request.user)
+        # prefetching the events keeps the listing at a constant number of queries,
+        # the reverse relation also populates event.occasion so no extra lookup happens per event.
+        return Occasion.objects.filter(created_by=self.request.user).prefetch_related('event_occasions__shares')
+        
+    def get_row_queryset(self):
+        return occasion_values(Occasion.objects.filter(created_by=self.request.user))
+    
+    def build_rows(self, rows):
+        return occasion_list(rows)
+    
+    async def abuild_rows(self, rows):
+        return await aoccasion_list(rows)
         
     def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user)  
+        retry_on_locked(lambda: serializer.save(created_by=self.request.user))
         
-class EventApi(generics.ListCreateAPIView):
+class EventApi(RowListMixin, generics.ListCreateAPIView):
     """ Allows the user to create and view the event and tag it to occasion (optional). """
     
-    authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = PrimaryKeyCursorPagination
     serializer_class =  EventSerializer 
     
     def get_queryset(self):
-        return Event.objects.filter(created_by=self.request.user)
+        return Event.objects.filter(created_by=self.request.user).select_related('occasion').prefetch_related('shares')
+        
+    def get_row_queryset(self):
+        return event_values(Event.objects.filter(created_by=self.request.user))
+    
+    def build_rows(self, rows):
+        return event_list(rows)
+    
+    async def abuild_rows(self, rows):
+        return await aevent_list(rows)
         
     def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user)
+        retry_on_locked(lambda: serializer.save(created_by=self.request.user))
+        
+class EventBulkApi(generics.CreateAPIView):
+    """ Allows the user to create a list of events in one request. """
+    
+    permission_classes = [IsAuthenticated]
+    serializer_class = BulkEventSerializer
+    
+    def get_serializer(self, *args, **kwargs):
+        kwargs['many'] = True
+        return super().get_serializer(*args, **kwargs)
+    
+    def perform_create(self, serializer):
+        retry_on_locked(lambda: serializer.save(created_by=self.request.user))
         
 class ExpenseApi(APIView):
     """ Allows the user to clear the expense. """
     
-    authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
     serializer_class = None
     
@@ -107,9 +263,11 @@ class ExpenseApi(APIView):
             return Response({'message': 'User and Event are required.'}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            event = Event.objects.get(description=event_name)
+            event = resolve(Event.objects.all(), event_name)
         except Event.DoesNotExist:
             return Response({'message': 'Provided event does not exist.'}, status=status.HTTP_404_NOT_FOUND)
+        except Event.MultipleObjectsReturned:
+            return Response({'message': f'Multiple events found with name: {event_name}.'}, status=status.HTTP_400_BAD_REQUEST)
         
         if event.clear_expense(user_name, split_amount):
             return Response({
@@ -122,14 +280,241 @@ class ExpenseApi(APIView):
             "updated_expense": event.expense_split
         }, status=status.HTTP_404_NOT_FOUND)
             
+class ExpenseBatchApi(generics.GenericAPIView):
+    """ Allows the user to clear many expenses in one request. """
+    
+    permission_classes = [IsAuthenticated]
+    serializer_class = ExpenseBatchSerializer
+    
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        all_or_nothing = serializer.validated_data['mode'] == 'all_or_nothing'
+        results, saved = Event.clear_expenses(serializer.validated_data['entries'], all_or_nothing=all_or_nothing)
+        
+        response_status = status.HTTP_400_BAD_REQUEST if all_or_nothing and not saved else status.HTTP_200_OK
+        return Response({
+            "cleared": sum(result['cleared'] for result in results),
+            "results": results
+        }, status=response_status)
+            
+def summary_headers(occasion, name):
+    """ The strong etag of a view of the occasion and the headers it is served with. """
+    
+    etag = f'"{name}-{occasion.pk}-v{occasion.summary_version}"'
+    return etag, {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+
+def is_not_modified(request, etag):
+    if_none_match = request.headers.get('If-None-Match', '')
+    return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+def versioned_response(request, occasion, name, compute):
+    """ Serves a view of the occasion cached under its summary version, with a strong etag for conditional requests. """
+    
+    etag, headers = summary_headers(occasion, name)
+    
+    # the version changes with every event or cleared expense, so a matching etag needs no recomputation.
+    if is_not_modified(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    summary_cache = caches[settings.SPLIT_IT_SUMMARY_CACHE]
+    cache_key = f'{name}:{occasion.pk}:{occasion.summary_version}'
+    data = summary_cache.get(cache_key)
+    if data is None:
+        data = compute()
+        summary_cache.set(cache_key, data)
+        
+    return Response(data, status=status.HTTP_200_OK, headers=headers)
+
+async def aversioned_response(request, occasion, name, compute):
+    """ versioned_response for the async views, only a summary missing from the cache is computed on a thread. """
+    
+    etag, headers = summary_headers(occasion, name)
+    if is_not_modified(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    summary_cache = caches[settings.SPLIT_IT_SUMMARY_CACHE]
+    cache_key = f'{name}:{occasion.pk}:{occasion.summary_version}'
+    data = await summary_cache.aget(cache_key)
+    if data is None:
+        data = await sync_to_async(compute)()
+        await summary_cache.aset(cache_key, data)
+        
+    return Response(data, status=status.HTTP_200_OK, headers=headers)
+    
 class OccasionSummaryApi(APIView):
     """ Allows the user to view the summary of the occasion. """
     
-    authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
     serializer_class = None
     
     def get(self, request, pk, format=None):
-        occasion = Occasion.objects.get(pk=pk)
-        expenditure_summary = occasion.get_expenditure_summary()
-        return Response(expenditure_summary, status=status.HTTP_200_OK)
\ No newline at end of file
+        occasion = get_object_or_404(Occasion, pk=pk)
+        return versioned_response(request, occasion, 'occasion-summary', occasion.get_ledger_summary)
+    
+class OccasionSettlePlanApi(APIView):
+    """ Allows the user to view the fewest transfers that settle everyone in the occasion. """
+    
+    permission_classes = [IsAuthenticated]
+    serializer_class = None
+    
+    def get(self, request, pk, format=None):
+        occasion = get_object_or_404(Occasion, pk=pk)
+        
+        def compute():
+            balances = occasion.get_balances()
+            return {
+                'occasion': occasion.description,
+                'balances': {participant: float(balance) for participant, balance in balances.items()},
+                'transfers': settle_plan(balances),
+            }
+        
+        return versioned_response(request, occasion, 'occasion-settle-plan', compute)
+
+class OccasionExportApi(APIView):
+    """ Streams every event and cleared expense of an occasion of the user as NDJSON (?format=ndjson) or CSV (?format=csv). """
+    
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+    serializer_class = None
+    
+    def get(self, request, pk, format=None):
+        # only the creator of the occasion can export it, to everyone else it does not exist.
+        if not Occasion.objects.filter(pk=pk, created_by=request.user).exists():
+            return Response({'message': 'Provided occasion does not exist.'}, status=status.HTTP_404_NOT_FOUND)
+        
+        # the rows are read in chunks while the response is written, so memory does not grow with the occasion.
+        compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+        export_format = request.accepted_renderer.format
+        response = StreamingHttpResponse(export_stream(pk, export_format, compress), content_type=request.accepted_renderer.media_type)
+        response['Content-Disposition'] = f'attachment; filename="occasion-{pk}.{export_format}"'
+        response['Vary'] = 'Accept-Encoding'
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        return response
+    
+class ProfileListApi(APIView):
+    """ Allows an admin to list the stored request profiles, newest first. """
+    
+    permission_classes = [IsAdminUser]
+    serializer_class = None
+    
+    def get(self, request, format=None):
+        return Response(list_profiles(), status=status.HTTP_200_OK)
+    
+class ProfileDownloadApi(APIView):
+    """ Allows an admin to download a stored request profile, to be read with pstats or snakeviz. """
+    
+    permission_classes = [IsAdminUser]
+    serializer_class = None
+    
+    def get(self, request, name, format=None):
+        path = profile_path(name)
+        if path is None or not os.path.isfile(path):
+            return Response({'message': 'Provided profile does not exist.'}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=name, content_type='application/octet-stream')
+    
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    """ Serves the GET requests of sync_view natively on the event loop, every other method goes to sync_view itself.
+    
+    An instance of sync_view does the content negotiation, permissions, throttling and rendering exactly as for a
+    sync request, only the authentication and the database reads are awaited so a single ASGI worker can keep many
+    reads in flight.
+    """
+    
+    sync_view = None
+    
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # the schema documents it as sync_view, both serve the same api.
+        view.cls = cls.sync_view
+        view.initkwargs = initkwargs
+        return view
+    
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return await sync_to_async(self.sync_view.as_view())(request, *args, **kwargs)
+        
+        api_view = self.sync_view()
+        api_view.setup(request, *args, **kwargs)
+        api_view.request = request = api_view.initialize_request(request, *args, **kwargs)
+        api_view.headers = api_view.default_response_headers
+        try:
+            await self.authenticate(request)
+            api_view.initial(request, *args, **kwargs) # the user is already set, so this needs no query
+            response = await self.get(api_view, request, *args, **kwargs)
+        except Exception as exc:
+            response = api_view.handle_exception(exc)
+        return api_view.finalize_response(request, response, *args, **kwargs)
+    
+    async def authenticate(self, request):
+        """ Request._authenticate with the async authenticate of the authenticators that have one. """
+        
+        for authenticator in request.authenticators:
+            try:
+                if hasattr(authenticator, 'aauthenticate'):
+                    user_auth_tuple = await authenticator.aauthenticate(request)
+                else:
+                    user_auth_tuple = await sync_to_async(authenticator.authenticate)(request)
+            except APIException:
+                request._not_authenticated()
+                raise
+            
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+        request._not_authenticated()
+        
+class AsyncListAPIView(AsyncAPIView):
+    """ The paginated list of a ListAPIView, with the page fetched by the async ORM. """
+    
+    async def get(self, api_view, request, *args, **kwargs):
+        if isinstance(api_view, RowListMixin):
+            page = await api_view.paginator.apaginate_queryset(api_view.get_row_queryset(), request, view=api_view)
+            return api_view.get_paginated_response(await api_view.abuild_rows(page))
+        
+        queryset = api_view.filter_queryset(api_view.get_queryset())
+        page = await api_view.paginator.apaginate_queryset(queryset, request, view=api_view)
+        serializer = api_view.get_serializer(page, many=True)
+        return api_view.get_paginated_response(serializer.data)
+        
+class AsyncUserApi(AsyncListAPIView):
+    """ UserApi served on the event loop. """
+    
+    sync_view = UserApi
+    
+class AsyncOccasionApi(AsyncListAPIView):
+    """ OccasionApi with its listing served on the event loop. """
+    
+    sync_view = OccasionApi
+    
+class AsyncEventApi(AsyncListAPIView):
+    """ EventApi with its listing served on the event loop. """
+    
+    sync_view = EventApi
+    
+class AsyncUserBalanceApi(AsyncAPIView):
+    """ UserBalanceApi served on the event loop. """
+    
+    sync_view = UserBalanceApi
+    
+    async def get(self, api_view, request, format=None):
+        username = request.user.username
+        return Response(balance_summary(username, [row async for row in PairBalance.counterparties(username)]))
+    
+class AsyncOccasionSummaryApi(AsyncAPIView):
+    """ OccasionSummaryApi served on the event loop. """
+    
+    sync_view = OccasionSummaryApi
+    
+    async def get(self, api_view, request, pk, format=None):
+        try:
+            occasion = await Occasion.objects.aget(pk=pk)
+        except Occasion.DoesNotExist:
+            raise Http404
+        return await aversioned_response(request, occasion, 'occasion-summary', occasion.get_ledger_summary)
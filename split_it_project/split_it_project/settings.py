@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import importlib.util
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -45,22 +47,65 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so the time it reports covers the other middleware as well.
+    'split_it_app.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'split_it_app.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 REST_FRAMEWORK = {
+    # CachedJWTAuthentication answers most requests without a query, set SPLIT_IT_AUTHENTICATION_CLASS to
+    # rest_framework_simplejwt.authentication.JWTAuthentication to load the user from the database on every request.
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        os.environ.get('SPLIT_IT_AUTHENTICATION_CLASS', 'split_it_app.authentication.CachedJWTAuthentication'),
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema', 
+    # the renderers report their rendering time to RequestMetricsMiddleware, JSON is encoded with orjson when it is
+    # installed and MessagePack (Accept: application/msgpack) is offered when msgpack is.
+    'DEFAULT_RENDERER_CLASSES': (
+        'split_it_app.renderers.TimedORJSONRenderer',
+        *(['split_it_app.renderers.TimedMessagePackRenderer'] if importlib.util.find_spec('msgpack') else []),
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
+# directory the request histograms of every worker process are shared through for /metrics, a directory of its own
+# per deployment (e.g. on a tmpfs). Without it /metrics only exposes the histograms of the process answering it.
+SPLIT_IT_METRICS_DIR = os.environ.get('SPLIT_IT_METRICS_DIR', '')
+SPLIT_IT_METRICS_FLUSH_INTERVAL = float(os.environ.get('SPLIT_IT_METRICS_FLUSH_INTERVAL', 1.0))
+
+# requests of staff users sending an X-Profile header, and this fraction of all requests, are run under cProfile.
+# The newest SPLIT_IT_PROFILE_KEEP profiles are kept in the directory, listed and downloaded through profiles/.
+SPLIT_IT_PROFILE_DIR = os.environ.get('SPLIT_IT_PROFILE_DIR', BASE_DIR / 'profiles')
+SPLIT_IT_PROFILE_SAMPLE_RATE = float(os.environ.get('SPLIT_IT_PROFILE_SAMPLE_RATE', 0))
+SPLIT_IT_PROFILE_KEEP = int(os.environ.get('SPLIT_IT_PROFILE_KEEP', 50))
+
+# default page size of the cursor paginated lists and the upper bound for their page_size query parameter.
+SPLIT_IT_PAGE_SIZE = int(os.environ.get('SPLIT_IT_PAGE_SIZE', 50))
+SPLIT_IT_MAX_PAGE_SIZE = int(os.environ.get('SPLIT_IT_MAX_PAGE_SIZE', 500))
+
+# names of the split_it_app routes served by their native async views, e.g. occasion-view-create,occasion-summary,
+# or * for all of them (get_users, occasion-view-create, event-view-create and occasion-summary have one).
+SPLIT_IT_ASYNC_ROUTES = set(filter(None, os.environ.get('SPLIT_IT_ASYNC_ROUTES', '').split(',')))
+
+# no of rows the occasion export reads from the database at a time.
+SPLIT_IT_EXPORT_CHUNK_SIZE = int(os.environ.get('SPLIT_IT_EXPORT_CHUNK_SIZE', 2000))
+
+# maximum no of events accepted by a single request to event/bulk/.
+SPLIT_IT_MAX_BULK_EVENTS = int(os.environ.get('SPLIT_IT_MAX_BULK_EVENTS', 1000))
+
+# settlements that lose a concurrent update of an event are retried this many times, backing off
+# exponentially (in seconds) up to the maximum, before answering 409.
+SPLIT_IT_CONFLICT_RETRIES = int(os.environ.get('SPLIT_IT_CONFLICT_RETRIES', 20))
+SPLIT_IT_CONFLICT_BACKOFF = float(os.environ.get('SPLIT_IT_CONFLICT_BACKOFF', 0.002))
+SPLIT_IT_CONFLICT_MAX_BACKOFF = float(os.environ.get('SPLIT_IT_CONFLICT_MAX_BACKOFF', 0.1))
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
@@ -100,6 +145,82 @@ DATABASES = {
     }
 }
 
+# SPLIT_IT_DATABASE_PROFILE=production tunes sqlite for concurrent requests: SPLIT_IT_SQLITE_PRAGMAS are applied to
+# every new connection (write ahead logging so readers never block the writer, fsync only at checkpoints, a memory
+# mapped file and a larger page cache, and waiting up to busy_timeout ms for a busy writer), connections are kept
+# open for CONN_MAX_AGE seconds and checked before reuse, and transactions take the write lock when they begin so
+# they wait on the busy timeout instead of failing with "database is locked" when upgrading from a read.
+SPLIT_IT_DATABASE_PROFILE = os.environ.get('SPLIT_IT_DATABASE_PROFILE', 'development')
+SPLIT_IT_SQLITE_PRODUCTION_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024, # in KiB when negative
+    'busy_timeout': int(os.environ.get('SPLIT_IT_SQLITE_BUSY_TIMEOUT', 5000)),
+}
+SPLIT_IT_SQLITE_PRAGMAS = {}
+
+if SPLIT_IT_DATABASE_PROFILE == 'production':
+    SPLIT_IT_SQLITE_PRAGMAS = SPLIT_IT_SQLITE_PRODUCTION_PRAGMAS
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.environ.get('SPLIT_IT_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': SPLIT_IT_SQLITE_PRODUCTION_PRAGMAS['busy_timeout'] / 1000},
+    })
+
+
+# SPLIT_IT_REPLICA_DATABASE is the path of a sqlite copy of the database (kept in sync by manage.py sync_replica) that
+# serves the reads. Reads stay on the primary inside transactions, in requests that write, for SPLIT_IT_REPLICA_PIN_SECONDS
+# after a client wrote (through a cookie, and for authenticated users through SPLIT_IT_REPLICA_PIN_CACHE) and while the
+# heartbeat on the replica is older than SPLIT_IT_REPLICA_MAX_LAG seconds.
+SPLIT_IT_REPLICA_DATABASE = os.environ.get('SPLIT_IT_REPLICA_DATABASE', '')
+SPLIT_IT_REPLICA_ALIAS = 'replica'
+SPLIT_IT_REPLICA_MAX_LAG = float(os.environ.get('SPLIT_IT_REPLICA_MAX_LAG', 5.0))
+SPLIT_IT_REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('SPLIT_IT_REPLICA_LAG_CHECK_INTERVAL', 1.0))
+SPLIT_IT_REPLICA_PIN_SECONDS = int(os.environ.get('SPLIT_IT_REPLICA_PIN_SECONDS', 10))
+
+if SPLIT_IT_REPLICA_DATABASE:
+    DATABASES[SPLIT_IT_REPLICA_ALIAS] = {**DATABASES['default'], 'NAME': SPLIT_IT_REPLICA_DATABASE, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_ROUTERS = ['split_it_app.routers.ReplicaRouter']
+    MIDDLEWARE.insert(MIDDLEWARE.index('split_it_app.metrics.RequestMetricsMiddleware') + 1, 'split_it_app.routers.ReplicaPinningMiddleware')
+
+
+# Caches
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# The occasion summaries are cached per (occasion, version), the backend can be swapped per deployment,
+# e.g. SPLIT_IT_SUMMARY_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache with a redis:// location.
+# The local memory backend evicts the least recently used entries beyond MAX_ENTRIES.
+
+SUMMARY_CACHE_BACKEND = os.environ.get('SPLIT_IT_SUMMARY_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # the state of authenticated users, dropped on every change of the user and expired after the timeout
+    # so other processes never trust a deactivated user for longer than that.
+    'auth': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'split-it-auth',
+        'TIMEOUT': int(os.environ.get('SPLIT_IT_AUTH_CACHE_TIMEOUT', 60)),
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('SPLIT_IT_AUTH_CACHE_MAX_ENTRIES', 10000))},
+    },
+    'summaries': {
+        'BACKEND': SUMMARY_CACHE_BACKEND,
+        'LOCATION': os.environ.get('SPLIT_IT_SUMMARY_CACHE_LOCATION', 'split-it-summaries'),
+        'TIMEOUT': int(os.environ.get('SPLIT_IT_SUMMARY_CACHE_TIMEOUT', 300)),
+    },
+}
+
+if SUMMARY_CACHE_BACKEND.endswith('LocMemCache'):
+    CACHES['summaries']['OPTIONS'] = {'MAX_ENTRIES': int(os.environ.get('SPLIT_IT_SUMMARY_CACHE_MAX_ENTRIES', 10000))}
+
+SPLIT_IT_SUMMARY_CACHE = 'summaries'
+SPLIT_IT_AUTH_CACHE = 'auth'
+# the users pinned to the primary after a write, it has to be shared by all the processes (e.g. a redis summaries cache)
+# for a pin to follow the user from one worker to another.
+SPLIT_IT_REPLICA_PIN_CACHE = SPLIT_IT_SUMMARY_CACHE
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -120,6 +241,27 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# https://docs.djangoproject.com/en/3.2/topics/auth/passwords/
+# The pbkdf2 iterations can be tuned per deployment, hashes made with another count keep working and are upgraded
+# on the next login. Argon2 or bcrypt can be put first through SPLIT_IT_PASSWORD_HASHERS when they are installed.
+
+SPLIT_IT_PBKDF2_ITERATIONS = int(os.environ.get('SPLIT_IT_PBKDF2_ITERATIONS', 870000))
+
+PASSWORD_HASHERS = os.environ.get('SPLIT_IT_PASSWORD_HASHERS', ','.join([
+    'split_it_app.hashing.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+])).split(',')
+
+# the async login and register endpoints hash on a pool of this many thread (or process) workers, with at most
+# SPLIT_IT_HASHING_QUEUE more requests waiting before they are answered 503.
+SPLIT_IT_HASHING_WORKERS = int(os.environ.get('SPLIT_IT_HASHING_WORKERS', os.cpu_count() or 1))
+SPLIT_IT_HASHING_QUEUE = int(os.environ.get('SPLIT_IT_HASHING_QUEUE', 32))
+SPLIT_IT_HASHING_EXECUTOR = os.environ.get('SPLIT_IT_HASHING_EXECUTOR', 'thread')
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
 